@@ -11,16 +11,21 @@ import os
 
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import elearning_platform.routing  # Import your routing module
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'elearning.settings')
+django_asgi_app = get_asgi_application()
+
+import elearning_platform.routing  # Import your routing module
+# websocket users are resolved through a per-process session cache
+from elearning_platform.websocket_auth import CachedAuthMiddlewareStack
+# refusing sockets over the process' connection and handshake limits
+from elearning_platform.throttling import AdmissionMiddleware
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    "websocket": AdmissionMiddleware(CachedAuthMiddlewareStack(
         URLRouter(
             elearning_platform.routing.websocket_urlpatterns
         )
-    ),
+    )),
 })
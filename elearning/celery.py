@@ -0,0 +1,21 @@
+"""
+Celery config for elearning project.
+
+It exposes the Celery app used to run background tasks (notification
+delivery and material post-processing). Start a worker with
+``celery -A elearning worker``; post-processing of new materials is only
+queued when CELERY_BROKER_URL is set.
+
+For more information on this file, see
+https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'elearning.settings')
+
+app = Celery('elearning')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
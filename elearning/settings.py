@@ -68,6 +68,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'elearning_platform.context_processors.unread_notifications_count',
+                'elearning_platform.context_processors.fragment_cache',
             ],
         },
     },
@@ -125,13 +126,37 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = [BASE_DIR / 'elearning_platform/static']
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 STATIC_ROOT = BASE_DIR / 'elearning_platform/staticfiles'
 
 # Material file uploads
+# material files are stored once per content (Material.material_path uses
+# elearning_platform/storage.py), other files by name
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Material downloads
+# files are only served through the authenticated download view; set the
+# offload mode to 'x-accel-redirect' (nginx, internal location at the
+# prefix mapped to MEDIA_ROOT) or 'x-sendfile' (Apache, lighttpd) to let the
+# front proxy send them
+MATERIAL_DOWNLOAD_OFFLOAD = None
+MATERIAL_DOWNLOAD_ACCEL_PREFIX = '/protected-media/'
+
+# Material post-processing (see elearning_platform/processing.py)
+MATERIAL_PROCESSING_WORKERS = 2
+MATERIAL_MANIFEST_ENTRIES = 500
+MATERIAL_TEXT_MAX_LENGTH = 100000
+MATERIAL_THUMBNAIL_SIZE = 256
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -149,3 +174,105 @@ CHANNEL_LAYERS = {
         },
     }
 }
+
+# number of students notified per batch when course material is added
+NOTIFICATION_FANOUT_BATCH_SIZE = 500
+
+# background task queue (notification delivery)
+# without a broker url tasks run eagerly in-process (development and tests);
+# material post-processing is then not queued at all and only runs through
+# `manage.py process_materials`, so production needs a broker
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', '')
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# seconds a user's group names stay cached between requests (0 disables)
+ROLE_CACHE_TIMEOUT = 300
+
+# cache shared by the roles and the rendered page fragments
+# set CACHE_URL (e.g. redis://127.0.0.1:6379/1) so that every worker sees
+# the same fragment versions; without it each process keeps its own
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# seconds rendered fragments are kept (they are invalidated by version
+# counters, this only ages out unused ones)
+FRAGMENT_CACHE_TIMEOUT = 3600
+
+# seconds the serialized data of an API object version stays cached
+API_CACHE_TIMEOUT = 300
+
+# API responses are rendered with orjson when it is installed
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'elearning_platform.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# rows per page of the course / enrollment / feedback / notification lists
+LISTING_PAGE_SIZE = 20
+
+# live chat: recent messages sent to users joining a room, and how
+# buffered messages are written (every N messages or every N seconds)
+CHAT_HISTORY_ON_CONNECT = True
+CHAT_HISTORY_SIZE = 50
+CHAT_FLUSH_BATCH_SIZE = 50
+CHAT_FLUSH_INTERVAL = 2.0
+
+# live chat flow control: messages per second (and burst) a socket may send,
+# largest accepted frame in characters, frames queued for a slow receiver
+CHAT_RATE_LIMIT = 5
+CHAT_RATE_BURST = 10
+CHAT_MAX_MESSAGE_SIZE = 4096
+CHAT_OUTBOUND_QUEUE_SIZE = 100
+
+# websocket admission, per process: open sockets, handshakes per second
+# (and burst), seconds refused clients are told to wait (when full, and at
+# most)
+WS_MAX_CONNECTIONS = 10000
+WS_HANDSHAKE_RATE = 200
+WS_HANDSHAKE_BURST = 400
+WS_RETRY_DELAY = 5
+WS_RETRY_MAX_DELAY = 60
+
+# topics (notifications, chat rooms) one multiplexed socket may subscribe to
+WS_MAX_SUBSCRIPTIONS = 20
+
+# websocket heartbeat: seconds between pings (0 disables them) and pings
+# a socket may leave unanswered before it is closed
+WS_HEARTBEAT_INTERVAL = 30
+WS_HEARTBEAT_MISSES = 2
+
+# websocket handshakes: sessions whose user is kept per process (0 disables
+# it) and seconds before a cached user is read again
+WS_AUTH_CACHE_SIZE = 10000
+WS_AUTH_CACHE_TTL = 60
+
+# largest number of users returned by the user search API
+USER_SEARCH_LIMIT = 20
+# per-process cache of recent user searches: number of queries kept (0
+# disables it) and seconds before changes made by other processes show up
+USER_SEARCH_CACHE_SIZE = 5000
+USER_SEARCH_CACHE_TTL = 60
+
+# chunked material uploads: bytes per chunk, largest file, accepted
+# extensions, seconds before unfinished uploads are purged
+MATERIAL_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+MATERIAL_UPLOAD_MAX_SIZE = 500 * 1024 * 1024
+MATERIAL_UPLOAD_EXTENSIONS = [
+    'pdf', 'zip', 'docx', 'pptx', 'xlsx', 'txt', 'png', 'jpg', 'jpeg']
+MATERIAL_UPLOAD_EXPIRY = 24 * 60 * 60
@@ -1,13 +1,20 @@
 from .models import *
 from .serializers import *
 from elearning_platform.permissions import *
-from django.core.files.storage import default_storage
+from .roles import has_role, get_user_roles
+from .pagination import KeysetCursorPagination
+from .conditional import ConditionalRetrieveMixin, ConditionalListMixin
+from .projections import ProjectedListMixin
+from .fragments import get_course_version
+from .notifications import mark_all_read
+from .throttling import ws_counters, get_connection_admission
+from .search import SEARCH_ROLES, get_search_limit, cached_search_users
+from .uploads import UploadRejected, start_upload, store_chunk, finalize_upload
 from rest_framework import status, mixins, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
 
 
 # teacher: add new course
@@ -20,7 +27,7 @@ class AddCourseAPI(mixins.CreateModelMixin,
 
     def post(self, request, *args, **kwargs):
         # checking if user is a 'teacher'
-        if not request.user.groups.filter(name='teacher').exists():
+        if not has_role(request.user, 'teacher'):
             return Response({"detail": "You are not authorized to add courses."}, status=status.HTTP_403_FORBIDDEN)
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -32,7 +39,8 @@ class AddCourseAPI(mixins.CreateModelMixin,
 # teacher: delete course
 
 
-class DeleteCourseAPI(mixins.RetrieveModelMixin,
+class DeleteCourseAPI(ConditionalRetrieveMixin,
+                      mixins.RetrieveModelMixin,
                       mixins.DestroyModelMixin,
                       generics.GenericAPIView):
     # check the user is logged and has enrollmentId
@@ -49,7 +57,8 @@ class DeleteCourseAPI(mixins.RetrieveModelMixin,
 # teacher: delete uploaded course material
 
 
-class DeleteMaterialAPI(mixins.RetrieveModelMixin,
+class DeleteMaterialAPI(ConditionalRetrieveMixin,
+                        mixins.RetrieveModelMixin,
                         mixins.DestroyModelMixin,
                         generics.GenericAPIView):
     # check the user is logged and has enrollmentId
@@ -61,15 +70,13 @@ class DeleteMaterialAPI(mixins.RetrieveModelMixin,
         return self.retrieve(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
-        material = self.get_object()
-        material_path = material.material_path.path
-        if default_storage.exists(material_path):
-            default_storage.delete(material_path)
-
+        # the file may be shared with materials of the same content, it is
+        # unlinked with the last of them (signals.py)
         return self.destroy(request, *args, **kwargs)
 
 
-class UnEnrollCourseAPI(mixins.RetrieveModelMixin,
+class UnEnrollCourseAPI(ConditionalRetrieveMixin,
+                        mixins.RetrieveModelMixin,
                         mixins.DestroyModelMixin,
                         generics.GenericAPIView):
     # check the user is logged in and is student
@@ -93,27 +100,18 @@ class UserSearchAPI(APIView):
         query = request.query_params.get('query', None)
         group_filter = request.query_params.get('group', None)
         if query:
-            # filter users based on key word and only in 'student'  and 'teacher' groups
-            matching_users = User.objects.filter(
-                Q(username__icontains=query) |
-                Q(first_name__icontains=query) |
-                Q(last_name__icontains=query),
-                groups__name__in=['student', 'teacher']
-            ).distinct()
-            # applying group filter
-            if group_filter in ['student', 'teacher']:
-                matching_users = matching_users.filter(
-                    groups__name=group_filter)
-            # collect list of user matching search and return it as a response
-            users_data = [
-                {
-                    "username": user.username,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "id": user.id,
-                    "group": user.groups.values_list('name', flat=True).first()
-                } for user in matching_users
-            ]
+            # ranked prefix search over students and teachers, optionally
+            # of one group, at most USER_SEARCH_LIMIT results
+            # repeated prefixes are answered from the in-process cache
+            limit = get_search_limit()
+            try:
+                limit = min(int(request.query_params['limit']), limit)
+            except (KeyError, ValueError):
+                pass
+            users_data = cached_search_users(
+                query,
+                group_filter if group_filter in SEARCH_ROLES else None,
+                max(limit, 1))
             return Response(users_data, status=status.HTTP_200_OK)
         else:
             return Response({"error": "No search query provided."}, status=status.HTTP_400_BAD_REQUEST)
@@ -121,7 +119,8 @@ class UserSearchAPI(APIView):
 # teacher: remove student from course
 
 
-class RemoveStudentFromCourseAPI(mixins.RetrieveModelMixin,
+class RemoveStudentFromCourseAPI(ConditionalRetrieveMixin,
+                                 mixins.RetrieveModelMixin,
                                  mixins.DestroyModelMixin,
                                  generics.GenericAPIView):
     # check the user is logged and has enrollmentId
@@ -162,9 +161,8 @@ class MarkNotificationsRead(APIView):
 
     def post(self, request, *args, **kwargs):
         # Update all unread notifications for the user to is_read=True
-        notifications = Notification.objects.filter(
-            user=request.user, is_read=False)
-        notifications.update(is_read=True)
+        # (the unread counter is lowered in the same transaction)
+        mark_all_read(request.user.id)
 
         return Response({'message': 'All notifications marked as read.'}, status=200)
 
@@ -233,3 +231,161 @@ class UpdateUserStatusAPI(APIView):
             serializer.save()
             return Response({"message": "Status updated successfully.", "status": serializer.data['status']}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+"""
+Paginated list endpoints
+"""
+# newest first, one keyset page per request (?cursor=<next cursor>)
+# course, enrollment and feedback lists answer If-None-Match with a 304
+# (see conditional.py); rows are serialized from values() without building
+# model instances (see projections.py)
+
+# student & teacher: list courses
+
+
+class CourseListAPI(ConditionalListMixin, ProjectedListMixin,
+                    generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = CourseSerializer
+    pagination_class = KeysetCursorPagination
+    ordering_field = 'created_at'
+
+    def get_queryset(self):
+        return Course.objects.all()
+
+# student: list own enrollments
+
+
+class EnrollmentListAPI(ConditionalListMixin, ProjectedListMixin,
+                        generics.ListAPIView):
+    permission_classes = [IsAuthenticated, IsStudent]
+    serializer_class = EnrollmentSerializer
+    pagination_class = KeysetCursorPagination
+    ordering_field = 'enrolled_at'
+
+    def get_queryset(self):
+        return Enrollment.objects.filter(student=self.request.user)
+
+# student & teacher: list course feedback (students only see their own)
+
+
+class CourseFeedbackListAPI(ConditionalListMixin, ProjectedListMixin,
+                            generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = FeedbackListSerializer
+    pagination_class = KeysetCursorPagination
+    ordering_field = 'sent_at'
+
+    # what a user sees depends on their roles
+    def get_list_version(self):
+        return (get_course_version(self.kwargs['pk']),
+                sorted(get_user_roles(self.request.user)))
+
+    def get_queryset(self):
+        feedbacks = Feedback.objects.filter(course_id=self.kwargs['pk'])
+        if has_role(self.request.user, 'teacher'):
+            return feedbacks
+        if has_role(self.request.user, 'student'):
+            return feedbacks.filter(user=self.request.user)
+        return feedbacks.none()
+
+# student & teacher: list own notifications (?is_read=true|false)
+
+
+class NotificationListAPI(ProjectedListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = NotificationSerializer
+    pagination_class = KeysetCursorPagination
+    ordering_field = 'created_at'
+
+    def get_queryset(self):
+        notifications = Notification.objects.filter(user=self.request.user)
+        is_read = self.request.query_params.get('is_read')
+        if is_read in ('true', 'false'):
+            notifications = notifications.filter(is_read=is_read == 'true')
+        return notifications
+
+# student & teacher: stored messages of a chat room
+
+
+class ChatHistoryListAPI(ProjectedListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ChatSerializer
+    pagination_class = KeysetCursorPagination
+    ordering_field = 'sent_at'
+
+    def get_queryset(self):
+        return Chat.objects.filter(room=self.kwargs['room_name'])
+
+# staff: websocket frame and connection counters of this process
+
+
+class WebSocketStatsAPI(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({**ws_counters,
+                         'open_connections': get_connection_admission().open})
+
+# teacher: chunked material upload
+# init -> put chunk N (any order, repeatable) -> finalize
+
+
+class MaterialUploadStartAPI(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def post(self, request, *args, **kwargs):
+        serializer = MaterialUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = start_upload(
+                serializer.validated_data['course'], request.user,
+                serializer.validated_data['file_name'],
+                serializer.validated_data['size'])
+        except UploadRejected as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(MaterialUploadSerializer(upload).data,
+                        status=status.HTTP_201_CREATED)
+
+# manifest of an upload, used to resume it
+
+
+class MaterialUploadAPI(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(
+            MaterialUpload, upload_id=upload_id, creator=request.user)
+        return Response(MaterialUploadSerializer(upload).data)
+
+
+class MaterialUploadChunkAPI(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def put(self, request, upload_id, index):
+        upload = get_object_or_404(
+            MaterialUpload, upload_id=upload_id, creator=request.user)
+        try:
+            # the raw body is streamed to storage, never parsed
+            chunk = store_chunk(upload, index, request.stream)
+        except UploadRejected as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'index': chunk.index, 'size': chunk.size,
+                         'sha256': chunk.sha256}, status=status.HTTP_200_OK)
+
+
+class MaterialUploadFinalizeAPI(APIView):
+    permission_classes = [IsAuthenticated, IsTeacher]
+
+    def post(self, request, upload_id):
+        upload = get_object_or_404(
+            MaterialUpload, upload_id=upload_id, creator=request.user)
+        try:
+            material = finalize_upload(upload, request.data.get('sha256'))
+        except UploadRejected as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(MaterialSerializer(
+            material, context={'request': request}).data,
+                        status=status.HTTP_201_CREATED)
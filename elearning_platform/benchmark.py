@@ -0,0 +1,490 @@
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import deque
+import django
+from .models import *
+from .model_factories import *
+from .notifications import rebuild_unread_counters, _group_send_many
+from .routing import websocket_urlpatterns
+from .search import rebuild_search_index
+from .catalog import rebuild_course_catalog
+from .consumers import ChatConsumer, chat_event, frame_text
+from .projections import get_field_plan, project_queryset, serialize_rows
+from .renderers import FastJSONRenderer, orjson
+from .serializers import CourseSerializer, EnrollmentSerializer, NotificationSerializer
+from .throttling import OutboundQueue, ws_counters
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+
+"""
+Benchmark harness
+"""
+# seeds a database with realistic volumes, then times the hot pages, the
+# REST API, material upload (with notification fan-out) and the websocket
+# consumers. Results are a JSON-serializable dict, so runs on different
+# commits can be compared. Run through 'manage.py benchmark', which uses a
+# throwaway test database.
+
+DEFAULT_SCALE = {
+    'users': 50000,
+    'courses': 2000,
+    'enrollments_per_course': 25,
+    'fanout': 5000,
+    'notifications': 1000000,
+    'requests': 20,
+    'clients': 200,
+    'messages': 20,
+    'serialize_rows': 10000,
+    'room_sizes': (10, 100, 1000),
+}
+
+SEED_BATCH_SIZE = 5000
+BENCHMARK_PASSWORD = 'password'
+# every N-th seeded user is a teacher
+TEACHER_EVERY = 25
+
+# inserting rows produced by 'make_row(i)' in batches
+
+
+def bulk_insert(model, count, make_row, batch_size=SEED_BATCH_SIZE):
+    for start in range(0, count, batch_size):
+        model.objects.bulk_create(
+            [make_row(i) for i in range(start, min(start + batch_size, count))])
+
+
+# seeding users, courses, enrollments, materials, feedback and notifications
+# factories build the rows (Faker values are drawn from small pools to keep
+# 1M rows cheap), bulk_create inserts them without per-row signals
+
+
+def seed_database(users, courses, enrollments_per_course, fanout,
+                  notifications, seed=0):
+    rng = random.Random(seed)
+    timings = {}
+    password = make_password(BENCHMARK_PASSWORD)
+    sentences = [fake.sentence() for _ in range(200)]
+    paragraphs = [fake.paragraph() for _ in range(50)]
+
+    started = time.perf_counter()
+    bulk_insert(User, users, lambda i: UserFactory.build(
+        username=f'bench_user_{i}', password=password))
+    user_ids = list(User.objects.filter(
+        username__startswith='bench_user_').order_by('pk').values_list(
+            'pk', flat=True))
+    bulk_insert(AppUser, len(user_ids), lambda i: AppUser(
+        user_id=user_ids[i], bio=rng.choice(paragraphs),
+        status=rng.choice(sentences)))
+    teacher_group, _ = Group.objects.get_or_create(name='teacher')
+    student_group, _ = Group.objects.get_or_create(name='student')
+    teacher_ids = user_ids[::TEACHER_EVERY]
+    student_ids = [user_id for i, user_id in enumerate(user_ids)
+                   if i % TEACHER_EVERY]
+    bulk_insert(User.groups.through, len(user_ids), lambda i: (
+        User.groups.through(
+            user_id=user_ids[i],
+            group=teacher_group if i % TEACHER_EVERY == 0 else student_group)))
+    rebuild_search_index()
+    timings['users'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bulk_insert(Course, courses, lambda i: CourseFactory.build(
+        creator=User(pk=teacher_ids[i % len(teacher_ids)]),
+        title=f'Benchmark course {i}', description=rng.choice(paragraphs)))
+    course_ids = list(Course.objects.order_by('pk').values_list(
+        'pk', flat=True))
+    # the first course is the 'hot' one: many students, detail page, uploads
+    enrollments = [(course_ids[0], student_id)
+                   for student_id in student_ids[:fanout]]
+    for course_id in course_ids[1:]:
+        enrollments += [(course_id, student_id) for student_id in rng.sample(
+            student_ids, min(enrollments_per_course, len(student_ids)))]
+    bulk_insert(Enrollment, len(enrollments), lambda i: Enrollment(
+        course_id=enrollments[i][0], student_id=enrollments[i][1]))
+    bulk_insert(Feedback, len(course_ids) * 5, lambda i: Feedback(
+        course_id=course_ids[i // 5], user_id=rng.choice(student_ids),
+        message=rng.choice(paragraphs)))
+    rebuild_course_catalog()
+    timings['courses'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # a tenth of the notifications belong to the first student
+    bulk_insert(Notification, notifications, lambda i: Notification(
+        user_id=student_ids[0] if i % 10 == 0 else rng.choice(student_ids),
+        course_id=rng.choice(course_ids), message=rng.choice(sentences),
+        is_read=rng.random() < 0.5))
+    rebuild_unread_counters()
+    timings['notifications'] = time.perf_counter() - started
+
+    return {
+        'rows': {
+            'users': len(user_ids),
+            'courses': len(course_ids),
+            'enrollments': len(enrollments),
+            'notifications': notifications,
+        },
+        'seconds': {name: round(value, 3) for name, value in timings.items()},
+        'teacher_id': teacher_ids[0],
+        'student_id': student_ids[0],
+        'course_id': course_ids[0],
+    }
+
+# summary of a list of durations in milliseconds
+
+
+def summarize(durations, **extra):
+    durations = sorted(duration * 1000 for duration in durations)
+    return {
+        'count': len(durations),
+        'min_ms': round(durations[0], 3),
+        'median_ms': round(statistics.median(durations), 3),
+        'p95_ms': round(durations[int(0.95 * (len(durations) - 1))], 3),
+        'max_ms': round(durations[-1], 3),
+        'mean_ms': round(statistics.fmean(durations), 3),
+        **extra,
+    }
+
+# timing 'repeat' calls of make_request(), with status and query count
+
+
+def time_requests(make_request, repeat):
+    durations = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = make_request()
+            durations.append(time.perf_counter() - started)
+    return summarize(durations, status=response.status_code,
+                     queries=len(queries))
+
+
+def login(user_id):
+    client = Client()
+    client.force_login(User.objects.get(pk=user_id))
+    return client
+
+
+def benchmark_http(seeded, repeat):
+    teacher = login(seeded['teacher_id'])
+    student = login(seeded['student_id'])
+    course_id = seeded['course_id']
+    course_detail = reverse('course_detail', kwargs={'pk': course_id})
+    search = reverse('api_search_users')
+    upload = reverse('upload_material')
+    uploads = iter(range(repeat))
+
+    def upload_material():
+        number = next(uploads)
+        return teacher.post(upload, {
+            'course_id': course_id,
+            'myfile': SimpleUploadedFile(
+                f'benchmark_{number}.pdf', b'%PDF-1.4 benchmark',
+                content_type='application/pdf'),
+        })
+
+    return {
+        'index_teacher': time_requests(
+            lambda: teacher.get(reverse('index')), repeat),
+        'index_student': time_requests(
+            lambda: student.get(reverse('index')), repeat),
+        'course_detail': time_requests(
+            lambda: teacher.get(course_detail), repeat),
+        'api_search_users': time_requests(
+            lambda: teacher.get(search, {'query': 'bench_user_1'}), repeat),
+        'user_notifications': time_requests(
+            lambda: student.get(reverse('user_notifications')), repeat),
+        'upload_material_fanout': time_requests(upload_material, repeat),
+    }
+
+# serializing 'rows' rows of the widest listings with their DRF serializer
+# and through the field plan of projections.py (query, serialization and
+# JSON rendering are timed together, best of 'rounds')
+
+
+def time_serialization(serialize, rounds):
+    durations = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        output = serialize()
+        durations.append(time.perf_counter() - started)
+    return min(durations), output
+
+
+def benchmark_serializers(rows, rounds=3):
+    listings = {
+        'courses': (CourseSerializer, Course.objects.order_by('-created_at')),
+        'enrollments': (EnrollmentSerializer,
+                        Enrollment.objects.order_by('-enrolled_at')),
+        'notifications': (NotificationSerializer,
+                          Notification.objects.order_by('-created_at')),
+    }
+    results = {}
+    for name, (serializer_class, queryset) in listings.items():
+        queryset = queryset[:rows]
+        plan = get_field_plan(serializer_class)
+
+        def drf():
+            return JSONRenderer().render(
+                serializer_class(list(queryset), many=True).data)
+
+        def projected():
+            return FastJSONRenderer().render(serialize_rows(
+                list(project_queryset(queryset, plan)), plan))
+
+        drf_seconds, drf_output = time_serialization(drf, rounds)
+        projected_seconds, projected_output = time_serialization(
+            projected, rounds)
+        count = queryset.count()
+        results[name] = {
+            'rows': count,
+            'drf_ms': round(drf_seconds * 1000, 3),
+            'projected_ms': round(projected_seconds * 1000, 3),
+            'drf_rows_per_second': round(count / drf_seconds),
+            'projected_rows_per_second': round(count / projected_seconds),
+            'speedup': round(drf_seconds / projected_seconds, 2),
+            'identical': drf_output == projected_output,
+        }
+    return results
+
+# websocket clients through the Channels test communicator
+
+
+def connect_clients(path, users):
+    application = URLRouter(websocket_urlpatterns)
+    communicators = []
+    for user in users:
+        communicator = WebsocketCommunicator(application, path)
+        communicator.scope['user'] = user
+        communicators.append(communicator)
+    return communicators
+
+
+async def receive_frames(communicator, count):
+    for _ in range(count):
+        await communicator.receive_from(timeout=30)
+
+# one room with 'clients' members, one of them sending 'messages' messages
+
+
+async def benchmark_chat(users, messages):
+    communicators = connect_clients('/ws/live_chat/benchmark/', users)
+    started = time.perf_counter()
+    await asyncio.gather(*[c.connect(timeout=30) for c in communicators])
+    connected = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for number in range(messages):
+        await communicators[0].send_json_to({'message': f'message {number}'})
+    await asyncio.gather(*[receive_frames(c, messages) for c in communicators])
+    delivered = time.perf_counter() - started
+
+    await asyncio.gather(*[c.disconnect() for c in communicators])
+    deliveries = len(communicators) * messages
+    return {
+        'clients': len(communicators),
+        'messages': messages,
+        'connect_all_ms': round(connected * 1000, 3),
+        'deliver_all_ms': round(delivered * 1000, 3),
+        'deliveries_per_second': round(deliveries / delivered, 1),
+        'dropped_frames': ws_counters['chat_dropped'],
+        'throttled_frames': ws_counters['chat_throttled'],
+    }
+
+# one notification socket per user, every user notified 'messages' times
+
+
+async def benchmark_notifications(users, messages):
+    communicators = connect_clients('/ws/notifications/', users)
+    started = time.perf_counter()
+    await asyncio.gather(*[c.connect(timeout=30) for c in communicators])
+    connected = time.perf_counter() - started
+
+    channel_layer = get_channel_layer()
+    started = time.perf_counter()
+    for number in range(messages):
+        await _group_send_many(channel_layer, [
+            (user.pk, f'notification {number}', number) for user in users])
+    await asyncio.gather(*[receive_frames(c, messages) for c in communicators])
+    delivered = time.perf_counter() - started
+
+    await asyncio.gather(*[c.disconnect() for c in communicators])
+    deliveries = len(communicators) * messages
+    return {
+        'clients': len(communicators),
+        'messages': messages,
+        'connect_all_ms': round(connected * 1000, 3),
+        'deliver_all_ms': round(delivered * 1000, 3),
+        'deliveries_per_second': round(deliveries / delivered, 1),
+    }
+
+
+# group_send of channels_redis (the configured layer) without Redis: like
+# it, every member channel gets its own msgpack-encoded copy of the event,
+# decoded when the member receives it
+
+
+class RedisEncodingChannelLayer:
+    def __init__(self):
+        # (only its serializer is used, it never connects)
+        self.codec = RedisChannelLayer()
+        self.groups = {}
+        self.queues = {}
+
+    def add_member(self, group, channel):
+        self.groups.setdefault(group, []).append(channel)
+        self.queues[channel] = deque()
+
+    async def group_send(self, group, message):
+        for channel in self.groups[group]:
+            self.queues[channel].append(self.codec.serialize(
+                {**message, '__asgi_channel__': channel}))
+
+    async def receive(self, channel):
+        message = self.codec.deserialize(self.queues[channel].popleft())
+        del message['__asgi_channel__']
+        return message
+
+# CPU cost of broadcasting 'messages' chat messages through group_send to
+# every member of a room, members being ChatConsumer instances without a
+# socket whose queued frames are taken as the writer task does.
+# 'make_event' builds the event the sender sends (encoding included).
+
+
+async def time_room_delivery(layer, members, make_event, messages):
+    started = time.process_time()
+    for _ in range(messages):
+        await layer.group_send('broadcast', make_event())
+        for consumer in members:
+            await consumer.chat_message(
+                await layer.receive(consumer.channel_name))
+            frame_text(await consumer.outbound.get())
+    return time.process_time() - started
+
+
+def benchmark_broadcast(room_sizes, messages):
+    # a typical message, with some non-ASCII text to escape
+    message = ' '.join(fake.sentence() for _ in range(3)) + ' \u00e9t\u00e9 \u2713'
+    events = {
+        # the event sent before frames were encoded by the sender
+        'per_member_encoding': lambda: {
+            'type': 'chat_message', 'room': 'broadcast', 'message': message,
+            'message_id': None},
+        'encoded_once': lambda: chat_event('broadcast', None, message),
+    }
+
+    async def run(size):
+        layer = RedisEncodingChannelLayer()
+        members = []
+        for number in range(size):
+            consumer = ChatConsumer()
+            consumer.room_name = 'broadcast'
+            consumer.channel_name = f'broadcast.member{number}'
+            consumer.outbound = OutboundQueue(1)
+            layer.add_member('broadcast', consumer.channel_name)
+            members.append(consumer)
+        result = {'members': size, 'messages': messages}
+        for name, make_event in events.items():
+            seconds = await time_room_delivery(
+                layer, members, make_event, messages)
+            result[f'{name}_us'] = round(seconds / messages * 1e6, 1)
+            result[f'{name}_event_bytes'] = len(
+                layer.codec.serialize(make_event()))
+        return result
+
+    results = {}
+    for size in room_sizes:
+        result = async_to_sync(run)(size)
+        once = result['encoded_once_us']
+        result['speedup'] = round(
+            result['per_member_encoding_us'] / once, 2) if once else None
+        results[str(size)] = result
+    return results
+
+
+def benchmark_websockets(seeded, clients, messages):
+    users = list(User.objects.filter(
+        groups__name='student').order_by('pk')[:clients])
+    ws_counters.clear()
+    # every frame must reach the clients: no throttling, no dropping
+    with override_settings(
+            CHANNEL_LAYERS={'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                'CONFIG': {'capacity': max(100, messages * 2)},
+            }},
+            CHAT_HISTORY_ON_CONNECT=False,
+            CHAT_RATE_LIMIT=messages, CHAT_RATE_BURST=messages,
+            CHAT_OUTBOUND_QUEUE_SIZE=max(100, messages)), \
+            contextlib.redirect_stdout(io.StringIO()):
+        # (the consumers log every frame to stdout)
+        return {
+            'chat': async_to_sync(benchmark_chat)(users, messages),
+            'notifications': async_to_sync(benchmark_notifications)(
+                users, messages),
+        }
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# seeding, then timing everything; uploads go to a temporary MEDIA_ROOT
+
+
+def run_benchmark(**scale):
+    scale = {**DEFAULT_SCALE, **scale}
+    media_root = tempfile.mkdtemp(prefix='elearning-benchmark-')
+    try:
+        with override_settings(MEDIA_ROOT=media_root,
+                               CHANNEL_LAYERS={'default': {
+                                   'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            seeded = seed_database(
+                scale['users'], scale['courses'],
+                scale['enrollments_per_course'], scale['fanout'],
+                scale['notifications'])
+            http = benchmark_http(seeded, scale['requests'])
+            serialization = benchmark_serializers(scale['serialize_rows'])
+        websocket = benchmark_websockets(
+            seeded, scale['clients'], scale['messages'])
+        broadcast = benchmark_broadcast(scale['room_sizes'], scale['messages'])
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+    return {
+        'meta': {
+            'commit': get_git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'orjson': orjson is not None,
+            'scale': scale,
+        },
+        'seed': {key: seeded[key] for key in ('rows', 'seconds')},
+        'http': http,
+        'serialization': serialization,
+        'websocket': websocket,
+        'broadcast': broadcast,
+    }
@@ -0,0 +1,97 @@
+from functools import partial
+from .models import Material, MaterialBlob
+from .storage import get_blob_sha256, material_storage
+from django.db import transaction
+from django.db.models import F
+
+"""
+Material file reference counts
+"""
+# with content-addressed storage several materials can point to the same
+# file. MaterialBlob counts them: the storage adds a reference for every
+# save, before it reuses a file already on disk, and signals.py releases it
+# when the material is deleted. The file is unlinked once the transaction
+# dropping its last reference commits, if no save referenced it again by
+# then (the check and the unlink hold the count row's lock).
+
+# adding 'amount' references to a stored file
+
+
+def acquire_material_file(name, amount=1):
+    MaterialBlob.objects.bulk_create([MaterialBlob(name=name)],
+                                     ignore_conflicts=True)
+    MaterialBlob.objects.filter(name=name).update(
+        ref_count=F('ref_count') + amount)
+
+# dropping one reference, the file is unlinked after commit when it was
+# the last one (files without a count row are only referenced by the caller)
+
+
+def release_material_file(name):
+    with transaction.atomic():
+        blob = MaterialBlob.objects.select_for_update().filter(
+            name=name).first()
+        if blob is not None and blob.ref_count > 1:
+            MaterialBlob.objects.filter(name=name).update(
+                ref_count=F('ref_count') - 1)
+            return False
+        if blob is not None:
+            MaterialBlob.objects.filter(name=name).update(ref_count=0)
+        transaction.on_commit(partial(delete_unreferenced_file, name))
+        return True
+
+# saving a new material: its file is saved first (taking its reference) and
+# the reference is released when the row can't be inserted
+
+
+def save_material(material):
+    material_file = material.material_path
+    if material_file and not material_file._committed:
+        material_file.save(material_file.name, material_file.file, save=False)
+    try:
+        with transaction.atomic():
+            material.save()
+    except BaseException:
+        if material_file:
+            release_material_file(material_file.name)
+        raise
+    return material
+
+# removing a file whose references were all released, unless a save took
+# one since (the count row is created if needed, so there is one to lock)
+
+
+def delete_unreferenced_file(name):
+    with transaction.atomic():
+        MaterialBlob.objects.bulk_create([MaterialBlob(name=name)],
+                                         ignore_conflicts=True)
+        blob = MaterialBlob.objects.select_for_update().get(name=name)
+        if blob.ref_count > 0:
+            return False
+        material_storage.delete(name)
+        blob.delete()
+        return True
+
+# moving files stored under their upload name to content-addressed names
+# materials sharing the same content end up sharing one file
+
+
+def deduplicate_material_files():
+    moved = 0
+    names = Material.objects.order_by().values_list(
+        'material_path', flat=True).distinct()
+    for name in list(names):
+        if not name or get_blob_sha256(name) or \
+                not material_storage.exists(name):
+            continue
+        # (saving took the first reference)
+        with material_storage.open(name, 'rb') as stored_file:
+            new_name = material_storage.save(name, stored_file)
+        with transaction.atomic():
+            updated = Material.objects.filter(material_path=name).update(
+                material_path=new_name)
+            MaterialBlob.objects.filter(name=name).delete()
+            acquire_material_file(new_name, updated - 1)
+        material_storage.delete(name)
+        moved += 1
+    return moved
@@ -0,0 +1,105 @@
+from .models import Course, CourseCatalogEntry, Enrollment, Material
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, Max, Value
+from django.db.models.functions import Greatest
+
+"""
+Course catalogue
+"""
+# the home page and 'more courses' lists read CourseCatalogEntry, one row per
+# course holding the creator's name, the enrollment and material counts and
+# the time of the latest activity, so a page is a single indexed query with
+# no joins and no per-row counting.
+# signals.py updates a row as its course, enrollments and materials change;
+# rebuild_course_catalog recomputes them all (rows inserted with bulk_create
+# skip the signals).
+
+
+def get_creator_name(user):
+    return f'{user.first_name} {user.last_name}'
+
+# adding or refreshing the row of a saved course (counts are kept)
+
+
+def save_catalog_entry(course):
+    CourseCatalogEntry.objects.bulk_create(
+        [CourseCatalogEntry(
+            course_id=course.course_id, title=course.title, level=course.level,
+            creator_id=course.creator_id,
+            creator_name=get_creator_name(course.creator),
+            created_at=course.created_at, updated_at=course.updated_at,
+            last_activity_at=course.updated_at)],
+        update_conflicts=True, unique_fields=['course'],
+        update_fields=['title', 'level', 'creator', 'creator_name',
+                       'updated_at', 'last_activity_at'])
+
+# adding 'delta' to a count, moving the last activity forward to 'activity_at'
+
+
+def update_catalog_count(course_id, field, delta, activity_at=None):
+    entries = CourseCatalogEntry.objects.filter(course_id=course_id)
+    if delta < 0:
+        entries = entries.filter(**{f'{field}__gte': -delta})
+    updates = {field: F(field) + delta}
+    if activity_at is not None:
+        updates['last_activity_at'] = Greatest(
+            'last_activity_at', Value(activity_at, output_field=DateTimeField()))
+    entries.update(**updates)
+
+
+def rename_catalog_creator(user):
+    creator_name = get_creator_name(user)
+    CourseCatalogEntry.objects.filter(creator=user).exclude(
+        creator_name=creator_name).update(creator_name=creator_name)
+
+# catalogue rows of the given courses (their creators selected), counted
+# with one grouped query per related table
+
+
+def build_catalog_entries(courses):
+    course_ids = [course.course_id for course in courses]
+    enrollments = {row['course']: row for row in Enrollment.objects.filter(
+        course_id__in=course_ids).order_by().values('course').annotate(
+        count=Count('enrollment_id'), latest=Max('enrolled_at'))}
+    materials = {row['course']: row for row in Material.objects.filter(
+        course_id__in=course_ids).order_by().values('course').annotate(
+        count=Count('material_id'), latest=Max('added_at'))}
+    entries = []
+    for course in courses:
+        course_enrollments = enrollments.get(course.course_id, {})
+        course_materials = materials.get(course.course_id, {})
+        activity = [course.updated_at, course_enrollments.get('latest'),
+                    course_materials.get('latest')]
+        entries.append(CourseCatalogEntry(
+            course_id=course.course_id, title=course.title, level=course.level,
+            creator_id=course.creator_id,
+            creator_name=get_creator_name(course.creator),
+            created_at=course.created_at, updated_at=course.updated_at,
+            enrollment_count=course_enrollments.get('count', 0),
+            material_count=course_materials.get('count', 0),
+            last_activity_at=max(time for time in activity if time)))
+    return entries
+
+# recomputing every catalogue row
+
+
+def rebuild_course_catalog(batch_size=1000):
+    rebuilt = 0
+    last_pk = 0
+    courses = Course.objects.order_by('course_id').select_related('creator')
+    with transaction.atomic():
+        CourseCatalogEntry.objects.all().delete()
+        while True:
+            batch = list(courses.filter(course_id__gt=last_pk)[:batch_size])
+            if not batch:
+                return rebuilt
+            CourseCatalogEntry.objects.bulk_create(build_catalog_entries(batch))
+            rebuilt += len(batch)
+            last_pk = batch[-1].course_id
+
+# courses a student is not enrolled in, as a catalogue queryset
+
+
+def catalog_excluding_enrolled(user):
+    return CourseCatalogEntry.objects.exclude(
+        course__in=Enrollment.objects.filter(student=user).values('course'))
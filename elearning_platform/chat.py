@@ -0,0 +1,152 @@
+import asyncio
+import json
+import uuid
+from collections import OrderedDict, deque
+from .models import Chat
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+from channels.db import database_sync_to_async
+
+"""
+Live chat persistence and history
+"""
+# messages are buffered per room and written with one bulk_create when
+# CHAT_FLUSH_BATCH_SIZE messages are waiting or CHAT_FLUSH_INTERVAL seconds
+# have passed, so the database is not hit once per message.
+# Every process also keeps the last CHAT_HISTORY_SIZE messages of each room
+# in a ring buffer, which is streamed to users joining the room. Messages
+# are kept as the encoded frames sent to the room's sockets.
+
+DEFAULT_CHAT_HISTORY_SIZE = 50
+DEFAULT_CHAT_HISTORY_MAX_ROOMS = 1000
+DEFAULT_CHAT_FLUSH_BATCH_SIZE = 50
+DEFAULT_CHAT_FLUSH_INTERVAL = 2.0
+
+
+def get_chat_setting(name, default):
+    return getattr(settings, name, default)
+
+# the websocket frame of a chat message
+
+
+def encode_chat_frame(message):
+    return json.dumps({'message': message})
+
+# ring buffer of a room's most recent messages
+# message ids make adding the same broadcast message twice a no-op
+
+
+class RoomHistory:
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+        self.message_ids = set()
+
+    def add(self, message_id, payload):
+        if message_id in self.message_ids:
+            return
+        if len(self.entries) == self.entries.maxlen:
+            evicted_id, _ = self.entries[0]
+            self.message_ids.discard(evicted_id)
+        self.entries.append((message_id, payload))
+        self.message_ids.add(message_id)
+
+    def payloads(self):
+        return [payload for _, payload in self.entries]
+
+# per-process store of pending messages and room histories
+
+
+class ChatStore:
+    def __init__(self):
+        self.pending = {}
+        self.flush_tasks = {}
+        self.histories = OrderedDict()
+
+    # buffering a message sent by a user of this process
+    # returns the id used to de-duplicate it in the room histories
+
+    async def add_message(self, room, user, message):
+        message_id = uuid.uuid4().hex
+        if user is None or not user.is_authenticated:
+            return message_id
+        pending = self.pending.setdefault(room, [])
+        pending.append(Chat(room=room, user_id=user.pk, message=message,
+                            sent_at=timezone.now()))
+        if len(pending) >= get_chat_setting(
+                'CHAT_FLUSH_BATCH_SIZE', DEFAULT_CHAT_FLUSH_BATCH_SIZE):
+            await self.flush(room)
+        elif room not in self.flush_tasks:
+            self.flush_tasks[room] = asyncio.ensure_future(
+                self._flush_later(room))
+        return message_id
+
+    async def _flush_later(self, room):
+        await asyncio.sleep(get_chat_setting(
+            'CHAT_FLUSH_INTERVAL', DEFAULT_CHAT_FLUSH_INTERVAL))
+        await self.flush(room)
+
+    # writing the pending messages of a room in one insert
+    # rows of a failed insert are kept, ahead of newer ones, for a later try
+
+    async def flush(self, room):
+        task = self.flush_tasks.pop(room, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        rows = self.pending.pop(room, [])
+        if rows:
+            try:
+                await database_sync_to_async(Chat.objects.bulk_create)(rows)
+            except DatabaseError as e:
+                print(f"Error writing chat messages of {room}: {e}")
+                self.pending[room] = rows + self.pending.get(room, [])
+                if room not in self.flush_tasks:
+                    self.flush_tasks[room] = asyncio.ensure_future(
+                        self._flush_later(room))
+                return 0
+        return len(rows)
+
+    async def flush_all(self):
+        flushed = 0
+        for room in list(self.pending):
+            flushed += await self.flush(room)
+        return flushed
+
+    # recording a message delivered to a consumer of this process
+
+    def remember(self, room, message_id, frame):
+        history = self.histories.get(room)
+        if history is not None:
+            history.add(message_id, frame)
+
+    # frames of the last messages of a room, oldest first
+    # a room seen for the first time is seeded from the database
+
+    async def get_history(self, room):
+        history = self.histories.get(room)
+        if history is None:
+            size = get_chat_setting(
+                'CHAT_HISTORY_SIZE', DEFAULT_CHAT_HISTORY_SIZE)
+            history = RoomHistory(size)
+            rows = await database_sync_to_async(load_room_history)(room, size)
+            rows += self.pending.get(room, [])
+            for row in rows[-size:]:
+                history.add(row.message_id or id(row),
+                            encode_chat_frame(row.message))
+            self.histories[room] = history
+            # keeping the number of rooms held in memory bounded
+            while len(self.histories) > get_chat_setting(
+                    'CHAT_HISTORY_MAX_ROOMS', DEFAULT_CHAT_HISTORY_MAX_ROOMS):
+                self.histories.popitem(last=False)
+        self.histories.move_to_end(room)
+        return history.payloads()
+
+
+# last 'size' stored messages of a room, oldest first
+def load_room_history(room, size):
+    rows = Chat.objects.filter(room=room).order_by(
+        '-sent_at', '-message_id').only('message_id', 'message')[:size]
+    return list(reversed(rows))
+
+
+chat_store = ChatStore()
@@ -0,0 +1,107 @@
+import hashlib
+from .fragments import get_course_version, get_catalog_version
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+"""
+Conditional API responses
+"""
+# read endpoints send an ETag (and a Last-Modified where the row has an
+# updated_at) built from the version counters of fragments.py, which signals
+# bump whenever a course or its rows change. A request repeating the ETag in
+# If-None-Match gets a bodyless 304 before anything is queried or serialized.
+# The serialized data of single objects is also kept in the cache for
+# API_CACHE_TIMEOUT seconds under the object's version, so a changed ETag
+# seen by many clients is serialized once.
+
+DEFAULT_API_CACHE_TIMEOUT = 300
+
+
+def get_api_cache_timeout():
+    return getattr(settings, 'API_CACHE_TIMEOUT', DEFAULT_API_CACHE_TIMEOUT)
+
+# strong ETag of a representation (the renderer is part of it)
+
+
+def make_etag(*parts):
+    return f'"{get_digest(parts)}"'
+
+
+def get_digest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()
+
+# 304 when the client's copy is current, None otherwise
+
+
+def get_not_modified(request, etag, last_modified=None):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return get_conditional_response(
+        request, etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # per-user data: browsers keep it but revalidate every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# serialized data of an object, cached per version
+
+
+def get_serializer_data(serializer, instance, version):
+    key = (f'api_data:{type(serializer).__name__}:{instance.pk}:'
+           f'{get_digest(version)}')
+    data = cache.get(key)
+    if data is None:
+        data = serializer.data
+        cache.set(key, data, get_api_cache_timeout())
+    return data
+
+# retrieve with validators, for views whose objects belong to a course
+# (Course, Material, Enrollment); get_object() still checks permissions
+
+
+class ConditionalRetrieveMixin:
+
+    # (version, last modified or None) of the object
+    def get_object_version(self, instance):
+        if hasattr(instance, 'updated_at'):
+            return (instance.updated_at.isoformat(),
+                    get_course_version(instance.course_id)), instance.updated_at
+        return get_course_version(instance.course_id), None
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        version, last_modified = self.get_object_version(instance)
+        etag = make_etag(type(instance).__name__, instance.pk, version,
+                         request.accepted_renderer.format)
+        response = get_not_modified(request, etag, last_modified)
+        if response is None:
+            response = Response(get_serializer_data(
+                self.get_serializer(instance), instance, version))
+        return set_validators(response, etag, last_modified)
+
+# list with an ETag, views name the version of what they list in
+# get_list_version() (the user and the query string are added to it)
+
+
+class ConditionalListMixin:
+
+    def get_list_version(self):
+        return get_catalog_version()
+
+    def list(self, request, *args, **kwargs):
+        etag = make_etag(type(self).__name__, request.user.pk,
+                         request.get_full_path(), self.get_list_version(),
+                         request.accepted_renderer.format)
+        response = get_not_modified(request, etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag)
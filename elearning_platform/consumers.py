@@ -1,13 +1,85 @@
+import asyncio
 import json
+import re
+from .chat import chat_store, encode_chat_frame
+from .throttling import *
+from .heartbeat import HeartbeatMixin
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+DEFAULT_WS_MAX_SUBSCRIPTIONS = 20
+NOTIFICATIONS_TOPIC = 'notifications'
+CHAT_TOPIC = re.compile(r'chat:(\w{1,100})')
+
+
+def chat_group_name(room_name):
+    return 'live_chat_%s' % room_name
+
+# channel-layer event of a chat message
+# the sender encodes the frame once and every member forwards the text as
+# it is (multiplexed sockets splice their topic in), instead of each of
+# them encoding the same message; the event carries the message only once
+
+
+def chat_event(room_name, message_id, message):
+    return {
+        'type': 'chat_message',
+        'room': room_name,
+        'message_id': message_id,
+        'frame': encode_chat_frame(message),
+    }
+
+# storing a chat message and broadcasting it to the room's sockets
+
+
+async def publish_chat_message(channel_layer, room_name, user, message):
+    message_id = await chat_store.add_message(room_name, user, message)
+    await channel_layer.group_send(
+        chat_group_name(room_name), chat_event(room_name, message_id, message))
+
+# frame of a chat event (events of the previous release carry the message)
+
+
+def get_chat_frame(event):
+    frame = event.get('frame')
+    return frame if frame is not None else encode_chat_frame(event['message'])
+
+# {"topic": ..., "message": ...} frame of a multiplexed socket: the topic
+# spliced into the room frame, the message isn't encoded again
+
+
+def add_topic(topic, frame):
+    return '{"topic": %s, %s' % (json.dumps(topic), frame[1:])
+
+# text of a queued frame: encoded by the sender already, or a payload dict
+
+
+def frame_text(frame):
+    return frame if isinstance(frame, str) else json.dumps(frame)
+
 # live chat comsumer handling multi-user chat communication
+# messages are persisted in batches and recent room history is sent on join
+# incoming frames are size and rate limited, outgoing frames go through a
+# bounded queue drained by a writer task; silent sockets are reaped (see
+# heartbeat.py)
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(HeartbeatMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = 'live_chat_%s' % self.room_name
+        self.room_group_name = chat_group_name(self.room_name)
+        self.writer = None
+        # refusing anonymous sockets before they join the room
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            ws_counters['chat_rejected'] += 1
+            await self.close()
+            return
+        self.rate_limiter = TokenBucket(
+            get_ws_setting('CHAT_RATE_LIMIT', DEFAULT_CHAT_RATE_LIMIT),
+            get_ws_setting('CHAT_RATE_BURST', DEFAULT_CHAT_RATE_BURST))
+        self.outbound = OutboundQueue(get_ws_setting(
+            'CHAT_OUTBOUND_QUEUE_SIZE', DEFAULT_CHAT_OUTBOUND_QUEUE_SIZE))
         # joining coms channel
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -15,38 +87,72 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        self.writer = asyncio.ensure_future(self.write_outbound())
+        # streaming the room's recent messages to the new member
+        if getattr(settings, 'CHAT_HISTORY_ON_CONNECT', True):
+            for frame in await chat_store.get_history(self.room_name):
+                self.outbound.put(frame)
+
+    def get_heartbeat_groups(self):
+        return [self.room_group_name]
 
     async def disconnect(self, close_code):
+        if self.writer is None:
+            # rejected in connect
+            return
+        self.writer.cancel()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        # writing buffered messages of the room
+        await chat_store.flush(self.room_name)
     # handle input from WebSocket
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message
-            }
-        )
+    async def receive(self, text_data=None, bytes_data=None):
+        max_size = get_ws_setting(
+            'CHAT_MAX_MESSAGE_SIZE', DEFAULT_CHAT_MAX_MESSAGE_SIZE)
+        if text_data is None or len(text_data) > max_size:
+            ws_counters['chat_oversized'] += 1
+            self.outbound.put({'error': 'Message is too long.'})
+            return
+        if not self.rate_limiter.consume():
+            ws_counters['chat_throttled'] += 1
+            self.outbound.put({'error': 'You are sending messages too fast.'})
+            return
+        try:
+            message = json.loads(text_data)['message']
+        except (ValueError, TypeError, KeyError):
+            message = None
+        # messages are text (null would fail the room's whole batch insert)
+        if not isinstance(message, str):
+            ws_counters['chat_invalid'] += 1
+            return
+        await publish_chat_message(
+            self.channel_layer, self.room_name, self.scope.get('user'), message)
     # handle output to WebSocket
 
     async def chat_message(self, event):
-        message = event['message']
+        frame = get_chat_frame(event)
+        chat_store.remember(
+            self.room_name, event.get('message_id'), frame)
 
-        await self.send(text_data=json.dumps({
-            'message': message
-        }))
+        self.outbound.put(frame)
+
+    # writer task: sends queued frames, reporting frames dropped in between
+
+    async def write_outbound(self):
+        while True:
+            payload = await self.outbound.get()
+            dropped = self.outbound.take_dropped()
+            if dropped:
+                await self.send(text_data=json.dumps({'dropped': dropped}))
+            await self.send(text_data=frame_text(payload))
 
 # notification consumer handling notification broadcasting
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(HeartbeatMixin, AsyncWebsocketConsumer):
     async def connect(self):
         try:
             self.user = self.scope["user"]
@@ -62,6 +168,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error in connect method: {e}")
 
+    def get_heartbeat_groups(self):
+        return [self.group_name]
+
     async def disconnect(self, close_code):
         # leaving notification group
         await self.channel_layer.group_discard(
@@ -93,3 +202,148 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             }))
         except Exception as e:
             print(f"Error sending notification: {e}")
+
+# one socket per browser tab carrying notifications and any number of chat
+# rooms. Frames are JSON objects naming a topic, 'notifications' or
+# 'chat:<room>':
+#   client: {"action": "subscribe" | "unsubscribe", "topic": ...}
+#           {"topic": "chat:<room>", "message": ...} to send to a room
+#   server: {"topic": ..., "message": ...} (notifications add unread_count),
+#           {"topic": ..., "error": ...}, {"dropped": n}
+# a topic is a channel-layer group joined by the socket's single channel;
+# client frames share one rate limit, server frames one bounded queue
+
+
+class MultiplexConsumer(HeartbeatMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        self.topics = {}
+        # topic of each subscribed channel-layer group
+        self.groups = {}
+        self.writer = None
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            ws_counters['multiplex_rejected'] += 1
+            await self.close()
+            return
+        self.rate_limiter = TokenBucket(
+            get_ws_setting('CHAT_RATE_LIMIT', DEFAULT_CHAT_RATE_LIMIT),
+            get_ws_setting('CHAT_RATE_BURST', DEFAULT_CHAT_RATE_BURST))
+        self.outbound = OutboundQueue(get_ws_setting(
+            'CHAT_OUTBOUND_QUEUE_SIZE', DEFAULT_CHAT_OUTBOUND_QUEUE_SIZE))
+        await self.accept()
+        self.writer = asyncio.ensure_future(self.write_outbound())
+
+    def get_heartbeat_groups(self):
+        return list(self.topics.values())
+
+    async def disconnect(self, close_code):
+        if self.writer is None:
+            # rejected in connect
+            return
+        self.writer.cancel()
+        for topic in list(self.topics):
+            await self.unsubscribe(topic)
+
+    # channel-layer group of a topic, None for unknown topics
+    def get_topic_group(self, topic):
+        if topic == NOTIFICATIONS_TOPIC:
+            return f'notifications_{self.scope["user"].id}'
+        match = CHAT_TOPIC.fullmatch(topic)
+        return chat_group_name(match.group(1)) if match else None
+
+    async def subscribe(self, topic):
+        if topic in self.topics:
+            return
+        group = self.get_topic_group(topic)
+        if group is None:
+            self.outbound.put({'topic': topic, 'error': 'Unknown topic.'})
+            return
+        if len(self.topics) >= get_ws_setting(
+                'WS_MAX_SUBSCRIPTIONS', DEFAULT_WS_MAX_SUBSCRIPTIONS):
+            self.outbound.put({'topic': topic, 'error': 'Too many subscriptions.'})
+            return
+        self.topics[topic] = group
+        self.groups[group] = topic
+        await self.channel_layer.group_add(group, self.channel_name)
+        # streaming the room's recent messages to the new member
+        if topic != NOTIFICATIONS_TOPIC and \
+                getattr(settings, 'CHAT_HISTORY_ON_CONNECT', True):
+            for frame in await chat_store.get_history(topic[len('chat:'):]):
+                self.outbound.put(add_topic(topic, frame))
+
+    async def unsubscribe(self, topic):
+        group = self.topics.pop(topic, None)
+        if group is None:
+            return
+        self.groups.pop(group, None)
+        await self.channel_layer.group_discard(group, self.channel_name)
+        if topic != NOTIFICATIONS_TOPIC:
+            # writing buffered messages of the room
+            await chat_store.flush(topic[len('chat:'):])
+
+    async def receive(self, text_data=None, bytes_data=None):
+        max_size = get_ws_setting(
+            'CHAT_MAX_MESSAGE_SIZE', DEFAULT_CHAT_MAX_MESSAGE_SIZE)
+        if text_data is None or len(text_data) > max_size:
+            ws_counters['chat_oversized'] += 1
+            self.outbound.put({'error': 'Message is too long.'})
+            return
+        if not self.rate_limiter.consume():
+            ws_counters['chat_throttled'] += 1
+            self.outbound.put({'error': 'You are sending messages too fast.'})
+            return
+        try:
+            frame = json.loads(text_data)
+            topic = frame['topic']
+            action = frame.get('action')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            topic = None
+        if not isinstance(topic, str):
+            ws_counters['chat_invalid'] += 1
+            return
+        if action == 'subscribe':
+            await self.subscribe(topic)
+        elif action == 'unsubscribe':
+            await self.unsubscribe(topic)
+        elif topic in self.topics and topic != NOTIFICATIONS_TOPIC \
+                and isinstance(frame.get('message'), str):
+            await publish_chat_message(
+                self.channel_layer, topic[len('chat:'):],
+                self.scope.get('user'), frame['message'])
+        else:
+            ws_counters['chat_invalid'] += 1
+
+    # topic of a room event, from the groups this socket subscribed to
+    # events sent before the multiplexed sockets carry no room: they can only
+    # be routed while a single room is subscribed
+    def get_event_topic(self, event):
+        if 'room' in event:
+            return self.groups.get(chat_group_name(event['room']))
+        chat_topics = [topic for topic in self.groups.values()
+                       if topic != NOTIFICATIONS_TOPIC]
+        return chat_topics[0] if len(chat_topics) == 1 else None
+
+    async def chat_message(self, event):
+        topic = self.get_event_topic(event)
+        if topic is None:
+            ws_counters['chat_unrouted'] += 1
+            return
+        frame = get_chat_frame(event)
+        chat_store.remember(
+            topic[len('chat:'):], event.get('message_id'), frame)
+        self.outbound.put(add_topic(topic, frame))
+
+    async def send_notification(self, event):
+        self.outbound.put({'topic': NOTIFICATIONS_TOPIC,
+                           'message': event['message'],
+                           'unread_count': event.get('unread_count', 0)})
+
+    # writer task: sends queued frames, reporting frames dropped in between
+
+    async def write_outbound(self):
+        while True:
+            payload = await self.outbound.get()
+            dropped = self.outbound.take_dropped()
+            if dropped:
+                await self.send(text_data=json.dumps({'dropped': dropped}))
+            await self.send(text_data=frame_text(payload))
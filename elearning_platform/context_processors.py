@@ -1,10 +1,20 @@
-from .models import Notification
+from .notifications import get_unread_count
+from .fragments import get_fragment_role, get_fragment_cache_timeout
 
 
 def unread_notifications_count(request):
     if request.user.is_authenticated:
-        unread_notif_count = Notification.objects.filter(
-            user=request.user, is_read=False).count()
+        unread_notif_count = get_unread_count(request.user.id)
     else:
         unread_notif_count = 0
     return {'unread_notifications_count': unread_notif_count}
+
+
+# role part of the cached fragment keys, see fragments.py
+
+
+def fragment_cache(request):
+    return {
+        'fragment_role': get_fragment_role(request.user),
+        'fragment_cache_timeout': get_fragment_cache_timeout(),
+    }
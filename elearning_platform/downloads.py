@@ -0,0 +1,153 @@
+import mimetypes
+import os
+import re
+from .models import Enrollment
+from .roles import has_role
+from .storage import get_blob_sha256
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date
+
+"""
+Material downloads
+"""
+# materials are served by an authenticated view instead of the MEDIA_URL
+# static view: teachers, the material's creator and non-blocked enrolled
+# students may download. Responses carry a strong ETag (the file's SHA-256),
+# answer If-None-Match with 304 and Range with 206, and are either streamed
+# by FileResponse (zero-copy through the server's wsgi.file_wrapper) or
+# handed to a front proxy with X-Accel-Redirect / X-Sendfile.
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+# MATERIAL_DOWNLOAD_OFFLOAD values
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+
+def get_download_setting(name, default):
+    return getattr(settings, name, default)
+
+# checking access to the material's course
+
+
+def can_download_material(user, material):
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or material.creator_id == user.id or has_role(user, 'teacher'):
+        return True
+    return Enrollment.objects.filter(
+        course_id=material.course_id, student=user, blocked=False).exists()
+
+# strong ETag from the content hash
+# (files stored before content addressing get a weak one from size / mtime)
+
+
+def get_material_etag(material, stat):
+    sha256 = get_blob_sha256(material.material_path.name)
+    if sha256:
+        return f'"{sha256}"'
+    return f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+# (start, end) of a single 'bytes=' range, None to send the whole file,
+# ValueError when the range can't be satisfied
+# multiple ranges are answered with the whole file, as RFC 9110 allows
+
+
+def parse_range(header, size):
+    match = RANGE_PATTERN.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+# part of an open file, without fileno() so servers stream it through
+# Python instead of sending the whole file with sendfile
+
+
+class FileRange:
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def serve_material(request, material):
+    path = material.material_path.path
+    stat = os.stat(path)
+    etag = get_material_etag(material, stat)
+    last_modified = int(stat.st_mtime)
+    # 304 for a matching If-None-Match / If-Modified-Since
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build_file_response(
+            request, material, path, stat.st_size, etag)
+    response.headers.setdefault('ETag', etag)
+    response.headers.setdefault('Last-Modified', http_date(last_modified))
+    # always revalidated, so access is checked on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def build_file_response(request, material, path, size, etag):
+    offload = get_download_setting('MATERIAL_DOWNLOAD_OFFLOAD', None)
+    if offload in (X_ACCEL_REDIRECT, X_SENDFILE):
+        # the proxy sends the file and handles Range itself
+        response = HttpResponse(content_type=mimetypes.guess_type(
+            material.material_name)[0] or 'application/octet-stream')
+        if offload == X_ACCEL_REDIRECT:
+            response['X-Accel-Redirect'] = get_download_setting(
+                'MATERIAL_DOWNLOAD_ACCEL_PREFIX', '/protected-media/'
+            ) + material.material_path.name
+        else:
+            response['X-Sendfile'] = path
+        response['Content-Disposition'] = content_disposition_header(
+            False, material.material_name)
+        return response
+
+    byte_range = None
+    if request.method == 'GET' and 'Range' in request.headers:
+        # only a strong ETag proves the client's part is of this content,
+        # anything else (dates, weak ETags) gets the whole file
+        if_range = request.headers.get('If-Range')
+        if if_range is None or (if_range == etag
+                                and not etag.startswith('W/')):
+            try:
+                byte_range = parse_range(request.headers['Range'], size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, filename=material.material_name)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1),
+                                filename=material.material_name, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
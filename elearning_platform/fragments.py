@@ -0,0 +1,72 @@
+import time
+from .roles import get_user_roles
+from django.conf import settings
+from django.core.cache import cache
+
+"""
+Rendered fragment cache
+"""
+# the navigation bar, the course lists of the home page and the body of
+# course pages are cached with the {% cache %} tag. Their keys hold version
+# counters: every course has one, bumped by signals.py whenever the course
+# or its materials, enrollments or feedback are saved or deleted, and the
+# catalogue has one bumped with any course. A change makes the next request
+# miss and render again; until then every page of the course is a hit.
+# Fragments are shared by users with the same roles (teachers get their own,
+# their pages show buttons for what they created).
+# Versions live in the default cache, so every worker must share it
+# (CACHE_URL) for invalidation to reach all of them.
+
+DEFAULT_FRAGMENT_CACHE_TIMEOUT = 3600
+CATALOG_VERSION_KEY = 'course_version:catalog'
+
+
+def get_fragment_cache_timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT',
+                   DEFAULT_FRAGMENT_CACHE_TIMEOUT)
+
+
+def course_version_key(course_id):
+    return f'course_version:{course_id}'
+
+# versions (re)start from the clock, so a counter lost by the cache never
+# repeats a version fragments were stored under
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_course_version(course_id):
+    return _get_version(course_version_key(course_id))
+
+
+def get_catalog_version():
+    return _get_version(CATALOG_VERSION_KEY)
+
+# invalidating the fragments of the given courses and the course lists
+
+
+def bump_course_versions(course_ids):
+    keys = [course_version_key(course_id) for course_id in set(course_ids)]
+    for key in keys + [CATALOG_VERSION_KEY]:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # not in the cache (yet)
+            cache.add(key, time.time_ns(), None)
+
+# which users may share a fragment: same roles, and the same user when they
+# are a teacher
+
+
+def get_fragment_role(user):
+    roles = ','.join(sorted(get_user_roles(user)))
+    if 'teacher' in get_user_roles(user):
+        return f'{roles}:{user.pk}'
+    return roles
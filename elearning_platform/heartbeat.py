@@ -0,0 +1,79 @@
+import asyncio
+from .throttling import get_ws_setting, ws_counters
+
+"""
+WebSocket heartbeat
+"""
+# a laptop closed mid-connection leaves a half-open socket the server never
+# hears about: it stays in its channel-layer groups and every group_send
+# keeps writing to it. Accepted sockets are sent a {"type": "ping"} frame
+# every WS_HEARTBEAT_INTERVAL seconds (0 disables it), answered by the page
+# with {"type":"pong"}; any frame from the client counts as an answer.
+# A socket that misses WS_HEARTBEAT_MISSES pings in a row is reaped: it
+# leaves its groups and is closed with code 4408.
+# ws_counters['connections_live'] is the number of sockets with a heartbeat
+# in this process, ws_counters['connections_reaped'] how many were reaped.
+
+DEFAULT_WS_HEARTBEAT_INTERVAL = 30
+DEFAULT_WS_HEARTBEAT_MISSES = 2
+
+CLOSE_HEARTBEAT_MISSED = 4408
+PING_FRAME = '{"type": "ping"}'
+# as sent by JSON.stringify()
+PONG_FRAME = '{"type":"pong"}'
+
+# for AsyncWebsocketConsumer subclasses, listing their groups in
+# get_heartbeat_groups()
+
+
+class HeartbeatMixin:
+    heartbeat = None
+    missed_heartbeats = 0
+
+    def get_heartbeat_groups(self):
+        return []
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        interval = get_ws_setting('WS_HEARTBEAT_INTERVAL',
+                                  DEFAULT_WS_HEARTBEAT_INTERVAL)
+        if interval > 0 and self.heartbeat is None:
+            ws_counters['connections_live'] += 1
+            self.heartbeat = asyncio.ensure_future(self.send_heartbeats(interval))
+
+    def stop_heartbeat(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+            self.heartbeat = None
+            ws_counters['connections_live'] -= 1
+
+    async def send_heartbeats(self, interval):
+        misses = get_ws_setting('WS_HEARTBEAT_MISSES',
+                                DEFAULT_WS_HEARTBEAT_MISSES)
+        while True:
+            await asyncio.sleep(interval)
+            if self.missed_heartbeats >= misses:
+                await self.reap()
+                return
+            self.missed_heartbeats += 1
+            await self.send(text_data=PING_FRAME)
+
+    # leaving the groups right away: the disconnect of a dead socket may
+    # only arrive when its TCP connection times out
+    async def reap(self):
+        self.heartbeat = None
+        ws_counters['connections_live'] -= 1
+        ws_counters['connections_reaped'] += 1
+        for group in self.get_heartbeat_groups():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        await self.close(code=CLOSE_HEARTBEAT_MISSED)
+
+    async def websocket_receive(self, message):
+        self.missed_heartbeats = 0
+        if message.get('text') == PONG_FRAME:
+            return
+        await super().websocket_receive(message)
+
+    async def websocket_disconnect(self, message):
+        self.stop_heartbeat()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,47 @@
+import json
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from elearning_platform.benchmark import DEFAULT_SCALE, run_benchmark
+
+# seeding a throwaway test database and timing pages, API and websockets
+# the JSON output is meant to be kept and compared across commits
+
+
+class Command(BaseCommand):
+    help = 'Seeds a test database and benchmarks views, API and websockets.'
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SCALE.items():
+            # lists of numbers (room sizes) take several values
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int,
+                                default=default,
+                                nargs='+' if isinstance(default, tuple) else None)
+        parser.add_argument('--output', help='file to write the JSON to')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='keep the test database afterwards')
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in DEFAULT_SCALE}
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            if options['keepdb']:
+                # emptying a database kept from a previous run, seeding
+                # creates the same rows again
+                call_command('flush', interactive=False, verbosity=0)
+            results = run_benchmark(**scale)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Benchmark results written to {options["output"]}.'))
+        else:
+            self.stdout.write(output)
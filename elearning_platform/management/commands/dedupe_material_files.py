@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.blobs import deduplicate_material_files
+
+# moving material files stored under their upload names to
+# content-addressed names, sharing one file per content
+
+
+class Command(BaseCommand):
+    help = 'Stores existing material files once per content.'
+
+    def handle(self, *args, **options):
+        moved = deduplicate_material_files()
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} material files to content-addressed storage.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.processing import process_pending_materials
+
+# post-processing materials uploaded before previews existed, or all of
+# them again with --all
+
+
+class Command(BaseCommand):
+    help = 'Builds previews, ZIP manifests and text of course materials.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Process materials that already have a preview.')
+
+    def handle(self, *args, **options):
+        processed = process_pending_materials(reprocess=options['all'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} materials.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.uploads import purge_expired_uploads
+
+# removing chunked uploads that were never finalized
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired, unfinished chunked material uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expiry', type=int, default=None,
+                            help='age in seconds (default MATERIAL_UPLOAD_EXPIRY)')
+
+    def handle(self, *args, **options):
+        purged = purge_expired_uploads(options['expiry'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} unfinished uploads.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.catalog import rebuild_course_catalog
+
+# recomputing the course catalogue rows (creator names, counts, activity)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the course catalogue read model.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_course_catalog(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt catalogue entries for {rebuilt} courses.'))
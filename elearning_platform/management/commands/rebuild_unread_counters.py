@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.notifications import rebuild_unread_counters
+
+# recomputing the denormalized unread notification counters from the table
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user unread notification counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_unread_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt unread counters for {rebuilt} users.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from elearning_platform.search import rebuild_search_index
+
+# re-indexing every student and teacher for the user search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the user search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} users for search.'))
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# filling the counters from the existing notifications
+def populate_counters(apps, schema_editor):
+    Notification = apps.get_model('elearning_platform', 'Notification')
+    NotificationCounter = apps.get_model(
+        'elearning_platform', 'NotificationCounter')
+    rows = Notification.objects.filter(is_read=False).values(
+        'user_id').annotate(unread_count=Count('notification_id'))
+    NotificationCounter.objects.bulk_create([
+        NotificationCounter(user_id=row['user_id'],
+                            unread_count=row['unread_count'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('elearning_platform', '0011_notification_dedupe_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
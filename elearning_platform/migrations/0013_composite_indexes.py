@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# keeping the oldest enrollment of duplicated (course, student) pairs
+# so the unique constraint can be created
+def remove_duplicate_enrollments(apps, schema_editor):
+    Enrollment = apps.get_model('elearning_platform', 'Enrollment')
+    seen = set()
+    duplicate_ids = []
+    for enrollment_id, course_id, student_id in Enrollment.objects.order_by(
+            'enrollment_id').values_list('enrollment_id', 'course_id', 'student_id'):
+        if (course_id, student_id) in seen:
+            duplicate_ids.append(enrollment_id)
+        seen.add((course_id, student_id))
+    Enrollment.objects.filter(enrollment_id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0012_notificationcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(condition=models.Q(('blocked', False)), fields=['course', 'enrollment_id'], name='enrollment_course_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['course', '-sent_at'], name='feedback_course_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='material',
+            index=models.Index(fields=['course', 'added_at'], name='material_course_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', True)), fields=['user', '-created_at'], name='notification_user_read_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_enrollments,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='enrollment',
+            constraint=models.UniqueConstraint(fields=('course', 'student'), name='unique_course_student'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0013_composite_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='feedback',
+            name='feedback_course_sent_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_user_unread_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='notification_user_read_idx',
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-created_at', '-course_id'], name='course_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['creator', '-created_at', '-course_id'], name='course_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['student', '-enrolled_at', '-enrollment_id'], name='enrollment_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['course', '-sent_at', '-feedback_id'], name='feedback_course_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user', '-created_at', '-notification_id'], name='notification_user_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', True)), fields=['user', '-created_at', '-notification_id'], name='notification_user_read_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-18 11:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0014_keyset_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='room',
+            field=models.CharField(default='global', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['room', '-sent_at', '-message_id'], name='chat_room_sent_idx'),
+        ),
+    ]
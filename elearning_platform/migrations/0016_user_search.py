@@ -0,0 +1,117 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+SEARCH_ROLES = ('student', 'teacher')
+
+# SQLite: FTS5 table over the entries, kept in sync by triggers
+SQLITE_CREATE_INDEX = [
+    """CREATE VIRTUAL TABLE elearning_platform_usersearch_fts USING fts5(
+        username, first_name, last_name,
+        content='elearning_platform_usersearchentry', content_rowid='user_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER elearning_platform_usersearch_ai
+        AFTER INSERT ON elearning_platform_usersearchentry BEGIN
+        INSERT INTO elearning_platform_usersearch_fts(
+            rowid, username, first_name, last_name)
+        VALUES (new.user_id, new.username, new.first_name, new.last_name);
+    END""",
+    """CREATE TRIGGER elearning_platform_usersearch_ad
+        AFTER DELETE ON elearning_platform_usersearchentry BEGIN
+        INSERT INTO elearning_platform_usersearch_fts(
+            elearning_platform_usersearch_fts, rowid,
+            username, first_name, last_name)
+        VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+    END""",
+    """CREATE TRIGGER elearning_platform_usersearch_au
+        AFTER UPDATE ON elearning_platform_usersearchentry BEGIN
+        INSERT INTO elearning_platform_usersearch_fts(
+            elearning_platform_usersearch_fts, rowid,
+            username, first_name, last_name)
+        VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+        INSERT INTO elearning_platform_usersearch_fts(
+            rowid, username, first_name, last_name)
+        VALUES (new.user_id, new.username, new.first_name, new.last_name);
+    END""",
+]
+SQLITE_DROP_INDEX = [
+    'DROP TRIGGER IF EXISTS elearning_platform_usersearch_au',
+    'DROP TRIGGER IF EXISTS elearning_platform_usersearch_ad',
+    'DROP TRIGGER IF EXISTS elearning_platform_usersearch_ai',
+    'DROP TABLE IF EXISTS elearning_platform_usersearch_fts',
+]
+
+# PostgreSQL: trigram index over the searched text
+POSTGRESQL_CREATE_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """CREATE INDEX usersearch_trgm_idx ON elearning_platform_usersearchentry
+        USING gin ((lower(username || ' ' || first_name || ' ' || last_name))
+                   gin_trgm_ops)""",
+]
+POSTGRESQL_DROP_INDEX = ['DROP INDEX IF EXISTS usersearch_trgm_idx']
+
+# other backends search the entries table without a dedicated index
+
+
+def create_search_index(apps, schema_editor):
+    statements = {
+        'sqlite': SQLITE_CREATE_INDEX,
+        'postgresql': POSTGRESQL_CREATE_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {
+        'sqlite': SQLITE_DROP_INDEX,
+        'postgresql': POSTGRESQL_DROP_INDEX,
+    }.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+# indexing the existing student and teacher users
+def populate_search_entries(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    UserSearchEntry = apps.get_model('elearning_platform', 'UserSearchEntry')
+    entries = []
+    for user in User.objects.prefetch_related('groups'):
+        group_names = [group.name for group in sorted(
+            user.groups.all(), key=lambda group: group.pk)]
+        if not set(SEARCH_ROLES) & set(group_names):
+            continue
+        entries.append(UserSearchEntry(
+            user_id=user.pk, username=user.username,
+            first_name=user.first_name, last_name=user.last_name,
+            group_name=group_names[0],
+            is_student='student' in group_names,
+            is_teacher='teacher' in group_names))
+    UserSearchEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('elearning_platform', '0015_chat_room'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchEntry',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_entry', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('username', models.CharField(max_length=150)),
+                ('first_name', models.CharField(blank=True, max_length=150)),
+                ('last_name', models.CharField(blank=True, max_length=150)),
+                ('group_name', models.CharField(max_length=150)),
+                ('is_student', models.BooleanField(default=False)),
+                ('is_teacher', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_entries, migrations.RunPython.noop),
+    ]
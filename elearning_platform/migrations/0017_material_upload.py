@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:14
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0016_user_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialUpload',
+            fields=[
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('sha256', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='elearning_platform.course')),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='material_uploads', to=settings.AUTH_USER_MODEL)),
+                ('material', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='elearning_platform.material')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MaterialUploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='elearning_platform.materialupload')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='materialuploadchunk',
+            constraint=models.UniqueConstraint(fields=('upload', 'index'), name='unique_upload_chunk'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# counting the materials already using each stored file
+def populate_blobs(apps, schema_editor):
+    Material = apps.get_model('elearning_platform', 'Material')
+    MaterialBlob = apps.get_model('elearning_platform', 'MaterialBlob')
+    rows = Material.objects.order_by().values('material_path').annotate(
+        ref_count=Count('material_id'))
+    MaterialBlob.objects.bulk_create([
+        MaterialBlob(name=row['material_path'], ref_count=row['ref_count'])
+        for row in rows if row['material_path']
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0017_material_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_blobs, migrations.RunPython.noop),
+    ]
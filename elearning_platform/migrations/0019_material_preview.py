@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0018_material_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialPreview',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='preview', serialize=False, to='elearning_platform.material')),
+                ('status', models.CharField(choices=[('processed', 'Processed'), ('failed', 'Failed')], max_length=10)),
+                ('manifest', models.JSONField(blank=True, default=list)),
+                ('entry_count', models.PositiveIntegerField(default=0)),
+                ('uncompressed_size', models.PositiveBigIntegerField(default=0)),
+                ('thumbnail', models.BinaryField(blank=True, null=True)),
+                ('text', models.TextField(blank=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('processed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
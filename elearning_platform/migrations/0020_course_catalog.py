@@ -0,0 +1,65 @@
+# Generated by Django 5.0.6 on 2026-10-18 12:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+# one catalogue row per existing course
+def populate_catalog(apps, schema_editor):
+    Course = apps.get_model('elearning_platform', 'Course')
+    Enrollment = apps.get_model('elearning_platform', 'Enrollment')
+    Material = apps.get_model('elearning_platform', 'Material')
+    CourseCatalogEntry = apps.get_model('elearning_platform', 'CourseCatalogEntry')
+    enrollments = {row['course']: row for row in Enrollment.objects.order_by()
+                   .values('course').annotate(count=Count('enrollment_id'),
+                                              latest=Max('enrolled_at'))}
+    materials = {row['course']: row for row in Material.objects.order_by()
+                 .values('course').annotate(count=Count('material_id'),
+                                            latest=Max('added_at'))}
+    entries = []
+    for course in Course.objects.select_related('creator'):
+        course_enrollments = enrollments.get(course.course_id, {})
+        course_materials = materials.get(course.course_id, {})
+        activity = [course.updated_at, course_enrollments.get('latest'),
+                    course_materials.get('latest')]
+        entries.append(CourseCatalogEntry(
+            course_id=course.course_id, title=course.title, level=course.level,
+            creator_id=course.creator_id,
+            creator_name=f'{course.creator.first_name} {course.creator.last_name}',
+            created_at=course.created_at, updated_at=course.updated_at,
+            enrollment_count=course_enrollments.get('count', 0),
+            material_count=course_materials.get('count', 0),
+            last_activity_at=max(time for time in activity if time)))
+    CourseCatalogEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0019_material_preview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseCatalogEntry',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='elearning_platform.course')),
+                ('title', models.CharField(max_length=255)),
+                ('level', models.CharField(choices=[('L4', 'Level 4'), ('L5', 'Level 5'), ('L6', 'Level 6')], max_length=2)),
+                ('creator_name', models.CharField(max_length=301)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('enrollment_count', models.PositiveIntegerField(default=0)),
+                ('material_count', models.PositiveIntegerField(default=0)),
+                ('last_activity_at', models.DateTimeField()),
+                ('creator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-created_at', '-course'], name='catalog_created_idx'), models.Index(fields=['creator', '-created_at', '-course'], name='catalog_creator_created_idx')],
+            },
+        ),
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+    ]
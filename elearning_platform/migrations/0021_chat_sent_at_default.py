@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0020_course_catalog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chat',
+            name='sent_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
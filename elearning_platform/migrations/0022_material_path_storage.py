@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:40
+
+import elearning_platform.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0021_chat_sent_at_default'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='material',
+            name='material_path',
+            field=models.FileField(storage=elearning_platform.storage.ContentAddressedStorage(), upload_to='materials/'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elearning_platform', '0022_material_path_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['course', '-enrolled_at', '-enrollment_id'], name='enrollment_course_idx'),
+        ),
+    ]
@@ -1,6 +1,9 @@
+import uuid
 from django.db import models
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from .storage import material_storage
 
 
 class AppUser(models.Model):
@@ -30,12 +33,53 @@ class Course(models.Model):
     start_date = models.DateField(null=True, blank=True)
     end_date = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # course listings, newest first
+            models.Index(fields=['-created_at', '-course_id'],
+                         name='course_created_idx'),
+            models.Index(fields=['creator', '-created_at', '-course_id'],
+                         name='course_creator_created_idx'),
+        ]
+
     def get_absolute_url(self):
         return reverse('course_detail', kwargs={'pk': self.course_id})
 
     def __str__(self):
         return self.title
 
+# course listing row with its aggregates, read by the course lists
+# kept up to date by signals.py, see catalog.py
+
+
+class CourseCatalogEntry(models.Model):
+    course = models.OneToOneField(
+        Course, on_delete=models.CASCADE, primary_key=True,
+        related_name='catalog_entry')
+    title = models.CharField(max_length=255)
+    level = models.CharField(max_length=2, choices=Course.LEVEL_CHOICES)
+    creator = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='catalog_entries')
+    creator_name = models.CharField(max_length=301)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    enrollment_count = models.PositiveIntegerField(default=0)
+    material_count = models.PositiveIntegerField(default=0)
+    # latest course update, enrollment or material
+    last_activity_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # course listings, newest first
+            models.Index(fields=['-created_at', '-course'],
+                         name='catalog_created_idx'),
+            models.Index(fields=['creator', '-created_at', '-course'],
+                         name='catalog_creator_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
 
 class Material(models.Model):
     material_id = models.AutoField(primary_key=True)
@@ -44,12 +88,110 @@ class Material(models.Model):
     creator = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='materials')
     material_name = models.CharField(max_length=255)
-    material_path = models.FileField(upload_to='materials/')
+    material_path = models.FileField(upload_to='materials/',
+                                     storage=material_storage)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # course page material list
+            models.Index(fields=['course', 'added_at'],
+                         name='material_course_added_idx'),
+        ]
+
     def __str__(self):
         return self.material_name
 
+# a stored material file and the number of materials using it
+# files are shared by materials with the same content, see blobs.py
+
+
+class MaterialBlob(models.Model):
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} references)'
+
+# chunked upload of a course material, until it is finalized
+# chunks are stored by uploads.py under 'material_uploads/<upload_id>/'
+
+
+class MaterialUpload(models.Model):
+    upload_id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False)
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name='uploads')
+    creator = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='material_uploads')
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    # of the whole file, set when finalized
+    sha256 = models.CharField(max_length=64, blank=True)
+    material = models.OneToOneField(
+        Material, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    # every chunk is chunk_size bytes, except the last one
+    def expected_chunk_size(self, index):
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.upload_id})'
+
+# manifest entry of a received chunk
+
+
+class MaterialUploadChunk(models.Model):
+    upload = models.ForeignKey(
+        MaterialUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'],
+                                    name='unique_upload_chunk'),
+        ]
+
+    def __str__(self):
+        return f'chunk {self.index} of {self.upload_id}'
+
+# what post-processing found in a material file, see processing.py
+
+
+class MaterialPreview(models.Model):
+    STATUS_CHOICES = [
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    material = models.OneToOneField(
+        Material, on_delete=models.CASCADE, primary_key=True,
+        related_name='preview')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    # ZIP archives: first entries of the listing, with totals of all of them
+    manifest = models.JSONField(default=list, blank=True)
+    entry_count = models.PositiveIntegerField(default=0)
+    uncompressed_size = models.PositiveBigIntegerField(default=0)
+    # images: JPEG thumbnail
+    thumbnail = models.BinaryField(null=True, blank=True)
+    # text found in the file, for search
+    text = models.TextField(blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    processed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'preview of {self.material_id} ({self.status})'
+
 
 class Notification(models.Model):
     notification_id = models.AutoField(primary_key=True)
@@ -60,11 +202,70 @@ class Notification(models.Model):
     message = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # idempotency key of background deliveries, e.g. 'material:<id>:user:<id>'
+    dedupe_key = models.CharField(
+        max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    class Meta:
+        # unread / read notification lists, newest first
+        # one partial index per read state: boolean filters are compiled to
+        # 'NOT is_read' / 'is_read', which a plain composite index can't match
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-notification_id'],
+                         condition=models.Q(is_read=False),
+                         name='notification_user_unread_idx'),
+            models.Index(fields=['user', '-created_at', '-notification_id'],
+                         condition=models.Q(is_read=True),
+                         name='notification_user_read_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembering the stored read state (used to keep unread counters)
+        instance._loaded_is_read = instance.__dict__.get('is_read')
+        return instance
 
     def __str__(self):
         return f'Notification for {self.user.email} on {self.course.title}'
 
 
+# denormalized number of unread notifications of a user
+# kept up to date by notifications.py / signals.py, rebuilt with
+# 'manage.py rebuild_unread_counters'
+
+
+class NotificationCounter(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='notification_counter')
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.unread_count} unread notifications for {self.user_id}'
+
+# searchable copy of the student and teacher users
+# kept up to date by search.py / signals.py, rebuilt with
+# 'manage.py rebuild_user_search'. The full-text index over it depends on
+# the database (FTS5 on SQLite, trigrams on PostgreSQL), see migration 0016
+
+
+class UserSearchEntry(models.Model):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name='search_entry')
+    username = models.CharField(max_length=150)
+    first_name = models.CharField(max_length=150, blank=True)
+    last_name = models.CharField(max_length=150, blank=True)
+    # first group of the user, returned with the search results
+    group_name = models.CharField(max_length=150)
+    is_student = models.BooleanField(default=False)
+    is_teacher = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.username
+
+
 class Feedback(models.Model):
     feedback_id = models.AutoField(primary_key=True)
     course = models.ForeignKey(
@@ -74,6 +275,13 @@ class Feedback(models.Model):
     message = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # course page feedback list, newest first
+            models.Index(fields=['course', '-sent_at', '-feedback_id'],
+                         name='feedback_course_sent_idx'),
+        ]
+
     def __str__(self):
         return f'Feedback by {self.user.email} for {self.course.title}'
 
@@ -82,8 +290,17 @@ class Chat(models.Model):
     message_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='chats')
+    room = models.CharField(max_length=255, default='global')
     message = models.TextField()
-    sent_at = models.DateTimeField(auto_now_add=True)
+    # set when the message is sent, not when its buffered batch is written
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # room history, newest first
+            models.Index(fields=['room', '-sent_at', '-message_id'],
+                         name='chat_room_sent_idx'),
+        ]
 
     def __str__(self):
         return f'Chat message by {self.user.email}'
@@ -98,5 +315,25 @@ class Enrollment(models.Model):
     enrolled_at = models.DateTimeField(auto_now_add=True)
     blocked = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            # a student enrolls at most once per course
+            # (also the index for course + student lookups)
+            models.UniqueConstraint(fields=['course', 'student'],
+                                    name='unique_course_student'),
+        ]
+        indexes = [
+            # non-blocked students of a course, walked in enrollment order
+            models.Index(fields=['course', 'enrollment_id'],
+                         condition=models.Q(blocked=False),
+                         name='enrollment_course_active_idx'),
+            # student's enrolled courses, newest first
+            models.Index(fields=['student', '-enrolled_at', '-enrollment_id'],
+                         name='enrollment_student_idx'),
+            # course page student list, newest first
+            models.Index(fields=['course', '-enrolled_at', '-enrollment_id'],
+                         name='enrollment_course_idx'),
+        ]
+
     def __str__(self):
         return f'{self.student.email} enrolled in {self.course.title}'
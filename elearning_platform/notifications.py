@@ -0,0 +1,190 @@
+import asyncio
+from .models import Notification, NotificationCounter, Enrollment
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+"""
+Notification fan-out engine
+"""
+
+# default number of recipients handled per batch
+DEFAULT_FANOUT_BATCH_SIZE = 500
+
+
+def get_fanout_batch_size():
+    return getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE',
+                   DEFAULT_FANOUT_BATCH_SIZE)
+
+# iterating the non-blocked students of a course in batches of user ids
+# keyset pagination on the enrollment id keeps every batch a single indexed query
+
+
+def iter_enrolled_student_batches(course, batch_size):
+    last_enrollment_id = 0
+    while True:
+        rows = list(Enrollment.objects.filter(
+            course=course, blocked=False,
+            enrollment_id__gt=last_enrollment_id
+        ).order_by('enrollment_id').values_list(
+            'enrollment_id', 'student_id')[:batch_size])
+        if not rows:
+            return
+        yield [student_id for _, student_id in rows]
+        if len(rows) < batch_size:
+            return
+        last_enrollment_id = rows[-1][0]
+
+# unread notification counters
+# reading is a primary key lookup, independent of the notification history
+
+
+def get_unread_count(user_id):
+    unread_count = NotificationCounter.objects.filter(
+        user_id=user_id).values_list('unread_count', flat=True).first()
+    return unread_count or 0
+
+# unread notification count of several users in one query
+
+
+def get_unread_counts(user_ids):
+    return dict(NotificationCounter.objects.filter(
+        user_id__in=user_ids).values_list('user_id', 'unread_count'))
+
+# adding 'amount' unread notifications to each of the users
+# missing counter rows are created first, then updated in one statement
+
+
+def increment_unread_counts(user_ids, amount=1):
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True)
+    NotificationCounter.objects.filter(user_id__in=user_ids).update(
+        unread_count=F('unread_count') + amount)
+
+# removing 'amount' unread notifications, never going below zero
+
+
+def decrement_unread_count(user_id, amount=1):
+    if amount:
+        NotificationCounter.objects.filter(user_id=user_id).update(
+            unread_count=Greatest(F('unread_count') - amount, Value(0)))
+
+# marking every unread notification of the user as read
+
+
+def mark_all_read(user_id):
+    with transaction.atomic():
+        updated = Notification.objects.filter(
+            user_id=user_id, is_read=False).update(is_read=True)
+        decrement_unread_count(user_id, updated)
+    return updated
+
+# recomputing every counter from the notifications table
+
+
+def rebuild_unread_counters(batch_size=1000):
+    rows = Notification.objects.filter(is_read=False).order_by().values(
+        'user_id').annotate(unread_count=Count('notification_id'))
+    rebuilt = 0
+    with transaction.atomic():
+        NotificationCounter.objects.update(unread_count=0)
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(NotificationCounter(
+                user_id=row['user_id'], unread_count=row['unread_count']))
+            if len(batch) >= batch_size:
+                rebuilt += _save_counters(batch)
+                batch = []
+        rebuilt += _save_counters(batch)
+    return rebuilt
+
+
+def _save_counters(counters):
+    NotificationCounter.objects.bulk_create(
+        counters, update_conflicts=True, unique_fields=['user'],
+        update_fields=['unread_count'])
+    return len(counters)
+
+# inserting the same notification for many users
+# one bulk insert, one counter update and one pipelined push per batch
+# dedupe_key(user_id) makes re-delivery of the same batch a no-op
+
+
+def fan_out_notifications(course, message, user_id_batches, dedupe_key):
+    sent = 0
+    for user_ids in user_id_batches:
+        keys = {user_id: dedupe_key(user_id) for user_id in user_ids}
+        delivered = set(Notification.objects.filter(
+            dedupe_key__in=keys.values()).values_list('dedupe_key', flat=True))
+        user_ids = [user_id for user_id in user_ids
+                    if keys[user_id] not in delivered]
+        if not user_ids:
+            continue
+        Notification.objects.bulk_create([
+            Notification(user_id=user_id, course=course, message=message,
+                         is_read=False, dedupe_key=keys[user_id])
+            for user_id in user_ids
+        ], ignore_conflicts=True)
+        increment_unread_counts(user_ids)
+        unread_counts = get_unread_counts(user_ids)
+        send_ws_notifications([
+            (user_id, message, unread_counts.get(user_id, 0))
+            for user_id in user_ids
+        ])
+        sent += len(user_ids)
+    return sent
+
+# notifying every non-blocked student enrolled in the material's course
+
+
+def fan_out_material_notification(material, batch_size=None):
+    course = material.course
+    message = (f"'{material.material_name}' added to the course "
+               f"'{course.title}'.")
+    batches = iter_enrolled_student_batches(
+        course, batch_size or get_fanout_batch_size())
+    return fan_out_notifications(
+        course, message, batches,
+        lambda user_id: f'material:{material.material_id}:user:{user_id}')
+
+# notifying the course creator about a new enrollment
+
+
+def fan_out_enrollment_notification(enrollment):
+    course = enrollment.course
+    student = enrollment.student
+    message = (f"'{student.first_name} {student.last_name}' has enrolled "
+               f"in '{course.title}'.")
+    return fan_out_notifications(
+        course, message, [[course.creator_id]],
+        lambda user_id: f'enrollment:{enrollment.enrollment_id}')
+
+# sending WebSocket notifications
+# every group_send of a batch is awaited concurrently inside one event loop
+
+
+def send_ws_notifications(payloads):
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not payloads:
+        return
+    async_to_sync(_group_send_many)(channel_layer, payloads)
+
+
+async def _group_send_many(channel_layer, payloads):
+    results = await asyncio.gather(*[
+        channel_layer.group_send(
+            f'notifications_{user_id}',
+            {
+                'type': 'send_notification',
+                'message': message,
+                'unread_count': unread_count,
+            }
+        ) for user_id, message, unread_count in payloads
+    ], return_exceptions=True)
+    for (user_id, _, _), result in zip(payloads, results):
+        if isinstance(result, Exception):
+            print(f"Error in send_ws_notifications for user {user_id}: {result}")
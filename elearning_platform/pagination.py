@@ -0,0 +1,116 @@
+import base64
+from collections.abc import Sequence
+from datetime import datetime
+from django.conf import settings
+from rest_framework.pagination import BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+"""
+Keyset (cursor) pagination
+"""
+# listings are ordered newest first on a (timestamp, primary key) pair that
+# is backed by an index. The cursor holds the last row of the page, so the
+# next page starts with an index seek: page N costs the same as page 1 and a
+# request never holds more than page_size rows.
+
+DEFAULT_LISTING_PAGE_SIZE = 20
+
+
+def get_page_size():
+    return getattr(settings, 'LISTING_PAGE_SIZE', DEFAULT_LISTING_PAGE_SIZE)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# cursors are url-safe base64 without padding, so links need no escaping
+
+
+def encode_cursor(value, pk):
+    position = f'{value.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        cursor += '=' * (-len(cursor) % 4)
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+        value, pk = position.rsplit('|', 1)
+        return datetime.fromisoformat(value), int(pk)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+# one page of rows, with the cursor of the following page (if any)
+
+
+class KeysetPage(Sequence):
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+# page of 'queryset' ordered on (-field, -pk), starting after 'cursor'
+
+
+def paginate_keyset(queryset, field, cursor=None, page_size=None):
+    page_size = page_size or get_page_size()
+    pk_name = queryset.model._meta.pk.name
+    queryset = queryset.order_by(f'-{field}', f'-{pk_name}')
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        # the range condition seeks the index, the exclude only drops ties
+        queryset = queryset.filter(**{f'{field}__lte': value}).exclude(
+            **{field: value, f'{pk_name}__gte': pk})
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        if isinstance(last, dict):
+            # rows projected with values()
+            next_cursor = encode_cursor(last[field], last[pk_name])
+        else:
+            next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(items, next_cursor)
+
+# DRF pagination using the same cursors
+# the view names its timestamp field in 'ordering_field'
+
+
+class KeysetCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate_keyset(
+                queryset, view.ordering_field,
+                request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_next_link(self):
+        if not self.page.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param,
+                                   self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
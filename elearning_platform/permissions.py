@@ -1,4 +1,5 @@
 from rest_framework.permissions import BasePermission
+from .roles import has_role
 from django.shortcuts import redirect
 from django.core.exceptions import PermissionDenied
 
@@ -10,14 +11,14 @@ Custom permissions
 
 class IsTeacher(BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='teacher').exists()
+        return has_role(request.user, 'teacher')
 
 # checking if the user is a student
 
 
 class IsStudent(BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='student').exists()
+        return has_role(request.user, 'student')
 
 
 # checking if the logged user is the creator
@@ -25,7 +26,8 @@ class IsStudent(BasePermission):
 
 class IsCreator(BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.creator == request.user
+        # compared by id, without loading the creator
+        return obj.creator_id == request.user.id
 
 
 """
@@ -41,7 +43,7 @@ def group_required(*group_names):
             # redirect to login if not authenticated
             if not request.user.is_authenticated:
                 return redirect('login')
-            if request.user.groups.filter(name__in=group_names).exists():
+            if has_role(request.user, *group_names):
                 return view_function(request, *args, **kwargs)
             # redirect to main page if not in group
             # return redirect('index')
@@ -0,0 +1,343 @@
+import codecs
+import io
+import mmap
+import multiprocessing
+import os
+import re
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+import django
+from PIL import Image
+from .models import Material, MaterialPreview
+from django.conf import settings
+
+"""
+Material post-processing
+"""
+# after a material is committed a background task (tasks.process_material,
+# queued only when there is a Celery broker) looks inside its file and stores
+# what it found in MaterialPreview: the listing of ZIP archives, read from the
+# central directory only, a JPEG thumbnail of images and the text of
+# documents, for search.
+# Files are read in bounded pieces (the text stops at MATERIAL_TEXT_MAX_LENGTH
+# characters) and the work runs in a pool of MATERIAL_PROCESSING_WORKERS
+# processes, so a large or malformed file can't stall the worker.
+# Materials sharing a stored file share its analysis.
+
+DEFAULT_MATERIAL_PROCESSING_WORKERS = 2
+DEFAULT_MATERIAL_MANIFEST_ENTRIES = 500
+DEFAULT_MATERIAL_TEXT_MAX_LENGTH = 100000
+DEFAULT_MATERIAL_THUMBNAIL_SIZE = 256
+
+READ_SIZE = 64 * 1024
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp')
+TEXT_EXTENSIONS = ('txt', 'csv', 'md')
+# XML parts of Office documents holding their text
+OFFICE_TEXT_PARTS = {
+    'docx': re.compile(r'word/document\.xml$'),
+    'pptx': re.compile(r'ppt/slides/slide(\d+)\.xml$'),
+    'xlsx': re.compile(r'xl/sharedStrings\.xml$'),
+}
+# PDF streams and the string operands of their text operators
+PDF_STREAM = re.compile(rb'(?<!end)stream\r?\n')
+PDF_TEXT = re.compile(rb'\(((?:\\.|[^\\)])*)\)\s*(?:Tj|\'|")|\[((?:\\.|[^\]])*)\]\s*TJ', re.S)
+PDF_STRING = re.compile(rb'\(((?:\\.|[^\\)])*)\)', re.S)
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'', b'f': b''}
+
+_executor = None
+
+
+def get_processing_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_processing_limits():
+    return {
+        'manifest_entries': get_processing_setting(
+            'MATERIAL_MANIFEST_ENTRIES', DEFAULT_MATERIAL_MANIFEST_ENTRIES),
+        'text_length': get_processing_setting(
+            'MATERIAL_TEXT_MAX_LENGTH', DEFAULT_MATERIAL_TEXT_MAX_LENGTH),
+        'thumbnail_size': get_processing_setting(
+            'MATERIAL_THUMBNAIL_SIZE', DEFAULT_MATERIAL_THUMBNAIL_SIZE),
+    }
+
+# collecting text pieces until 'limit' characters
+
+
+class TextCollector:
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.length = 0
+
+    @property
+    def full(self):
+        return self.length >= self.limit
+
+    def add(self, text):
+        text = text.strip()
+        if text and not self.full:
+            self.parts.append(text[:self.limit - self.length])
+            self.length += len(self.parts[-1]) + 1
+
+    def text(self):
+        return ' '.join(self.parts)
+
+# listing of a ZIP archive from its central directory, nothing is inflated
+
+
+def zip_manifest(path, max_entries):
+    manifest = []
+    entry_count = 0
+    uncompressed_size = 0
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            entry_count += 1
+            uncompressed_size += info.file_size
+            if len(manifest) < max_entries:
+                manifest.append({'name': info.filename, 'size': info.file_size,
+                                 'compressed_size': info.compress_size})
+    return manifest, entry_count, uncompressed_size
+
+# JPEG thumbnail of an image, decoded at reduced scale where the format
+# allows it (Pillow refuses images over Image.MAX_IMAGE_PIXELS)
+
+
+def image_thumbnail(path, size):
+    with Image.open(path) as image:
+        image.draft('RGB', (size, size))
+        image.thumbnail((size, size))
+        output = io.BytesIO()
+        image.convert('RGB').save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+
+def plain_text(path, limit):
+    collector = TextCollector(limit)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as file:
+        while not collector.full:
+            data = file.read(READ_SIZE)
+            if not data:
+                break
+            collector.add(decoder.decode(data))
+    return collector.text()
+
+# text elements of the document's XML parts, parsed as they are inflated
+
+
+def office_text(path, part_pattern, limit):
+    collector = TextCollector(limit)
+    with zipfile.ZipFile(path) as archive:
+        parts = [(match, name) for name in archive.namelist()
+                 if (match := part_pattern.match(name))]
+        # slides in presentation order
+        parts.sort(key=lambda part: int(part[0].group(1))
+                   if part[0].groups() else 0)
+        for _, name in parts:
+            with archive.open(name) as part:
+                for _, element in ElementTree.iterparse(part):
+                    if element.tag.endswith('}t') and element.text:
+                        collector.add(element.text)
+                    element.clear()
+                    if collector.full:
+                        return collector.text()
+    return collector.text()
+
+
+def pdf_string(value):
+    return re.sub(rb'\\(.)', lambda match: PDF_ESCAPES.get(
+        match.group(1), match.group(1)), value, flags=re.S).decode('latin-1')
+
+# decoded content of a PDF stream, at most 'limit' bytes
+
+
+def pdf_stream(data, start, end, flate, limit):
+    if not flate:
+        return bytes(data[start:min(end, start + limit)])
+    inflater = zlib.decompressobj()
+    output = []
+    size = 0
+    for offset in range(start, end, READ_SIZE):
+        piece = inflater.decompress(
+            data[offset:min(end, offset + READ_SIZE)], limit - size)
+        output.append(piece)
+        size += len(piece)
+        if size >= limit or inflater.eof:
+            break
+    return b''.join(output)
+
+# literal strings shown by the text operators of the page streams
+# (fonts with custom encodings give no usable text)
+
+
+def pdf_text(path, limit):
+    collector = TextCollector(limit)
+    with open(path, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        position = 0
+        while match := PDF_STREAM.search(data, position):
+            start = match.end()
+            end = data.find(b'endstream', start)
+            if end < 0:
+                break
+            position = end + len(b'endstream')
+            dictionary = data[data.rfind(b'obj', 0, match.start()):match.start()]
+            if b'/Subtype/Image' in dictionary.replace(b' ', b''):
+                continue
+            try:
+                content = pdf_stream(data, start, end,
+                                     b'/FlateDecode' in dictionary, limit * 4)
+            except zlib.error:
+                continue
+            if b'BT' not in content:
+                continue
+            for text_match in PDF_TEXT.finditer(content):
+                single, array = text_match.groups()
+                if single is not None:
+                    collector.add(pdf_string(single))
+                else:
+                    collector.add(''.join(pdf_string(string) for string in
+                                          PDF_STRING.findall(array)))
+                if collector.full:
+                    return collector.text()
+    return collector.text()
+
+# everything post-processing stores for one file
+# runs in the pool processes: no database access, plain values in and out
+
+
+def analyse_material_file(path, file_name, limits):
+    extension = os.path.splitext(file_name)[1].lstrip('.').lower()
+    result = {'manifest': [], 'entry_count': 0, 'uncompressed_size': 0,
+              'thumbnail': None, 'text': ''}
+    if extension == 'zip':
+        (result['manifest'], result['entry_count'],
+         result['uncompressed_size']) = zip_manifest(
+            path, limits['manifest_entries'])
+    elif extension in IMAGE_EXTENSIONS:
+        result['thumbnail'] = image_thumbnail(path, limits['thumbnail_size'])
+    elif extension in OFFICE_TEXT_PARTS:
+        result['text'] = office_text(
+            path, OFFICE_TEXT_PARTS[extension], limits['text_length'])
+    elif extension == 'pdf':
+        result['text'] = pdf_text(path, limits['text_length'])
+    elif extension in TEXT_EXTENSIONS:
+        result['text'] = plain_text(path, limits['text_length'])
+    return result
+
+# the shared process pool, None to work in the calling process
+# (MATERIAL_PROCESSING_WORKERS = 0, or daemonic processes such as celery's
+# prefork children, which can't start their own)
+
+
+def get_executor():
+    global _executor
+    workers = get_processing_setting(
+        'MATERIAL_PROCESSING_WORKERS', DEFAULT_MATERIAL_PROCESSING_WORKERS)
+    if workers <= 0 or multiprocessing.current_process().daemon:
+        return None
+    if _executor is None:
+        # spawned workers load the apps before their first job
+        _executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+# running the analyses of several (path, file name) pairs, in parallel
+# when there is a pool; yields a result dict or the raised exception
+
+
+def analyse_files(jobs):
+    limits = get_processing_limits()
+    executor = get_executor()
+    if executor is not None:
+        futures = [executor.submit(analyse_material_file, path, name, limits)
+                   for path, name in jobs]
+        for future in futures:
+            try:
+                yield future.result()
+            except BrokenProcessPool:
+                shutdown_executor()
+                raise
+            except Exception as error:
+                yield error
+        return
+    for path, name in jobs:
+        try:
+            yield analyse_material_file(path, name, limits)
+        except Exception as error:
+            yield error
+
+
+def save_preview(material, result):
+    fields = {'status': 'processed', 'error': ''}
+    if isinstance(result, Exception):
+        fields = {'status': 'failed', 'manifest': [], 'entry_count': 0,
+                  'uncompressed_size': 0, 'thumbnail': None, 'text': '',
+                  'error': f'{type(result).__name__}: {result}'[:255]}
+    else:
+        fields.update(result)
+    preview, _ = MaterialPreview.objects.update_or_create(
+        material_id=material.material_id, defaults=fields)
+    return preview
+
+# analysis already stored for another material with the same file
+
+
+def find_shared_preview(material):
+    return MaterialPreview.objects.filter(
+        material__material_path=material.material_path.name,
+        status='processed').exclude(material_id=material.material_id).first()
+
+# post-processing the given materials, returns their previews
+
+
+def process_materials(materials):
+    previews = []
+    pending = []
+    for material in materials:
+        shared = find_shared_preview(material)
+        if shared is not None:
+            # copied to this material (the primary key is the material)
+            shared.material_id = material.material_id
+            shared.save()
+            previews.append(shared)
+        elif not material.material_path:
+            previews.append(save_preview(material, ValueError('No file.')))
+        else:
+            pending.append(material)
+    results = analyse_files([(material.material_path.path,
+                              material.material_name) for material in pending])
+    for material, result in zip(pending, results):
+        previews.append(save_preview(material, result))
+    return previews
+
+# post-processing the materials without a preview ('reprocess' for all)
+
+
+def process_pending_materials(reprocess=False, batch_size=100):
+    materials = Material.objects.order_by('material_id')
+    if not reprocess:
+        materials = materials.filter(preview__isnull=True)
+    processed = 0
+    last_pk = 0
+    while True:
+        batch = list(materials.filter(material_id__gt=last_pk)[:batch_size])
+        if not batch:
+            return processed
+        processed += len(process_materials(batch))
+        last_pk = batch[-1].material_id
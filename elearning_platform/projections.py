@@ -0,0 +1,153 @@
+import datetime
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+
+"""
+Read-only row projection
+"""
+# list endpoints don't build model instances and run them through the DRF
+# field machinery: the queryset is narrowed with values() to the columns the
+# serializer shows, and each row dict is turned into the serializer's output
+# by a field plan, a list of (name, column, converter) derived once per
+# serializer class. Columns that are already JSON values (ids, text, numbers,
+# booleans) are copied as they are, dates and links get a converter giving
+# the same output as the DRF field. Files are not listed by their media URL
+# (MEDIA_URL is not served), but linked through their view.
+
+# DRF fields whose representation of a database value is the value itself
+PLAIN_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.JSONField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+_field_plans = {}
+
+
+def is_iso_format(field, default):
+    output_format = getattr(field, 'format', default)
+    return output_format is not None and output_format.lower() == ISO_8601
+
+# converters are made per serialization (bound to the request), so what
+# depends on it is looked up once and not per row
+
+
+def datetime_converter(field):
+    if not is_iso_format(field, api_settings.DATETIME_FORMAT):
+        return lambda request: field.to_representation
+
+    def bind(request):
+        zone = None
+        if settings.USE_TZ:
+            zone = getattr(field, 'timezone', None) or \
+                timezone.get_current_timezone()
+
+        def convert(value):
+            if zone is not None and value.tzinfo is not None:
+                value = value.astimezone(zone)
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+    return bind
+
+
+def date_converter(field):
+    if not is_iso_format(field, api_settings.DATE_FORMAT):
+        return lambda request: field.to_representation
+    return lambda request: datetime.date.isoformat
+
+# HyperlinkedIdentityField: the lookup column gives the (absolute) URL of
+# the field's view
+
+
+def link_converter(field):
+    def bind(request):
+        def convert(value):
+            return reverse(field.view_name,
+                           kwargs={field.lookup_url_kwarg: value},
+                           request=request)
+        return convert
+    return bind
+
+# converter of a field's values given the request, None when the values
+# are shown as they are
+
+
+def get_converter(field):
+    if isinstance(field, PLAIN_FIELDS):
+        return None
+    if isinstance(field, serializers.DateTimeField):
+        return datetime_converter(field)
+    if isinstance(field, serializers.DateField):
+        return date_converter(field)
+    return lambda request: field.to_representation
+
+# (name, column, converter or None) of every field of a read-only listing
+
+
+def get_field_plan(serializer_class):
+    plan = _field_plans.get(serializer_class)
+    if plan is None:
+        plan = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.HyperlinkedIdentityField):
+                plan.append((name, field.lookup_field, link_converter(field)))
+                continue
+            if field.source == '*' or '.' in field.source or \
+                    isinstance(field, serializers.SerializerMethodField):
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} is not a column, '
+                    f'it can\'t be projected.')
+            if isinstance(field, serializers.FileField):
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} is a file, link it '
+                    f'with a HyperlinkedIdentityField to its view.')
+            plan.append((name, field.source, get_converter(field)))
+        plan = _field_plans[serializer_class] = tuple(plan)
+    return plan
+
+# the queryset as row dicts holding the plan's columns (and 'extra' ones,
+# e.g. what pagination orders on)
+
+
+def project_queryset(queryset, plan, extra=()):
+    columns = dict.fromkeys([column for _, column, _ in plan] + list(extra))
+    return queryset.values(*columns)
+
+
+def serialize_rows(rows, plan, request=None):
+    converters = [(name, column, bind and bind(request))
+                  for name, column, bind in plan]
+    data = []
+    for row in rows:
+        item = {}
+        for name, column, convert in converters:
+            value = row[column]
+            item[name] = value if convert is None or value is None \
+                else convert(value)
+        data.append(item)
+    return data
+
+# list endpoints serializing through the field plan of their serializer
+# (paginated, the pagination orders on the view's 'ordering_field')
+
+
+class ProjectedListMixin:
+
+    def list(self, request, *args, **kwargs):
+        plan = get_field_plan(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset(project_queryset(
+            queryset, plan, [self.ordering_field, queryset.model._meta.pk.name]))
+        return self.get_paginated_response(serialize_rows(rows, plan, request))
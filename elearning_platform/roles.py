@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import cache
+
+"""
+User roles (auth groups)
+"""
+# group names are loaded once per user object, i.e. once per request, and
+# shared across requests through the cache for ROLE_CACHE_TIMEOUT seconds
+# (0 disables the shared cache). Entries are dropped by signals.py when the
+# user's groups change.
+
+DEFAULT_ROLE_CACHE_TIMEOUT = 300
+
+
+def get_role_cache_timeout():
+    return getattr(settings, 'ROLE_CACHE_TIMEOUT', DEFAULT_ROLE_CACHE_TIMEOUT)
+
+
+def role_cache_key(user_id):
+    return f'user_roles:{user_id}'
+
+# names of the groups the user belongs to
+
+
+def get_user_roles(user):
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_role_names', None)
+    if roles is None:
+        timeout = get_role_cache_timeout()
+        if timeout:
+            roles = cache.get(role_cache_key(user.pk))
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            if timeout:
+                cache.set(role_cache_key(user.pk), roles, timeout)
+        user._role_names = roles
+    return roles
+
+# checking if the user is in at least one of the groups
+
+
+def has_role(user, *role_names):
+    return not get_user_roles(user).isdisjoint(role_names)
+
+# first of the given roles the user has (e.g. to label chat messages)
+
+
+def get_primary_role(user, *role_names):
+    roles = get_user_roles(user)
+    for role_name in role_names:
+        if role_name in roles:
+            return role_name
+    return None
+
+# dropping cached roles of users whose groups changed
+
+
+def invalidate_user_roles(user_ids):
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
@@ -6,4 +6,6 @@ websocket_urlpatterns = [
             consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/notifications/$',
             consumers.NotificationConsumer.as_asgi()),
+    # notifications and chat rooms on one socket
+    re_path(r'ws/$', consumers.MultiplexConsumer.as_asgi()),
 ]
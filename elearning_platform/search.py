@@ -0,0 +1,342 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from .models import UserSearchEntry
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+
+"""
+User search index
+"""
+# UserSearchAPI looks users up in UserSearchEntry rather than scanning
+# auth_user: on SQLite through an FTS5 table (prefix indexes, bm25 ranking),
+# on PostgreSQL through a trigram index. Every query returns the rows ready
+# to serialize, group name included, in a single statement.
+# Entries are refreshed by signals.py whenever a user or their groups change.
+
+SEARCH_ROLES = ('student', 'teacher')
+DEFAULT_USER_SEARCH_LIMIT = 20
+FTS_TABLE = 'elearning_platform_usersearch_fts'
+ENTRY_TABLE = UserSearchEntry._meta.db_table
+SEARCH_COLUMNS = 'user_id, username, first_name, last_name, group_name'
+# text matched on PostgreSQL (the expression of the trigram index)
+TRIGRAM_DOCUMENT = "lower(username || ' ' || first_name || ' ' || last_name)"
+
+DEFAULT_USER_SEARCH_CACHE_SIZE = 5000
+DEFAULT_USER_SEARCH_CACHE_TTL = 60
+
+# per-connection cache of 'is the FTS5 table there?'
+_fts_available = {}
+
+
+def get_search_limit():
+    return getattr(settings, 'USER_SEARCH_LIMIT', DEFAULT_USER_SEARCH_LIMIT)
+
+# words of the query, split the way the FTS5 unicode61 tokenizer splits them
+
+
+def tokenize(query):
+    return re.findall(r'[^\W_]+', query.lower())
+
+# search entries of the given users (their groups prefetched)
+
+
+def build_search_entries(users):
+    entries = []
+    for user in users:
+        group_names = [group.name for group in sorted(
+            user.groups.all(), key=lambda group: group.pk)]
+        if not set(SEARCH_ROLES) & set(group_names):
+            continue
+        entries.append(UserSearchEntry(
+            user_id=user.pk, username=user.username,
+            first_name=user.first_name, last_name=user.last_name,
+            group_name=group_names[0],
+            is_student='student' in group_names,
+            is_teacher='teacher' in group_names))
+    return entries
+
+
+def _save_entries(entries):
+    UserSearchEntry.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=['user'],
+        update_fields=['username', 'first_name', 'last_name', 'group_name',
+                       'is_student', 'is_teacher'])
+    return len(entries)
+
+# re-indexing users whose name or groups changed
+# users that are neither students nor teachers are dropped from the index
+
+
+def refresh_search_entries(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    entries = build_search_entries(
+        User.objects.filter(pk__in=user_ids).prefetch_related('groups'))
+    UserSearchEntry.objects.filter(user_id__in=user_ids).exclude(
+        user_id__in=[entry.user_id for entry in entries]).delete()
+    _save_entries(entries)
+    discard_cached_searches(user_ids, [
+        tokenize(f'{entry.username} {entry.first_name} {entry.last_name}')
+        for entry in entries])
+
+# re-indexing every user
+
+
+def rebuild_search_index(batch_size=1000):
+    indexed = 0
+    last_pk = 0
+    users = User.objects.order_by('pk').prefetch_related('groups')
+    search_cache.clear()
+    with transaction.atomic():
+        UserSearchEntry.objects.all().delete()
+        while True:
+            batch = list(users.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                return indexed
+            indexed += _save_entries(build_search_entries(batch))
+            last_pk = batch[-1].pk
+
+
+def has_fts_index():
+    if connection.alias not in _fts_available:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [FTS_TABLE])
+            _fts_available[connection.alias] = cursor.fetchone() is not None
+    return _fts_available[connection.alias]
+
+# best matching students / teachers for 'query', each word a prefix
+# 'group' restricts the results to one role
+
+
+def search_users(query, group=None, limit=None):
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    limit = limit or get_search_limit()
+    role_filter = {'student': 'is_student', 'teacher': 'is_teacher'}.get(group)
+    if connection.vendor == 'sqlite' and has_fts_index():
+        rows = _search_fts(tokens, role_filter, limit)
+    elif connection.vendor == 'postgresql':
+        rows = _search_trigram(tokens, role_filter, limit)
+    else:
+        rows = _search_entries(tokens, role_filter, limit)
+    return [
+        {
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'id': user_id,
+            'group': group_name,
+        } for user_id, username, first_name, last_name, group_name in rows
+    ]
+
+# SQLite: prefix query on the FTS5 table, username matches weigh most
+
+
+def _search_fts(tokens, role_filter, limit):
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    role_condition = f'AND entry.{role_filter}' if role_filter else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT entry.user_id, entry.username, entry.first_name,
+                   entry.last_name, entry.group_name
+            FROM {FTS_TABLE}
+            JOIN {ENTRY_TABLE} entry ON entry.user_id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s {role_condition}
+            ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 5.0), entry.username
+            LIMIT %s""", [match, limit])
+        return cursor.fetchall()
+
+# PostgreSQL: every word must start a word of the document (trigram index),
+# ranked by word similarity
+
+
+def _search_trigram(tokens, role_filter, limit):
+    conditions = [f"{TRIGRAM_DOCUMENT} ~ %s" for _ in tokens]
+    if role_filter:
+        conditions.append(role_filter)
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {SEARCH_COLUMNS}
+            FROM {ENTRY_TABLE}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY word_similarity(%s, {TRIGRAM_DOCUMENT}) DESC, username
+            LIMIT %s""",
+            [f'(^|[^[:alnum:]]){token}' for token in tokens]
+            + [' '.join(tokens), limit])
+        return cursor.fetchall()
+
+# other backends: prefix match on the entry columns
+
+
+def _search_entries(tokens, role_filter, limit):
+    entries = UserSearchEntry.objects.all()
+    for token in tokens:
+        entries = entries.filter(
+            Q(username__istartswith=token) |
+            Q(first_name__istartswith=token) |
+            Q(last_name__istartswith=token))
+    if role_filter:
+        entries = entries.filter(**{role_filter: True})
+    return list(entries.order_by('username').values_list(
+        *SEARCH_COLUMNS.split(', '))[:limit])
+
+
+"""
+In-process typeahead cache
+"""
+# live search sends one request per keystroke, mostly for prefixes seen
+# before. Every worker keeps the results of recent queries in an LRU map of
+# at most USER_SEARCH_CACHE_SIZE queries (0 disables it). A query whose
+# shorter prefix returned fewer rows than the limit (i.e. every match) is
+# answered by filtering those rows, without SQL.
+# Changes made by this process drop the affected entries right away
+# (refresh_search_entries); changes made by other workers are picked up
+# after USER_SEARCH_CACHE_TTL seconds.
+
+
+def get_search_cache_size():
+    return getattr(settings, 'USER_SEARCH_CACHE_SIZE',
+                   DEFAULT_USER_SEARCH_CACHE_SIZE)
+
+
+def get_search_cache_ttl():
+    return getattr(settings, 'USER_SEARCH_CACHE_TTL',
+                   DEFAULT_USER_SEARCH_CACHE_TTL)
+
+# checking that every query word starts one of the words
+
+
+def matches_tokens(words, tokens):
+    return all(any(word.startswith(token) for word in words)
+               for token in tokens)
+
+# shorter queries matching a superset of users: 'ada qu' -> 'ada q', 'ada'
+
+
+def prefix_ancestors(tokens):
+    *head, last = tokens
+    for end in range(len(last) - 1, 0, -1):
+        yield (*head, last[:end])
+    if head:
+        yield tuple(head)
+
+
+class SearchCacheEntry:
+    def __init__(self, rows, complete, created_at):
+        # (row, words of the row) pairs, in ranking order
+        self.rows = rows
+        # True when rows hold every match, not just the first 'limit'
+        self.complete = complete
+        self.created_at = created_at
+
+
+# shared by the request threads of a worker: the entries and counters are
+# only touched holding 'lock' (_get, _put and _derive expect it held), the
+# database is queried without it
+
+
+class UserSearchCache:
+    def __init__(self, clock=time.monotonic):
+        self.entries = OrderedDict()
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self.clock() - entry.created_at > get_search_cache_ttl():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        # evicting the least recently used queries
+        while len(self.entries) > get_search_cache_size():
+            self.entries.popitem(last=False)
+
+    def search(self, query, group=None, limit=None):
+        tokens = tuple(tokenize(query))
+        if not tokens:
+            return []
+        limit = limit or get_search_limit()
+        max_limit = get_search_limit()
+        key = (group, tokens)
+        with self.lock:
+            entry = self._get(key)
+            if entry is None:
+                entry = self._derive(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            rows = search_users(query, group, max_limit + 1)
+            entry = SearchCacheEntry(
+                [(row, tokenize(f"{row['username']} {row['first_name']} "
+                                f"{row['last_name']}")) for row in rows[:max_limit]],
+                len(rows) <= max_limit, self.clock())
+            with self.lock:
+                self._put(key, entry)
+        return [row for row, _ in entry.rows[:limit]]
+
+    # filtering the rows of a complete, cached shorter query
+
+    def _derive(self, key):
+        group, tokens = key
+        for ancestor in prefix_ancestors(tokens):
+            parent = self._get((group, ancestor))
+            if parent is not None and parent.complete:
+                entry = SearchCacheEntry(
+                    [(row, words) for row, words in parent.rows
+                     if matches_tokens(words, tokens)],
+                    True, parent.created_at)
+                self._put(key, entry)
+                return entry
+        return None
+
+    # dropping queries that returned these users or that their current
+    # names ('words' of each entry) now match
+
+    def discard_users(self, user_ids, words_list):
+        user_ids = set(user_ids)
+        with self.lock:
+            for key in list(self.entries):
+                _, tokens = key
+                if any(row['id'] in user_ids for row, _ in self.entries[key].rows) \
+                        or any(matches_tokens(words, tokens) for words in words_list):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+search_cache = UserSearchCache()
+
+# dropping this process' cached queries affected by changed users
+
+
+def discard_cached_searches(user_ids, words_list=()):
+    search_cache.discard_users(user_ids, words_list)
+
+# search used by the API: through the cache unless it is disabled
+
+
+def cached_search_users(query, group=None, limit=None):
+    if get_search_cache_size() <= 0:
+        return search_users(query, group, limit)
+    return search_cache.search(query, group, limit)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import *
+from .uploads import received_chunks
 from django.contrib.auth.models import User
 
 # Serializer models - for converting complex data types into python data types that would be rendered to JSON,XML, etc.
@@ -47,17 +48,37 @@ class CourseSerializer(serializers.ModelSerializer):
 
 
 class MaterialSerializer(serializers.ModelSerializer):
+    # media files are not served: the file is linked through its download view
+    material_path = serializers.HyperlinkedIdentityField(
+        view_name='download_material')
 
     class Meta:
         model = Material
         fields = '__all__'
 
 
+# chunked upload state, with the indexes of the chunks received so far
+
+
+class MaterialUploadSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+    received = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MaterialUpload
+        fields = ['upload_id', 'course', 'file_name', 'size', 'chunk_size',
+                  'chunk_count', 'received', 'sha256', 'material']
+        read_only_fields = ['upload_id', 'chunk_size', 'sha256', 'material']
+
+    def get_received(self, upload):
+        return received_chunks(upload)
+
+
 class NotificationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Notification
-        fields = '__all__'
+        exclude = ['dedupe_key']
 
 
 class FeedbackSerializer(serializers.ModelSerializer):
@@ -67,6 +88,13 @@ class FeedbackSerializer(serializers.ModelSerializer):
         fields = ['course', 'message']
 
 
+class FeedbackListSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Feedback
+        fields = ['feedback_id', 'course', 'user', 'message', 'sent_at']
+
+
 class ChatSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -1,66 +1,281 @@
-from .models import Material, Notification, Enrollment
+from .models import Course, Material, MaterialPreview, Enrollment, Feedback, Notification
+from .tasks import (deliver_material_notifications, deliver_enrollment_notification,
+                    process_material)
+from .notifications import increment_unread_counts, decrement_unread_count
+from .roles import invalidate_user_roles
+from .search import refresh_search_entries, discard_cached_searches
+from .blobs import release_material_file
+from .catalog import save_catalog_entry, update_catalog_count, rename_catalog_creator
+from .fragments import bump_course_versions
+from .websocket_auth import discard_cached_session, revoke_session_users
+from django.contrib.auth.models import User, Group
+from django.contrib.auth.signals import user_logged_out
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 
-# inserting notification in db for each course material added by the teacher
+# notifications are written and pushed by background tasks
+# the jobs are queued once the triggering row is committed
+
+# queue notifications and post-processing for each course material added
+# by the teacher (post-processing needs a broker: without one tasks would
+# run in the web process, so it is left to the process_materials command)
 
 
 @receiver(post_save, sender=Material)
 def insert_material_notification(sender, instance, created, **kwargs):
     if created:
-        # searching for all students enrolled in the course
-        enrollments = Enrollment.objects.filter(
-            course=instance.course, blocked=False)
-        # inserting notification for each student enrolled
-        for enrollment in enrollments:
-            notification = Notification.objects.create(
-                user=enrollment.student,
-                course=instance.course,
-                message=f"'{instance.material_name}' added to the course '{
-                    instance.course.title}'.",
-                is_read=False
-            )
-            # send notification through WebSocket
-            send_ws_notification(notification)
-
-# inserting notification in db for each student enrollment
+        material_id = instance.material_id
+        transaction.on_commit(
+            lambda: deliver_material_notifications.delay(material_id))
+        if not getattr(settings, 'CELERY_TASK_ALWAYS_EAGER', False):
+            transaction.on_commit(
+                lambda: process_material.delay(material_id))
+
+# queue notification for each student enrollment
 
 
 @receiver(post_save, sender=Enrollment)
 def insert_enrollment_notification(sender, instance, created, **kwargs):
     if created:
-        # inserting notification for the course creator
-        notification = Notification.objects.create(
-            user=instance.course.creator,
-            course=instance.course,
-            message=f"'{instance.student.first_name} {
-                instance.student.last_name}' has enrolled in '{instance.course.title}'.",
-            is_read=False
-        )
-        # send notification through WebSocket
-        send_ws_notification(notification)
-
-# sending WebSocket notificaiton
-# this is used for live
-
-
-def send_ws_notification(notification):
-    channel_layer = get_channel_layer()
-    group_name = f'notifications_{notification.user.id}'
-    unread_count = Notification.objects.filter(
-        user=notification.user, is_read=False).count()
-    try:
-        print(f"SIGNALS: Sending message to group {
-              group_name}: {notification.message}")
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': 'send_notification',
-                'message': notification.message,
-                'unread_count': unread_count,
-            }
-        )
-    except Exception as e:
-        print(f"Error in send_ws_notification: {e}")
+        enrollment_id = instance.enrollment_id
+        transaction.on_commit(
+            lambda: deliver_enrollment_notification.delay(enrollment_id))
+
+
+# keeping the unread counter in sync for notifications saved one by one
+# (bulk inserts of the fan-out engine update the counters themselves)
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_counter_on_save(sender, instance, created, **kwargs):
+    was_read = getattr(instance, '_loaded_is_read', None)
+    if created:
+        if not instance.is_read:
+            increment_unread_counts([instance.user_id])
+    elif was_read is not None and was_read != instance.is_read:
+        if instance.is_read:
+            decrement_unread_count(instance.user_id)
+        else:
+            increment_unread_counts([instance.user_id])
+    instance._loaded_is_read = instance.is_read
+
+
+@receiver(post_delete, sender=Notification)
+def update_unread_counter_on_delete(sender, instance, **kwargs):
+    if not instance.is_read:
+        decrement_unread_count(instance.user_id)
+
+
+# dropping cached roles when group membership changes
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if not reverse:
+        # user.groups changed
+        instance.__dict__.pop('_role_names', None)
+        invalidate_user_roles([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear(): members are only known before clearing
+        invalidate_user_roles(
+            instance.user_set.values_list('pk', flat=True))
+    elif pk_set:
+        # group.user_set changed
+        invalidate_user_roles(pk_set)
+
+# group renamed / deleted: every member's roles change
+
+
+@receiver(post_save, sender=Group)
+def invalidate_roles_on_group_rename(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_user_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def invalidate_roles_on_group_delete(sender, instance, **kwargs):
+    invalidate_user_roles(instance.user_set.values_list('pk', flat=True))
+
+# new user rows may reuse the id of a deleted user
+
+
+@receiver(post_save, sender=User)
+def invalidate_roles_on_user_create(sender, instance, created, **kwargs):
+    if created:
+        invalidate_user_roles([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def invalidate_roles_on_user_delete(sender, instance, **kwargs):
+    invalidate_user_roles([instance.pk])
+
+# keeping the user search index in sync with names and groups
+# (logins only update last_login, which is not indexed)
+
+SEARCHED_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def update_search_entry_on_user_save(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None
+                   and not SEARCHED_USER_FIELDS & set(update_fields)):
+        # new users have no groups yet
+        return
+    refresh_search_entries([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def update_search_entries_on_membership_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_search_entries([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_user_ids = list(
+            instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_search_entries(instance.__dict__.pop('_cleared_user_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_search_entries(pk_set)
+
+
+@receiver(post_save, sender=Group)
+def update_search_entries_on_group_rename(sender, instance, created, **kwargs):
+    if not created:
+        refresh_search_entries(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_members(sender, instance, **kwargs):
+    instance._member_ids = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def update_search_entries_on_group_delete(sender, instance, **kwargs):
+    refresh_search_entries(instance.__dict__.pop('_member_ids', []))
+
+
+# deleted users leave the search index with their entry (cascade)
+
+
+@receiver(post_delete, sender=User)
+def discard_cached_searches_on_user_delete(sender, instance, **kwargs):
+    discard_cached_searches([instance.pk])
+
+
+# counting the materials sharing each stored file (the storage took the
+# reference when the file was saved); the file is unlinked after the
+# deletion of its last material commits
+
+
+@receiver(post_delete, sender=Material)
+def release_material_file_on_delete(sender, instance, **kwargs):
+    if instance.material_path:
+        release_material_file(instance.material_path.name)
+
+
+# keeping the course catalogue rows in step with their course, enrollments
+# and materials
+
+
+@receiver(post_save, sender=Course)
+def save_catalog_entry_on_course_save(sender, instance, **kwargs):
+    save_catalog_entry(instance)
+
+
+@receiver(post_save, sender=Enrollment)
+def count_catalog_enrollment_on_create(sender, instance, created, **kwargs):
+    if created:
+        update_catalog_count(instance.course_id, 'enrollment_count', 1,
+                             instance.enrolled_at)
+
+
+@receiver(post_delete, sender=Enrollment)
+def count_catalog_enrollment_on_delete(sender, instance, **kwargs):
+    update_catalog_count(instance.course_id, 'enrollment_count', -1)
+
+
+@receiver(post_save, sender=Material)
+def count_catalog_material_on_create(sender, instance, created, **kwargs):
+    if created:
+        update_catalog_count(instance.course_id, 'material_count', 1,
+                             instance.added_at)
+
+
+@receiver(post_delete, sender=Material)
+def count_catalog_material_on_delete(sender, instance, **kwargs):
+    update_catalog_count(instance.course_id, 'material_count', -1)
+
+
+@receiver(post_save, sender=User)
+def rename_catalog_creator_on_user_save(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None
+                   and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    rename_catalog_creator(instance)
+
+
+# invalidating the cached fragments of a course when it or its rows change
+# (and again on commit: a page rendered in between may show the old rows)
+
+
+def invalidate_course_fragments(course_ids):
+    course_ids = list(course_ids)
+    if course_ids:
+        bump_course_versions(course_ids)
+        transaction.on_commit(lambda: bump_course_versions(course_ids))
+
+
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=Enrollment)
+@receiver([post_save, post_delete], sender=Feedback)
+def invalidate_course_fragments_on_change(sender, instance, **kwargs):
+    invalidate_course_fragments([instance.course_id])
+
+
+@receiver([post_save, post_delete], sender=MaterialPreview)
+def invalidate_course_fragments_on_preview_change(sender, instance, **kwargs):
+    invalidate_course_fragments(Material.objects.filter(
+        material_id=instance.material_id).values_list('course_id', flat=True))
+
+# names are shown on the pages of courses the user created, enrolled in or
+# uploaded to
+
+
+@receiver(post_save, sender=User)
+def invalidate_course_fragments_on_user_rename(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None
+                   and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    invalidate_course_fragments(
+        list(instance.courses.values_list('course_id', flat=True))
+        + list(instance.materials.values_list('course_id', flat=True))
+        + list(instance.enrollments.values_list('course_id', flat=True)))
+
+# revoking the websocket users cached for the sessions of a user that logged
+# out, changed their password or was otherwise changed (logins only update
+# last_login)
+
+
+@receiver(user_logged_out)
+def revoke_session_users_on_logout(sender, request, user, **kwargs):
+    discard_cached_session(request.session.session_key)
+    if user is not None:
+        revoke_session_users([user.pk])
+
+
+@receiver(post_save, sender=User)
+def revoke_session_users_on_user_save(sender, instance, created, update_fields, **kwargs):
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    revoke_session_users([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def revoke_session_users_on_user_delete(sender, instance, **kwargs):
+    revoke_session_users([instance.pk])
@@ -212,26 +212,122 @@ function blockStudent(enrollmentId, isBlocked) {
     }
 }
 
-// student & teacher:  event listener to handle WebSocket notifications
-document.addEventListener('DOMContentLoaded', function () {
-    // initializing the WebSocket for notifications
-    const notificationSocket = new WebSocket('ws://' + window.location.host + '/ws/notifications/');
-
-    notificationSocket.onopen = function(e) {
-        console.log('WebSocket Notifications connection opened');
+// opening a WebSocket that reconnects when it closes unexpectedly
+// the delay grows exponentially with full jitter, so pages reconnecting
+// after a restart spread out; a busy server refuses the socket with code
+// 4429 or 4503 and says in 'retry_after' (seconds) when to come back
+const SOCKET_RETRY_BASE_DELAY = 1000;
+const SOCKET_RETRY_MAX_DELAY = 60000;
+// open this long (ms) before the delay starts from the base again
+const SOCKET_STABLE_AFTER = 10000;
+const SOCKET_REFUSED_CODES = [4429, 4503];
+let pageUnloading = false;
+window.addEventListener('beforeunload', () => { pageUnloading = true; });
+
+function openReconnectingSocket(path, onMessage, onOpen) {
+    const connection = {
+        socket: null,
+        send(data) {
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.socket.send(data);
+            }
+        },
     };
+    let attempt = 0;
+
+    function connect() {
+        const socket = new WebSocket('ws://' + window.location.host + path);
+        let openedAt = null;
+        let retryAfter = null;
+        connection.socket = socket;
+
+        socket.onopen = function () {
+            openedAt = Date.now();
+            if (onOpen) {
+                onOpen();
+            }
+        };
+        socket.onmessage = function (e) {
+            const data = JSON.parse(e.data);
+            // heartbeat: the server reaps sockets that stop answering
+            if (data.type === 'ping') {
+                socket.send(JSON.stringify({type: 'pong'}));
+                return;
+            }
+            if (data.retry_after !== undefined) {
+                retryAfter = data.retry_after * 1000;
+                return;
+            }
+            onMessage(data);
+        };
+        socket.onclose = function (e) {
+            // closed by the server on purpose, or leaving the page
+            if (e.code === 1000 || pageUnloading) {
+                return;
+            }
+            if (openedAt && Date.now() - openedAt >= SOCKET_STABLE_AFTER) {
+                attempt = 0;
+            }
+            let delay;
+            if (SOCKET_REFUSED_CODES.includes(e.code) && retryAfter !== null) {
+                // already jittered by the server
+                delay = retryAfter;
+            } else {
+                const ceiling = Math.min(SOCKET_RETRY_MAX_DELAY, SOCKET_RETRY_BASE_DELAY * 2 ** attempt);
+                delay = Math.random() * ceiling;
+            }
+            attempt++;
+            console.warn(`Socket ${path} closed (${e.code}), reconnecting in ${Math.round(delay)} ms`);
+            setTimeout(connect, delay);
+        };
+    }
 
-    notificationSocket.onmessage = function(e) {
-        const data = JSON.parse(e.data);
+    connect();
+    return connection;
+}
+
+// one socket per tab carries the notifications and chat rooms of the page
+// as topics ('notifications', 'chat:<room>'); subscriptions are sent again
+// whenever it reconnects
+const topicHandlers = {};
+let pageSocket = null;
+
+function sendToTopic(topic, frame) {
+    pageSocket.send(JSON.stringify({topic: topic, ...frame}));
+}
+
+function subscribeTopic(topic, handler) {
+    topicHandlers[topic] = handler;
+    if (!pageSocket) {
+        pageSocket = openReconnectingSocket('/ws/', function (data) {
+            if (data.topic === undefined) {
+                // frames skipped while the page was slow, shown by every topic
+                for (const topicHandler of Object.values(topicHandlers)) {
+                    topicHandler(data);
+                }
+            } else if (topicHandlers[data.topic]) {
+                topicHandlers[data.topic](data);
+            }
+        }, function () {
+            for (const subscribed of Object.keys(topicHandlers)) {
+                sendToTopic(subscribed, {action: 'subscribe'});
+            }
+        });
+    } else {
+        sendToTopic(topic, {action: 'subscribe'});
+    }
+}
+
+// student & teacher:  event listener to handle WebSocket notifications
+document.addEventListener('DOMContentLoaded', function () {
+    subscribeTopic('notifications', function (data) {
+        if (data.message === undefined) {
+            return;
+        }
         console.log('SCRIPT - OnMessage: this is your message: ' + data.message);
-        const notificationBadge = document.getElementById(`notification-badge`);
         displayNotification(data.message);
         updateNotificationCount(data.unread_count);
-    };
-
-    notificationSocket.onclose = function(e) {
-        console.error('Notification socket closed unexpectedly');
-    };
+    });
 });
 
 // displaying notification within page as alert message
@@ -324,16 +420,21 @@ document.addEventListener('DOMContentLoaded', function () {
         const userGroup = document.getElementById("chat-user-group").value;
         const username = document.getElementById("chat-username").value;
 
-        const chatSocket = new WebSocket('ws://' + window.location.host + '/ws/live_chat/' + roomName + '/');
+        const chatTopic = 'chat:' + roomName;
 
-        chatSocket.onmessage = function (e) {
-            const data = JSON.parse(e.data);
-            document.querySelector('#chat-log').value += (data.message + '\n');
-        };
-
-        chatSocket.onclose = function (e) {
-            console.error('Chat socket closed unexpectedly');
-        }
+        subscribeTopic(chatTopic, function (data) {
+            const chatLog = document.querySelector('#chat-log');
+            // server notices: rejected frames and messages skipped while slow
+            if (data.error) {
+                chatLog.value += ('[!] ' + data.error + '\n');
+                return;
+            }
+            if (data.dropped) {
+                chatLog.value += ('[' + data.dropped + ' messages skipped]\n');
+                return;
+            }
+            chatLog.value += (data.message + '\n');
+        });
 
         chatMessageInput.focus();
         document.querySelector('#chat-message-input').onkeyup = function (e) {
@@ -346,15 +447,91 @@ document.addEventListener('DOMContentLoaded', function () {
             const message = messageInputDom.value;
             const formattedMessage = `${userGroup}[${username}] :: ${message}`;
 
-            chatSocket.send(JSON.stringify({
-                'message': formattedMessage
-            }));
+            sendToTopic(chatTopic, {message: formattedMessage});
             messageInputDom.value = '';
         };
     }
 });
 
 
+// teacher: upload course material in chunks
+// an interrupted upload of the same file resumes with its missing chunks
+
+async function uploadMaterialInChunks(event, courseId) {
+    event.preventDefault();
+    const file = document.getElementById('myfile').files[0];
+    const responseMessage = document.getElementById('response-message');
+    if (!file) {
+        responseMessage.innerHTML = 'Please choose a file.';
+        return;
+    }
+    const csrfToken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+    const resumeKey = `material-upload:${courseId}:${file.name}:${file.size}`;
+
+    // calling the upload API, returning the JSON body or throwing its error
+    async function callApi(url, options) {
+        const response = await fetch(url, {
+            ...options,
+            headers: {'X-CSRFToken': csrfToken, ...(options.headers || {})},
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || 'Upload failed.');
+        }
+        return data;
+    }
+
+    try {
+        let upload = null;
+        const previousId = localStorage.getItem(resumeKey);
+        if (previousId) {
+            upload = await callApi(`/api/material/uploads/${previousId}/`, {method: 'GET'})
+                .catch(() => null);
+        }
+        if (!upload) {
+            upload = await callApi('/api/material/uploads/', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({course: courseId, file_name: file.name, size: file.size}),
+            });
+            localStorage.setItem(resumeKey, upload.upload_id);
+        }
+        const received = new Set(upload.received);
+        for (let index = 0; index < upload.chunk_count; index++) {
+            if (received.has(index)) {
+                continue;
+            }
+            const chunk = file.slice(index * upload.chunk_size, (index + 1) * upload.chunk_size);
+            // retrying each chunk a few times before giving up
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    await callApi(`/api/material/uploads/${upload.upload_id}/chunks/${index}/`, {
+                        method: 'PUT',
+                        headers: {'Content-Type': 'application/octet-stream'},
+                        body: chunk,
+                    });
+                    break;
+                } catch (error) {
+                    if (attempt >= 3) {
+                        throw error;
+                    }
+                }
+            }
+            responseMessage.innerHTML = `Uploaded ${Math.round(100 * (index + 1) / upload.chunk_count)}%`;
+        }
+        await callApi(`/api/material/uploads/${upload.upload_id}/finalize/`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({}),
+        });
+        localStorage.removeItem(resumeKey);
+        location.reload();
+    } catch (error) {
+        console.error('Error:', error);
+        responseMessage.innerHTML = error.message;
+    }
+}
+
 // student: send course feedback
 
 function sendCourseFeedback(courseId) {
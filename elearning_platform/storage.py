@@ -0,0 +1,75 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.core.files.storage import FileSystemStorage
+
+"""
+Content-addressed file storage
+"""
+# files are stored under their SHA-256, computed while the upload is
+# written: 'materials/report.pdf' becomes 'materials/ab/ab12...ef.pdf'.
+# Saving content that is already stored keeps the existing file, so every
+# re-upload of the same material shares one copy on disk. blobs.py counts
+# the materials using each file and unlinks it with the last of them; every
+# save takes a reference for the material it is made for, before the
+# existing file is reused, so a concurrent deletion can't unlink it.
+
+BLOB_NAME_PATTERN = re.compile(r'(?:^|/)[0-9a-f]{2}/(?P<sha256>[0-9a-f]{64})(?:\.\w+)?$')
+
+
+def blob_name(directory, sha256, extension):
+    return os.path.join(directory, sha256[:2], sha256 + extension)
+
+# SHA-256 of a stored file, from its name (None for files stored by name)
+
+
+def get_blob_sha256(name):
+    match = BLOB_NAME_PATTERN.search(name or '')
+    return match.group('sha256') if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    # the final name depends on the content, so no '_x7Ab2' suffixes
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        temp_directory = self.path(directory)
+        os.makedirs(temp_directory, exist_ok=True)
+        sha256 = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(suffix='.upload', dir=temp_directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    temp_file.write(chunk)
+            name = blob_name(directory, sha256.hexdigest(), extension)
+            self.reference(name)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # same content already stored
+                os.unlink(temp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return name.replace('\\', '/')
+
+    # counting the save as a reference to the file (see blobs.py)
+    def reference(self, name):
+        from .blobs import acquire_material_file
+        acquire_material_file(name)
+
+
+# storage of Material.material_path, the only files counted in MaterialBlob
+# (the project's default storage stores files by name)
+material_storage = ContentAddressedStorage()
@@ -0,0 +1,56 @@
+from .models import Material, Enrollment
+from .notifications import (fan_out_material_notification,
+                            fan_out_enrollment_notification)
+from .processing import process_materials
+from celery import shared_task
+from django.db import DatabaseError
+
+"""
+Background tasks
+"""
+# jobs only carry ids, the worker reloads the rows it needs
+# deliveries are idempotent (Notification.dedupe_key) so they can be retried
+
+
+DELIVERY_TASK_OPTIONS = {
+    'bind': True,
+    'autoretry_for': (DatabaseError,),
+    'retry_backoff': True,
+    'retry_jitter': True,
+    'max_retries': 5,
+}
+
+# notifying enrolled students about a new course material
+
+
+@shared_task(**DELIVERY_TASK_OPTIONS)
+def deliver_material_notifications(self, material_id):
+    material = Material.objects.select_related('course').filter(
+        material_id=material_id).first()
+    # material deleted before the job ran
+    if material is None:
+        return 0
+    return fan_out_material_notification(material)
+
+# notifying the course creator about a new enrollment
+
+
+@shared_task(**DELIVERY_TASK_OPTIONS)
+def deliver_enrollment_notification(self, enrollment_id):
+    enrollment = Enrollment.objects.select_related(
+        'course', 'student').filter(enrollment_id=enrollment_id).first()
+    # enrollment removed before the job ran
+    if enrollment is None:
+        return 0
+    return fan_out_enrollment_notification(enrollment)
+
+# previews, manifest and text of a new course material
+
+
+@shared_task(**DELIVERY_TASK_OPTIONS)
+def process_material(self, material_id):
+    material = Material.objects.filter(material_id=material_id).first()
+    # material deleted before the job ran
+    if material is None:
+        return None
+    return process_materials([material])[0].status
@@ -1,8 +1,9 @@
 from django import template
+from elearning_platform.roles import has_role
 
 register = template.Library()
 
 
 @register.filter(name='has_group')
 def has_group(user, group_name):
-    return user.groups.filter(name=group_name).exists()
+    return has_role(user, group_name)
@@ -1,18 +1,92 @@
+import contextlib
+import hashlib
+import io
 import json
+import os
+import shutil
+import tempfile
+import zipfile
+import random
+import zlib
+import asyncio
+import threading
+import time
+import unittest
+from collections import Counter
+from decimal import Decimal
+from PIL import Image
 from django.test import TestCase, Client
 from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework.request import Request
 from rest_framework import status
-from django.contrib.auth.models import Group
+from rest_framework.renderers import JSONRenderer
+from django.contrib.auth.models import Group, AnonymousUser
 
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.files.storage import default_storage
+from django.core.files.storage import default_storage, FileSystemStorage
+from django.core.files.base import ContentFile
 from unittest import mock
 
 from django.urls import reverse
 from django.urls import reverse_lazy
+from django.test import override_settings
+from django.db import connection, transaction, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.http import http_date
+from unittest import skipUnless
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.db import database_sync_to_async
 
 from .model_factories import *
 from .serializers import *
+from .notifications import *
+from .tasks import *
+from .roles import *
+from .pagination import *
+from .chat import *
+from .throttling import *
+from .benchmark import run_benchmark
+from .search import *
+from .uploads import *
+from .blobs import *
+from .storage import *
+from .processing import shutdown_executor
+from .catalog import *
+from .fragments import *
+from .conditional import *
+from .projections import get_field_plan, project_queryset, serialize_rows
+from .renderers import FastJSONRenderer
+from .websocket_auth import *
+from .heartbeat import CLOSE_HEARTBEAT_MISSED, PONG_FRAME
+from .consumers import chat_event
+from .routing import websocket_urlpatterns
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.urls import re_path
+from .context_processors import unread_notifications_count
+from django.core.management import call_command
+from io import StringIO
+from urllib.parse import urlparse, parse_qs
+
+# in-memory channel layer so tests do not need a running redis server
+IN_MEMORY_CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+}
+
+
+# every test writes uploaded files under a temporary MEDIA_ROOT, so running
+# the suite never leaves files in the project's media/ directory
+def setUpModule():
+    media_root = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = override_settings(MEDIA_ROOT=media_root)
+    media.enable()
+    unittest.addModuleCleanup(media.disable)
 
 """
 View Tests
@@ -49,8 +123,8 @@ class ListNotificationsTest(TestCase):
         response = self.client.get(reverse('user_notifications'))
         unread_notifications = response.context['unread_notifications']
         read_notifications = response.context['read_notifications']
-        self.assertEqual(unread_notifications.count(), 2)
-        self.assertEqual(read_notifications.count(), 2)
+        self.assertEqual(len(unread_notifications), 2)
+        self.assertEqual(len(read_notifications), 2)
 
 
 class SearchUsersTest(TestCase):
@@ -140,6 +214,103 @@ class EnrollToCourseTest(TestCase):
         self.assertIn('/login/', response.url)
 
 
+class CourseDetailTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # adding student & teacher users
+        self.user_teacher = UserFactory()
+        self.user_student = UserFactory()
+        self.other_student = UserFactory()
+        teacher_group = Group.objects.create(name='teacher')
+        student_group = Group.objects.create(name='student')
+        self.user_teacher.groups.add(teacher_group)
+        self.user_student.groups.add(student_group)
+        self.other_student.groups.add(student_group)
+
+        # adding course with one row of each related list
+        self.course = CourseFactory(creator=self.user_teacher)
+        self.url = reverse('course_detail', kwargs={'pk': self.course.pk})
+        self.add_course_rows(1)
+        EnrollmentFactory(course=self.course, student=self.user_student)
+        FeedbackFactory(course=self.course, user=self.user_student,
+                        message='own feedback')
+        FeedbackFactory(course=self.course, user=self.other_student,
+                        message='other feedback')
+
+    def add_course_rows(self, count):
+        for _ in range(count):
+            MaterialFactory.build(course=self.course,
+                                  creator=self.user_teacher).save()
+            student = UserFactory()
+            EnrollmentFactory(course=self.course, student=student)
+            FeedbackFactory(course=self.course, user=student)
+
+    def get_course_page(self, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_teacher_query_budget_is_constant(self):
+        self.client.login(username=self.user_teacher.username,
+                          password='password')
+        # session, user, course + creator, roles, unread counter,
+        # materials, enrollments, feedback
+        self.get_course_page(8)
+        self.add_course_rows(5)
+        response = self.get_course_page(7)
+        self.assertEqual(len(response.context['feedbacks']), 8)
+        # unchanged course: materials and enrollments come from the cache
+        self.get_course_page(5)
+
+    def test_student_query_budget_is_constant(self):
+        self.client.login(username=self.user_student.username,
+                          password='password')
+        # the teacher's queries and the enrollment check
+        self.get_course_page(9)
+        self.add_course_rows(5)
+        response = self.get_course_page(8)
+        self.assertTrue(response.context['is_enrolled'])
+        self.get_course_page(6)
+
+    @override_settings(LISTING_PAGE_SIZE=2)
+    def test_materials_and_enrollments_are_paginated(self):
+        self.client.login(username=self.user_teacher.username,
+                          password='password')
+        self.add_course_rows(2)
+        for param, rows in (('materials', self.course.materials),
+                            ('enrollments', self.course.enrollments)):
+            seen = []
+            cursor = None
+            while True:
+                response = self.client.get(
+                    self.url, {param: cursor} if cursor else {})
+                page = response.context[param]
+                self.assertLessEqual(len(page), 2)
+                # (rendered from the fragment cached for this page)
+                for row in page:
+                    self.assertContains(response, f'id="{param[:-1]}-{row.pk}"')
+                seen += [row.pk for row in page]
+                if not page.has_next:
+                    break
+                cursor = page.next_cursor
+                self.assertContains(response, f'?{param}=')
+            # newest first, every row once
+            self.assertEqual(seen, list(rows.order_by(
+                '-pk').values_list('pk', flat=True)))
+
+    def test_student_only_sees_own_feedback(self):
+        self.client.login(username=self.user_student.username,
+                          password='password')
+        response = self.client.get(self.url)
+        messages = [feedback.message
+                    for feedback in response.context['feedbacks']]
+        self.assertEqual(messages, ['own feedback'])
+        self.assertContains(response, 'own feedback')
+        self.assertNotContains(response, 'other feedback')
+
+
 """
 API View Tests
 """
@@ -254,17 +425,20 @@ class DeleteMaterialAPITest(APITestCase):
         self.url = reverse('api_delete_material', kwargs={
                            'pk': self.material.pk})
 
-    # adding decorator to alter behaviour of default_storage
-    # this allows us to test default_storage without altering any physical files
-    @mock.patch('django.core.files.storage.default_storage.delete')
+    # adding decorator to alter behaviour of the material storage
+    # this allows us to test the storage without altering any physical files
+    @mock.patch('elearning_platform.storage.material_storage.delete')
     def test_teacher_can_delete_material(self, mock_delete):
         self.client.login(username=self.user_teacher,
                           password='password')
-        response = self.client.delete(self.url)
+        # (the file is deleted once the deletion commits)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(self.url)
+            mock_delete.assert_not_called()
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Material.objects.count(), 0)
 
-        mock_delete.assert_called_once_with(self.material.material_path.path)
+        mock_delete.assert_called_once_with(self.material.material_path.name)
 
     def test_student_cannot_delete_material(self):
         self.client.login(username=self.user_student,
@@ -377,6 +551,8 @@ class UserSearchAPITest(APITestCase):
         self.second_teacher.groups.add(teacher_group)
         self.first_student.groups.add(student_group)
         self.second_student.groups.add(student_group)
+        # results cached by earlier tests refer to rolled back users
+        search_cache.clear()
 
         # accessing search users url
         self.url = reverse('api_search_users')
@@ -752,3 +928,1957 @@ class UpdateUserStatusAPITest(APITestCase):
         response = self.client.put(
             self.url, self.valid_status_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ConditionalAPITest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = UserFactory()
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.course = CourseFactory(creator=self.teacher)
+        self.material = MaterialFactory(course=self.course, creator=self.teacher)
+        self.client.login(username=self.teacher.username, password='password')
+
+    def test_unchanged_object_is_not_modified(self):
+        url = reverse('api_delete_course', kwargs={'pk': self.course.pk})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with mock.patch.object(CourseSerializer, 'to_representation') as serialize:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        serialize.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self.course.title = 'Renamed'
+        self.course.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_serialized_data_is_cached_per_version(self):
+        url = reverse('api_delete_material', kwargs={'pk': self.material.pk})
+        first = self.client.get(url)
+        with mock.patch.object(MaterialSerializer, 'to_representation') as serialize:
+            second = self.client.get(url)
+        serialize.assert_not_called()
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        # another material of the course changes the version
+        MaterialFactory(course=self.course, creator=self.teacher)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_is_not_modified_until_course_changes(self):
+        url = reverse('api_list_course_feedback', kwargs={'pk': self.course.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):
+            # session and user only
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        FeedbackFactory(course=self.course)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_permissions_are_checked_before_validators(self):
+        student = UserFactory()
+        student.groups.add(Group.objects.create(name='student'))
+        url = reverse('api_delete_course', kwargs={'pk': self.course.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.login(username=student.username, password='password')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+"""
+Notification Tests
+"""
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MaterialNotificationFanOutTest(TestCase):
+
+    def setUp(self):
+
+        # adding teacher, course and enrolled students
+        self.user_teacher = UserFactory()
+        self.course = CourseFactory(creator=self.user_teacher)
+        self.students = UserFactory.create_batch(5)
+        for student in self.students:
+            EnrollmentFactory(course=self.course, student=student,
+                              blocked=False)
+        self.blocked_student = UserFactory()
+        EnrollmentFactory(course=self.course, student=self.blocked_student,
+                          blocked=True)
+
+    def test_material_upload_notifies_enrolled_students(self):
+        # delivery job is queued on commit and runs eagerly in tests
+        with self.captureOnCommitCallbacks(execute=True):
+            MaterialFactory(course=self.course, creator=self.user_teacher)
+        for student in self.students:
+            self.assertEqual(Notification.objects.filter(
+                user=student, course=self.course).count(), 1)
+        self.assertFalse(Notification.objects.filter(
+            user=self.blocked_student).exists())
+
+    def test_fan_out_uses_constant_queries_per_batch(self):
+        material = MaterialFactory.build(
+            course=self.course, creator=self.user_teacher)
+        # batch query + delivered keys + bulk insert + 3 counter queries
+        with self.assertNumQueries(6):
+            sent = fan_out_material_notification(material, batch_size=10)
+        self.assertEqual(sent, 5)
+
+        # 2 full batches + 1 partial batch
+        material.material_id = None
+        material.save()
+        with self.assertNumQueries(18):
+            sent = fan_out_material_notification(material, batch_size=2)
+        self.assertEqual(sent, 5)
+
+    def test_fan_out_pushes_unread_count(self):
+        student = self.students[0]
+        NotificationFactory(user=student, course=self.course, is_read=False)
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(
+            f'notifications_{student.id}', channel_name)
+
+        material = MaterialFactory.build(
+            course=self.course, creator=self.user_teacher)
+        material.material_id = 1
+        fan_out_material_notification(material)
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(event['type'], 'send_notification')
+        self.assertEqual(event['unread_count'], 2)
+        self.assertIn(material.material_name, event['message'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationDeliveryTaskTest(TestCase):
+
+    def setUp(self):
+
+        # adding teacher, course and enrolled students
+        self.user_teacher = UserFactory()
+        self.course = CourseFactory(creator=self.user_teacher)
+        self.students = UserFactory.create_batch(3)
+        for student in self.students:
+            EnrollmentFactory(course=self.course, student=student,
+                              blocked=False)
+        self.material = MaterialFactory.build(
+            course=self.course, creator=self.user_teacher)
+        self.material.save()
+
+    def test_signal_only_queues_job(self):
+        with mock.patch.object(deliver_material_notifications,
+                               'delay') as mock_delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                material = MaterialFactory.build(
+                    course=self.course, creator=self.user_teacher)
+                material.save()
+                # nothing is written before the transaction commits
+                mock_delay.assert_not_called()
+        mock_delay.assert_called_once_with(material.material_id)
+        self.assertFalse(Notification.objects.filter(
+            message__contains=material.material_name).exists())
+
+    def test_material_delivery_is_idempotent(self):
+        result = deliver_material_notifications.delay(self.material.pk)
+        self.assertEqual(result.get(), 3)
+        # retried / re-delivered job does not duplicate notifications
+        result = deliver_material_notifications.delay(self.material.pk)
+        self.assertEqual(result.get(), 0)
+        for student in self.students:
+            self.assertEqual(Notification.objects.filter(
+                user=student,
+                dedupe_key=f'material:{self.material.pk}:user:{student.id}'
+            ).count(), 1)
+
+    def test_deleted_material_is_skipped(self):
+        material_id = self.material.pk
+        self.material.delete()
+        self.assertEqual(
+            deliver_material_notifications.delay(material_id).get(), 0)
+
+    def test_enrollment_notifies_course_creator(self):
+        student = UserFactory()
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment = EnrollmentFactory(course=self.course, student=student)
+        notification = Notification.objects.get(
+            dedupe_key=f'enrollment:{enrollment.enrollment_id}')
+        self.assertEqual(notification.user, self.user_teacher)
+        self.assertIn(student.last_name, notification.message)
+
+
+class UnreadNotificationCounterTest(TestCase):
+
+    def setUp(self):
+
+        # adding user and course with 2 unread + 1 read notifications
+        self.user = UserFactory()
+        self.course = CourseFactory()
+        self.unread_notifications = NotificationFactory.create_batch(
+            2, user=self.user, course=self.course, is_read=False)
+        NotificationFactory(user=self.user, course=self.course, is_read=True)
+
+    def test_counter_follows_creation(self):
+        self.assertEqual(get_unread_count(self.user.id), 2)
+
+    def test_counter_follows_read_state_change(self):
+        notification = Notification.objects.get(
+            pk=self.unread_notifications[0].pk)
+        notification.is_read = True
+        notification.save()
+        self.assertEqual(get_unread_count(self.user.id), 1)
+        notification.is_read = False
+        notification.save()
+        self.assertEqual(get_unread_count(self.user.id), 2)
+
+    def test_counter_follows_deletion(self):
+        Notification.objects.filter(is_read=False).first().delete()
+        self.assertEqual(get_unread_count(self.user.id), 1)
+        Notification.objects.filter(is_read=True).delete()
+        self.assertEqual(get_unread_count(self.user.id), 1)
+
+    def test_mark_all_read_resets_counter(self):
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.post(reverse('user_notifications_read'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_unread_count(self.user.id), 0)
+
+    def test_context_processor_reads_counter_in_one_query(self):
+        NotificationFactory.create_batch(
+            20, user=self.user, course=self.course, is_read=False)
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            context = unread_notifications_count(request)
+        self.assertEqual(context['unread_notifications_count'], 22)
+
+    def test_rebuild_command_repairs_counters(self):
+        NotificationCounter.objects.filter(user=self.user).update(
+            unread_count=40)
+        other_user = UserFactory()
+        # rows written without signals leave the counter behind
+        Notification.objects.bulk_create([
+            Notification(user=other_user, course=self.course, message='m')])
+        out = StringIO()
+        call_command('rebuild_unread_counters', stdout=out)
+        self.assertIn('Rebuilt unread counters for 2 users.', out.getvalue())
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        self.assertEqual(get_unread_count(other_user.id), 1)
+
+
+"""
+Index Tests
+"""
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+class HotQueryIndexTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.course = CourseFactory()
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'USING (COVERING )?INDEX {index_name}\b')
+        # ordering is served by the index too
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_unread_notification_list_uses_index(self):
+        self.assertUsesIndex(
+            Notification.objects.filter(
+                user=self.user, is_read=False).order_by('-created_at'),
+            'notification_user_unread_idx')
+
+    def test_read_notification_list_uses_index(self):
+        self.assertUsesIndex(
+            Notification.objects.filter(
+                user=self.user, is_read=True).order_by('-created_at'),
+            'notification_user_read_idx')
+
+    def test_enrollment_lookup_uses_unique_index(self):
+        # SQLite names the index of an inline unique constraint itself
+        plan = Enrollment.objects.filter(
+            course=self.course, student=self.user).explain()
+        self.assertRegex(plan, r'USING (COVERING )?INDEX \S+ '
+                               r'\(course_id=\? AND student_id=\?\)')
+
+    def test_active_enrollment_batch_uses_index(self):
+        self.assertUsesIndex(
+            Enrollment.objects.filter(
+                course=self.course, blocked=False,
+                enrollment_id__gt=0).order_by('enrollment_id'),
+            'enrollment_course_active_idx')
+
+    def test_feedback_list_uses_index(self):
+        self.assertUsesIndex(
+            Feedback.objects.filter(course=self.course).order_by('-sent_at'),
+            'feedback_course_sent_idx')
+
+    def test_material_list_uses_index(self):
+        self.assertUsesIndex(
+            Material.objects.filter(course=self.course).order_by('added_at'),
+            'material_course_added_idx')
+
+    def test_duplicate_enrollment_is_rejected(self):
+        Enrollment.objects.create(course=self.course, student=self.user)
+        with self.assertRaises(IntegrityError):
+            Enrollment.objects.create(course=self.course, student=self.user)
+
+
+class CourseCatalogTest(TestCase):
+
+    def setUp(self):
+        self.teacher = UserFactory(first_name='Ada', last_name='Lovelace')
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.student = UserFactory()
+        self.student.groups.add(Group.objects.create(name='student'))
+        AppUserFactory(user=self.student)
+        self.course = CourseFactory(creator=self.teacher, title='Algebra')
+
+    def entry(self):
+        return CourseCatalogEntry.objects.get(course=self.course)
+
+    def test_signals_keep_entry_in_sync(self):
+        entry = self.entry()
+        self.assertEqual((entry.title, entry.creator_name), ('Algebra', 'Ada Lovelace'))
+        self.assertEqual((entry.enrollment_count, entry.material_count), (0, 0))
+
+        enrollment = EnrollmentFactory(course=self.course, student=self.student)
+        material = MaterialFactory(course=self.course, creator=self.teacher)
+        entry = self.entry()
+        self.assertEqual((entry.enrollment_count, entry.material_count), (1, 1))
+        self.assertEqual(entry.last_activity_at, material.added_at)
+
+        enrollment.delete()
+        material.delete()
+        self.teacher.last_name = 'King'
+        self.teacher.save()
+        self.course.title = 'Linear algebra'
+        self.course.save()
+        entry = self.entry()
+        self.assertEqual((entry.enrollment_count, entry.material_count), (0, 0))
+        self.assertEqual((entry.title, entry.creator_name),
+                         ('Linear algebra', 'Ada King'))
+        self.course.delete()
+        self.assertFalse(CourseCatalogEntry.objects.exists())
+
+    def test_course_lists_read_catalog(self):
+        other = CourseFactory(creator=self.teacher, title='Geometry')
+        EnrollmentFactory(course=self.course, student=self.student, blocked=False)
+        EnrollmentFactory(course=other)
+        self.client.login(username=self.student.username, password='password')
+        response = self.client.get(reverse('more_courses'))
+        self.assertEqual([entry.course_id for entry in response.context['courses']],
+                         [other.course_id])
+        self.assertContains(response, 'Ada Lovelace')
+        self.assertContains(response, '1 students, 0 materials')
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual([entry.course_id for entry in
+                          response.context['not_enrolled_courses']],
+                         [other.course_id])
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+    def test_catalog_pages_use_index(self):
+        for queryset, index_name in [
+                (catalog_excluding_enrolled(self.student), 'catalog_created_idx'),
+                (CourseCatalogEntry.objects.filter(creator=self.teacher),
+                 'catalog_creator_created_idx')]:
+            plan = queryset.order_by('-created_at', '-course').explain()
+            self.assertIn(index_name, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_rebuild_command_repairs_entries(self):
+        Enrollment.objects.bulk_create([
+            Enrollment(course=self.course, student=self.student)])
+        CourseCatalogEntry.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_course_catalog', stdout=out)
+        self.assertIn('Rebuilt catalogue entries for 1 courses', out.getvalue())
+        entry = self.entry()
+        self.assertEqual(entry.enrollment_count, 1)
+        self.assertEqual(entry.creator_name, 'Ada Lovelace')
+
+
+class FragmentCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.teacher = UserFactory(first_name='Ada', last_name='Lovelace')
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        student_group = Group.objects.create(name='student')
+        self.students = UserFactory.create_batch(2)
+        for student in self.students:
+            student.groups.add(student_group)
+            AppUserFactory(user=student)
+        self.course = CourseFactory(creator=self.teacher)
+        self.material = MaterialFactory(course=self.course, creator=self.teacher,
+                                        material_name='week1.pdf')
+        self.url = reverse('course_detail', kwargs={'pk': self.course.pk})
+
+    def get_page(self, user, url=None):
+        self.client.force_login(user)
+        return self.client.get(url or self.url)
+
+    def test_course_page_is_shared_until_course_changes(self):
+        self.get_page(self.students[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_page(self.students[1])
+        self.assertContains(response, 'week1.pdf')
+        self.assertFalse(any('elearning_platform_material"' in query['sql']
+                             for query in queries.captured_queries))
+
+        version = get_course_version(self.course.pk)
+        MaterialFactory(course=self.course, creator=self.teacher,
+                        material_name='week2.pdf')
+        self.assertGreater(get_course_version(self.course.pk), version)
+        self.assertContains(self.get_page(self.students[1]), 'week2.pdf')
+
+        self.teacher.first_name = 'Augusta'
+        self.teacher.save()
+        self.assertContains(self.get_page(self.students[0]), 'Augusta Lovelace')
+
+    def test_teacher_fragments_are_not_shared(self):
+        # the creator's page has delete buttons, students' pages do not
+        teacher_page = self.get_page(self.teacher)
+        self.assertContains(teacher_page, f'deleteMaterial({self.material.pk})')
+        student_page = self.get_page(self.students[0])
+        self.assertNotContains(student_page, f'deleteMaterial({self.material.pk})')
+        self.assertNotContains(student_page, 'Add new material')
+
+    def test_course_lists_follow_catalog_version(self):
+        index = reverse('index')
+        self.assertNotContains(self.get_page(self.students[0], index), 'Geometry')
+        CourseFactory(creator=self.teacher, title='Geometry')
+        self.assertContains(self.get_page(self.students[0], index), 'Geometry')
+        response = self.client.get(index, {'not_enrolled': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_navigation_shows_current_name(self):
+        student = self.students[0]
+        self.assertContains(self.get_page(student), student.first_name)
+        student.first_name = 'Renamed'
+        student.save()
+        self.assertContains(self.get_page(student), 'Hello, Renamed')
+
+
+"""
+Role Tests
+"""
+
+
+class RoleResolutionTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # adding student & teacher users
+        self.user_teacher = UserFactory()
+        self.user_student = UserFactory()
+        self.teacher_group = Group.objects.create(name='teacher')
+        self.student_group = Group.objects.create(name='student')
+        self.user_teacher.groups.add(self.teacher_group)
+        self.user_student.groups.add(self.student_group)
+        self.course = CourseFactory(creator=self.user_teacher)
+
+    def count_group_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len([query for query in queries.captured_queries
+                    if 'auth_user_groups' in query['sql']])
+
+    def test_course_page_loads_groups_once(self):
+        self.client.login(username=self.user_teacher.username,
+                          password='password')
+        url = reverse('course_detail', kwargs={'pk': self.course.pk})
+        self.assertEqual(self.count_group_queries(url), 1)
+        # following requests are served by the role cache
+        self.assertEqual(self.count_group_queries(url), 0)
+
+    @override_settings(ROLE_CACHE_TIMEOUT=0)
+    def test_roles_memoized_per_request_without_cache(self):
+        self.client.login(username=self.user_student.username,
+                          password='password')
+        url = reverse('course_detail', kwargs={'pk': self.course.pk})
+        self.assertEqual(self.count_group_queries(url), 1)
+        self.assertEqual(self.count_group_queries(url), 1)
+
+    def test_membership_change_invalidates_cache(self):
+        self.assertEqual(get_user_roles(self.user_student), {'student'})
+        self.user_student.groups.add(self.teacher_group)
+        self.assertTrue(has_role(self.user_student, 'teacher'))
+        # a fresh user object (next request) sees the change as well
+        user = User.objects.get(pk=self.user_student.pk)
+        self.assertEqual(get_user_roles(user), {'student', 'teacher'})
+
+    def test_reverse_membership_change_invalidates_cache(self):
+        user = User.objects.get(pk=self.user_teacher.pk)
+        self.assertTrue(has_role(user, 'teacher'))
+        self.teacher_group.user_set.remove(self.user_teacher)
+        user = User.objects.get(pk=self.user_teacher.pk)
+        self.assertFalse(has_role(user, 'teacher'))
+
+    def test_anonymous_user_has_no_roles(self):
+        self.assertEqual(get_user_roles(AnonymousUser()), frozenset())
+
+
+"""
+Pagination Tests
+"""
+
+
+@override_settings(LISTING_PAGE_SIZE=2)
+class KeysetPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.course = CourseFactory()
+        # 5 unread notifications, 3 of them sharing the same timestamp
+        self.notifications = NotificationFactory.create_batch(
+            5, user=self.user, course=self.course, is_read=False)
+        Notification.objects.filter(
+            pk__in=[n.pk for n in self.notifications[:3]]).update(
+            created_at=self.notifications[0].created_at)
+        self.queryset = Notification.objects.filter(
+            user=self.user, is_read=False)
+
+    def walk_pages(self):
+        pages = []
+        cursor = None
+        while True:
+            page = paginate_keyset(self.queryset, 'created_at', cursor)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        pages = self.walk_pages()
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        seen = [notification.pk for page in pages for notification in page]
+        self.assertCountEqual(seen, [n.pk for n in self.notifications])
+
+    def test_later_page_costs_one_query(self):
+        cursor = paginate_keyset(self.queryset, 'created_at').next_cursor
+        with self.assertNumQueries(1):
+            paginate_keyset(self.queryset, 'created_at', cursor)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN output is SQLite specific')
+    def test_later_page_seeks_index(self):
+        value, pk = decode_cursor(
+            paginate_keyset(self.queryset, 'created_at').next_cursor)
+        plan = self.queryset.filter(created_at__lte=value).exclude(
+            created_at=value, notification_id__gte=pk).order_by(
+            '-created_at', '-notification_id').explain()
+        self.assertIn('notification_user_unread_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.get(
+            reverse('user_notifications'), {'unread': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            reverse('api_list_notifications'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_notification_view_is_paginated(self):
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.get(reverse('user_notifications'))
+        page = response.context['unread_notifications']
+        self.assertEqual(len(page), 2)
+        self.assertContains(response, f'?unread={page.next_cursor}')
+
+    def test_notification_api_follows_next_link(self):
+        self.client.login(username=self.user.username, password='password')
+        url = reverse('api_list_notifications')
+        params = {'is_read': 'false'}
+        seen = []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [row['notification_id']
+                     for row in response.data['results']]
+            if not response.data['next']:
+                break
+            params['cursor'] = parse_qs(
+                urlparse(response.data['next']).query)['cursor'][0]
+        self.assertCountEqual(seen, [n.pk for n in self.notifications])
+
+    def test_course_feedback_api_filters_students(self):
+        student_group = Group.objects.create(name='student')
+        self.user.groups.add(student_group)
+        FeedbackFactory(course=self.course, user=self.user)
+        FeedbackFactory(course=self.course)
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.get(reverse(
+            'api_list_course_feedback', kwargs={'pk': self.course.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user'], self.user.id)
+
+
+class ProjectedListTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.user.groups.add(Group.objects.create(name='student'))
+        courses = CourseFactory.create_batch(3, description='line\u2028break é')
+        for course in courses:
+            EnrollmentFactory(course=course, student=self.user)
+            NotificationFactory(user=self.user, course=course)
+        self.client.login(username=self.user.username, password='password')
+
+    def assert_same_as_serializer(self, url, serializer_class, queryset):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        request = response.wsgi_request
+        expected = serializer_class(
+            queryset, many=True, context={'request': request}).data
+        self.assertEqual(response.json()['results'], json.loads(
+            JSONRenderer().render(expected)))
+        return response
+
+    def test_lists_match_their_serializers(self):
+        self.assert_same_as_serializer(
+            reverse('api_list_courses'), CourseSerializer,
+            Course.objects.order_by('-created_at', '-course_id'))
+        self.assert_same_as_serializer(
+            reverse('api_list_enrollments'), EnrollmentSerializer,
+            Enrollment.objects.order_by('-enrolled_at', '-enrollment_id'))
+        self.assert_same_as_serializer(
+            reverse('api_list_notifications'), NotificationSerializer,
+            Notification.objects.order_by('-created_at', '-notification_id'))
+
+    @override_settings(LISTING_PAGE_SIZE=2)
+    def test_projected_rows_are_paginated(self):
+        response = self.client.get(reverse('api_list_courses'))
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_field_plan_is_built_once(self):
+        self.assertIs(get_field_plan(CourseSerializer),
+                      get_field_plan(CourseSerializer))
+        with self.assertRaises(ImproperlyConfigured):
+            get_field_plan(MaterialUploadSerializer)
+
+    def test_files_are_linked_to_their_download_view(self):
+        material = MaterialFactory()
+        request = Request(APIRequestFactory().get('/'))
+        plan = get_field_plan(MaterialSerializer)
+        rows = serialize_rows(project_queryset(
+            Material.objects.filter(pk=material.pk), plan), plan, request)
+        self.assertEqual(rows, [dict(MaterialSerializer(
+            material, context={'request': request}).data)])
+        self.assertEqual(rows[0]['material_path'], 'http://testserver' + reverse(
+            'download_material', kwargs={'pk': material.pk}))
+
+    def test_renderer_output_matches_drf(self):
+        data = {'results': [{'title': 'line\u2028break é', 'count': 1,
+                             'at': timezone.now(), 'price': Decimal('1.50')}]}
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class UserSearchIndexTest(TestCase):
+
+    def setUp(self):
+        self.teacher_group = Group.objects.create(name='teacher')
+        self.student_group = Group.objects.create(name='student')
+        self.teacher = UserFactory(username='marlow', first_name='Ada',
+                                   last_name='Quint')
+        self.student = UserFactory(username='quinton', first_name='Bea',
+                                   last_name='Marsh')
+        self.teacher.groups.add(self.teacher_group)
+        self.student.groups.add(self.student_group)
+        # users outside student / teacher are not searchable
+        UserFactory(username='marple', first_name='Ada', last_name='Quill')
+
+    def usernames(self, query, **kwargs):
+        return [row['username'] for row in search_users(query, **kwargs)]
+
+    def test_words_match_as_prefixes_ranked_by_username(self):
+        self.assertEqual(self.usernames('mar'), ['marlow', 'quinton'])
+        self.assertEqual(self.usernames('qui'), ['quinton', 'marlow'])
+        self.assertEqual(self.usernames('ada qu'), ['marlow'])
+        self.assertEqual(self.usernames('arlow'), [])
+
+    def test_group_filter_limit_and_group_name(self):
+        self.assertEqual(self.usernames('mar', group='student'), ['quinton'])
+        self.assertEqual(len(search_users('mar', limit=1)), 1)
+        self.assertEqual(search_users('bea')[0], {
+            'username': 'quinton', 'first_name': 'Bea', 'last_name': 'Marsh',
+            'id': self.student.pk, 'group': 'student'})
+
+    def test_search_is_a_single_query(self):
+        search_users('warm up')
+        with self.assertNumQueries(1):
+            search_users('mar')
+
+    def test_index_follows_user_and_group_changes(self):
+        self.student.first_name = 'Cleo'
+        self.student.save()
+        self.assertEqual(self.usernames('cleo'), ['quinton'])
+        self.assertEqual(self.usernames('bea'), [])
+
+        self.student.groups.remove(self.student_group)
+        self.assertEqual(self.usernames('cleo'), [])
+        self.student_group.user_set.add(self.student)
+        self.assertEqual(self.usernames('cleo'), ['quinton'])
+
+        self.teacher_group.name = 'lecturer'
+        self.teacher_group.save()
+        self.assertEqual(self.usernames('marlow'), [])
+        self.student_group.delete()
+        self.assertEqual(self.usernames('cleo'), [])
+
+    def test_rebuild_command(self):
+        UserSearchEntry.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_user_search', stdout=out)
+        self.assertIn('Indexed 2 users', out.getvalue())
+        self.assertEqual(self.usernames('mar'), ['marlow', 'quinton'])
+
+
+
+class UserSearchCacheTest(TestCase):
+
+    def setUp(self):
+        student_group = Group.objects.create(name='student')
+        for username in ['mara', 'marco', 'maria', 'milo']:
+            UserFactory(username=username, first_name='Sam',
+                        last_name='Lee').groups.add(student_group)
+        self.now = [0.0]
+        self.cache = UserSearchCache(clock=lambda: self.now[0])
+        patcher = mock.patch('elearning_platform.search.search_cache',
+                             self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def usernames(self, query, **kwargs):
+        return [row['username'] for row in cached_search_users(query, **kwargs)]
+
+    def test_repeated_and_longer_prefixes_skip_the_database(self):
+        self.assertEqual(self.usernames('ma'), ['mara', 'marco', 'maria'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.usernames('ma'), ['mara', 'marco', 'maria'])
+            # derived from the complete 'ma' results
+            self.assertEqual(self.usernames('mar'), ['mara', 'marco', 'maria'])
+            self.assertEqual(self.usernames('mari'), ['maria'])
+            self.assertEqual(self.usernames('mar', limit=1), ['mara'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 1))
+
+    @override_settings(USER_SEARCH_LIMIT=2)
+    def test_truncated_results_are_not_filtered(self):
+        self.assertEqual(self.usernames('ma'), ['mara', 'marco'])
+        # 'ma' was cut at the limit, 'mari' must ask the database
+        self.assertEqual(self.usernames('mari'), ['maria'])
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_changes_drop_affected_queries(self):
+        self.usernames('ma')
+        self.usernames('mi')
+        maria = User.objects.get(username='maria')
+        maria.username = 'mila'
+        maria.save()
+        self.assertEqual(self.usernames('ma'), ['mara', 'marco'])
+        self.assertEqual(self.usernames('mi'), ['mila', 'milo'])
+        User.objects.get(username='milo').delete()
+        self.assertEqual(self.usernames('mi'), ['mila'])
+
+    @override_settings(USER_SEARCH_CACHE_SIZE=2, USER_SEARCH_CACHE_TTL=10)
+    def test_lru_eviction_and_expiry(self):
+        self.usernames('ma')
+        self.usernames('mi')
+        self.usernames('ma')
+        self.usernames('sam')
+        self.assertEqual(list(self.cache.entries),
+                         [(None, ('ma',)), (None, ('sam',))])
+        self.now[0] = 11
+        with self.assertNumQueries(1):
+            self.usernames('ma')
+
+    @override_settings(USER_SEARCH_CACHE_SIZE=0)
+    def test_cache_can_be_disabled(self):
+        self.usernames('ma')
+        self.assertEqual(len(self.cache.entries), 0)
+
+    @override_settings(USER_SEARCH_CACHE_SIZE=3)
+    def test_concurrent_searches_share_the_cache(self):
+        rows = [{'id': 1, 'username': 'mara', 'first_name': 'Sam',
+                 'last_name': 'Lee'}]
+        queries = ['ma', 'mar', 'mi', 'sa', 'le', 'mara'] * 10
+        errors = []
+
+        # other threads run (and evict) while a lookup reads the clock
+        def clock():
+            time.sleep(0.0002)
+            return 0.0
+        cache = UserSearchCache(clock=clock)
+
+        def search(offset):
+            try:
+                for query in queries[offset:] + queries[:offset]:
+                    cache.search(query)
+            except Exception as error:
+                errors.append(error)
+
+        # (the database is left out, threads don't share the test's)
+        with mock.patch('elearning_platform.search.search_users',
+                        return_value=rows):
+            threads = [threading.Thread(target=search, args=(offset,))
+                       for offset in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(cache.hits + cache.misses, 8 * len(queries))
+        self.assertLessEqual(len(cache.entries), 3)
+
+
+# gives every test an empty MEDIA_ROOT, removed afterwards
+
+
+class TempMediaRootMixin:
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+@override_settings(MATERIAL_UPLOAD_CHUNK_SIZE=8, MATERIAL_UPLOAD_MAX_SIZE=64,
+                   CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChunkedMaterialUploadTest(TempMediaRootMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = UserFactory()
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.course = CourseFactory(creator=self.teacher)
+        self.client.login(username=self.teacher.username, password='password')
+        self.content = b'%PDF-1.4 twenty bytes'
+
+    def start(self, file_name='notes.pdf', size=None):
+        return self.client.post(reverse('api_material_upload_start'), {
+            'course': self.course.course_id, 'file_name': file_name,
+            'size': len(self.content) if size is None else size,
+        }, format='json')
+
+    def put_chunk(self, upload_id, index, data):
+        return self.client.put(
+            reverse('api_material_upload_chunk',
+                    kwargs={'upload_id': upload_id, 'index': index}),
+            data, content_type='application/octet-stream')
+
+    def finalize(self, upload_id, **data):
+        return self.client.post(
+            reverse('api_material_upload_finalize',
+                    kwargs={'upload_id': upload_id}), data, format='json')
+
+    def test_chunks_in_any_order_are_joined_into_a_material(self):
+        response = self.start()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['upload_id']
+        self.assertEqual(response.data['chunk_count'], 3)
+
+        for index in [2, 0, 1]:
+            response = self.put_chunk(
+                upload_id, index, self.content[index * 8:(index + 1) * 8])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(
+                upload_id, sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        material = Material.objects.get(pk=response.data['material_id'])
+        self.assertEqual(material.material_name, 'notes.pdf')
+        with material.material_path.open('rb') as material_file:
+            self.assertEqual(material_file.read(), self.content)
+        upload = MaterialUpload.objects.get(pk=upload_id)
+        self.assertEqual(upload.sha256, hashlib.sha256(self.content).hexdigest())
+        # chunk files and manifest are gone, finalizing again is a no-op
+        self.assertFalse(upload.chunks.exists())
+        self.assertFalse(chunk_storage.exists(chunk_path(upload, 0)))
+        self.assertEqual(self.finalize(upload_id).data['material_id'],
+                         material.material_id)
+
+    def test_manifest_lists_received_chunks_for_resuming(self):
+        upload_id = self.start().data['upload_id']
+        self.put_chunk(upload_id, 1, self.content[8:16])
+        # putting a chunk again replaces it
+        self.put_chunk(upload_id, 1, self.content[8:16])
+        response = self.client.get(
+            reverse('api_material_upload', kwargs={'upload_id': upload_id}))
+        self.assertEqual(response.data['received'], [1])
+
+        response = self.finalize(upload_id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Missing chunks: [0, 2].')
+        self.assertFalse(Material.objects.exists())
+
+    def test_limits_are_checked_before_the_material_is_created(self):
+        self.assertEqual(self.start(file_name='run.exe').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.start(size=65).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        upload_id = self.start().data['upload_id']
+        # wrong chunk size, chunk out of range
+        self.assertEqual(self.put_chunk(upload_id, 0, b'x' * 9).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.put_chunk(upload_id, 3, b'x').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        # content that is not a PDF, then a checksum mismatch
+        for index in range(3):
+            self.put_chunk(upload_id, index, b'x' * len(
+                self.content[index * 8:(index + 1) * 8]))
+        self.assertIn('does not match',
+                      self.finalize(upload_id).data['error'])
+        self.put_chunk(upload_id, 0, self.content[:8])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.finalize(upload_id, sha256='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Material.objects.exists())
+        # the file written for it is released and removed
+        self.assertFalse(MaterialBlob.objects.exists())
+        self.assertEqual([files for _, _, files in os.walk(
+            material_storage.path('materials')) if files], [])
+
+    def test_uploads_belong_to_their_creator(self):
+        upload_id = self.start().data['upload_id']
+        other_teacher = UserFactory()
+        other_teacher.groups.add(Group.objects.get(name='teacher'))
+        self.client.login(username=other_teacher.username, password='password')
+        self.assertEqual(self.put_chunk(upload_id, 0, self.content[:8]).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_expired_uploads_are_purged(self):
+        upload_id = self.start().data['upload_id']
+        self.put_chunk(upload_id, 0, self.content[:8])
+        upload = MaterialUpload.objects.get(pk=upload_id)
+        out = StringIO()
+        call_command('purge_material_uploads', expiry=0, stdout=out)
+        self.assertIn('Purged 1 unfinished uploads', out.getvalue())
+        self.assertFalse(chunk_storage.exists(chunk_path(upload, 0)))
+
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ContentAddressedStorageTest(TempMediaRootMixin, APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = UserFactory()
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.course = CourseFactory(creator=self.teacher)
+        self.client.login(username=self.teacher.username, password='password')
+        self.content = b'%PDF-1.4 shared syllabus'
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def upload(self, file_name):
+        self.client.post(reverse('upload_material'), {
+            'course_id': self.course.course_id,
+            'myfile': SimpleUploadedFile(file_name, self.content),
+        })
+        return Material.objects.get(material_name=file_name)
+
+    def delete(self, material):
+        return self.client.delete(
+            reverse('api_delete_material', kwargs={'pk': material.pk}))
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload('syllabus.pdf')
+        second = self.upload('syllabus_copy.PDF')
+        self.assertEqual(first.material_path.name,
+                         f'materials/{self.sha256[:2]}/{self.sha256}.pdf')
+        self.assertEqual(second.material_path.name, first.material_path.name)
+        self.assertEqual(get_blob_sha256(first.material_path.name), self.sha256)
+        self.assertEqual(MaterialBlob.objects.get(
+            name=first.material_path.name).ref_count, 2)
+        # only the blob is left in the directory, no temporary files
+        self.assertEqual(material_storage.listdir(f'materials/{self.sha256[:2]}'),
+                         ([], [f'{self.sha256}.pdf']))
+        self.assertEqual(material_storage.listdir('materials')[1], [])
+
+    def test_file_is_unlinked_with_its_last_material(self):
+        first = self.upload('syllabus.pdf')
+        second = self.upload('syllabus_copy.pdf')
+        path = first.material_path.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.delete(first).status_code,
+                             status.HTTP_204_NO_CONTENT)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MaterialBlob.objects.get(
+            name=second.material_path.name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delete(second)
+            # unlinked only once the deletion commits
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MaterialBlob.objects.exists())
+
+    def test_rolled_back_deletion_keeps_the_file(self):
+        material = self.upload('syllabus.pdf')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    material.delete()
+                    raise IntegrityError
+        self.assertEqual(callbacks, [])
+        self.assertTrue(os.path.exists(material.material_path.path))
+        self.assertEqual(MaterialBlob.objects.get(
+            name=material.material_path.name).ref_count, 1)
+
+    def test_file_reused_before_the_deletion_commits_is_kept(self):
+        first = self.upload('syllabus.pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delete(first)
+            # the same content uploaded again before the unlink runs
+            second = self.upload('syllabus_again.pdf')
+        self.assertTrue(os.path.exists(second.material_path.path))
+        self.assertEqual(MaterialBlob.objects.get(
+            name=second.material_path.name).ref_count, 1)
+
+    def test_other_files_are_stored_by_name_and_not_counted(self):
+        name = default_storage.save('avatars/photo.png', ContentFile(self.content))
+        self.assertEqual(name, 'avatars/photo.png')
+        self.assertFalse(MaterialBlob.objects.exists())
+
+    def test_failed_material_insert_releases_its_file(self):
+        material = Material(creator=self.teacher, material_name='orphan.pdf',
+                            material_path=SimpleUploadedFile(
+                                'orphan.pdf', self.content))
+        with self.captureOnCommitCallbacks(execute=True):
+            # (no course)
+            with self.assertRaises(IntegrityError):
+                save_material(material)
+        self.assertFalse(MaterialBlob.objects.exists())
+        self.assertFalse(material_storage.exists(material.material_path.name))
+
+    def test_course_deletion_releases_its_materials(self):
+        material = self.upload('syllabus.pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.delete()
+        self.assertFalse(os.path.exists(material.material_path.path))
+
+    def test_existing_files_are_deduplicated(self):
+        plain_storage = FileSystemStorage()
+        for name in ['materials/notes.pdf', 'materials/notes_copy.pdf']:
+            plain_storage.save(name, ContentFile(self.content))
+            MaterialFactory(course=self.course, creator=self.teacher,
+                            material_path=name)
+        out = StringIO()
+        call_command('dedupe_material_files', stdout=out)
+        self.assertIn('Moved 2 material files', out.getvalue())
+
+        blob_name = f'materials/{self.sha256[:2]}/{self.sha256}.pdf'
+        self.assertEqual(set(Material.objects.values_list(
+            'material_path', flat=True)), {blob_name})
+        self.assertEqual(MaterialBlob.objects.get(name=blob_name).ref_count, 2)
+        self.assertFalse(plain_storage.exists('materials/notes.pdf'))
+
+
+class MaterialDownloadTest(TempMediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = UserFactory()
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.student = UserFactory()
+        self.student.groups.add(Group.objects.create(name='student'))
+        self.course = CourseFactory(creator=self.teacher)
+        self.content = b'%PDF-1.4 ' + bytes(range(256)) * 4
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.material = MaterialFactory(
+            course=self.course, creator=self.teacher, material_name='week1.pdf',
+            material_path=material_storage.save(
+                'materials/week1.pdf', ContentFile(self.content)))
+        self.url = reverse('download_material',
+                           kwargs={'pk': self.material.pk})
+
+    def enroll(self, blocked=False):
+        EnrollmentFactory(course=self.course, student=self.student,
+                          blocked=blocked)
+        self.client.login(username=self.student.username, password='password')
+
+    def test_api_links_materials_to_their_download(self):
+        self.client.login(username=self.teacher.username, password='password')
+        response = self.client.get(
+            reverse('api_delete_material', kwargs={'pk': self.material.pk}))
+        self.assertEqual(response.status_code, 200)
+        download = self.client.get(response.json()['material_path'])
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(b''.join(download.streaming_content), self.content)
+
+    def test_enrolled_students_and_teachers_can_download(self):
+        self.enroll()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['ETag'], f'"{self.sha256}"')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('week1.pdf', response['Content-Disposition'])
+        self.assertIn('private', response['Cache-Control'])
+
+        self.client.login(username=self.teacher.username, password='password')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_other_users_cannot_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username=self.student.username, password='password')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.logout()
+        self.enroll(blocked=True)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_matching_etag_returns_not_modified(self):
+        self.enroll()
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=f'"{self.sha256}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{self.sha256}"')
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_range_requests(self):
+        self.enroll()
+        response = self.client.get(self.url, HTTP_RANGE='bytes=9-18')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[9:19])
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 9-18/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[-5:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes */{len(self.content)}')
+        # a stale If-Range gets the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3',
+                                   HTTP_IF_RANGE=f'"{self.sha256}"')
+        self.assertEqual(response.status_code, 206)
+
+    def test_if_range_needs_a_strong_etag(self):
+        self.enroll()
+        with mock.patch('elearning_platform.downloads.get_blob_sha256',
+                        return_value=None):
+            etag = self.client.get(self.url)['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            for if_range in (etag, http_date(time.time())):
+                response = self.client.get(self.url, HTTP_RANGE='bytes=0-3',
+                                           HTTP_IF_RANGE=if_range)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b''.join(response.streaming_content),
+                                 self.content)
+
+    def test_proxy_offload(self):
+        self.enroll()
+        with self.settings(MATERIAL_DOWNLOAD_OFFLOAD='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/' + self.material.material_path.name)
+        self.assertEqual(response['ETag'], f'"{self.sha256}"')
+        with self.settings(MATERIAL_DOWNLOAD_OFFLOAD='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'],
+                         self.material.material_path.path)
+
+    def test_course_page_links_to_download_view(self):
+        self.enroll()
+        response = self.client.get(
+            reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertContains(response, f'href="{self.url}"')
+
+
+@override_settings(MATERIAL_PROCESSING_WORKERS=0)
+class MaterialProcessingTest(TempMediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.teacher = UserFactory()
+        self.teacher.groups.add(Group.objects.create(name='teacher'))
+        self.course = CourseFactory(creator=self.teacher)
+
+    def create_material(self, file_name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            material = MaterialFactory(
+                course=self.course, creator=self.teacher,
+                material_name=file_name, material_path=material_storage.save(
+                    'materials/' + file_name, ContentFile(content)))
+        process_material.delay(material.material_id)
+        return material
+
+    def zip_content(self, files):
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return output.getvalue()
+
+    def test_zip_manifest(self):
+        material = self.create_material('lab.zip', self.zip_content({
+            'lab/readme.txt': 'x' * 1000, 'lab/data.csv': 'a,b\n' * 100}))
+        preview = MaterialPreview.objects.get(material=material)
+        self.assertEqual(preview.status, 'processed')
+        self.assertEqual(preview.entry_count, 2)
+        self.assertEqual(preview.uncompressed_size, 1400)
+        self.assertEqual([entry['name'] for entry in preview.manifest],
+                         ['lab/readme.txt', 'lab/data.csv'])
+
+        self.client.login(username=self.teacher.username, password='password')
+        response = self.client.get(
+            reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertContains(response, 'lab/readme.txt')
+
+    def test_image_thumbnail(self):
+        image = io.BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(image, 'PNG')
+        material = self.create_material('diagram.png', image.getvalue())
+        preview = MaterialPreview.objects.get(material=material)
+        thumbnail = Image.open(io.BytesIO(preview.thumbnail))
+        self.assertEqual(thumbnail.format, 'JPEG')
+        self.assertEqual(thumbnail.size, (256, 171))
+
+        url = reverse('material_thumbnail', kwargs={'pk': material.pk})
+        self.client.login(username=self.teacher.username, password='password')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, bytes(preview.thumbnail))
+        student = UserFactory()
+        student.groups.add(Group.objects.create(name='student'))
+        self.client.login(username=student.username, password='password')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_text_extraction(self):
+        document = self.zip_content({'word/document.xml': (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+            'wordprocessingml/2006/main"><w:body><w:p><w:r><w:t>Linear</w:t>'
+            '</w:r><w:r><w:t>algebra notes</w:t></w:r></w:p></w:body></w:document>')})
+        docx = self.create_material('notes.docx', document)
+        self.assertEqual(docx.preview.text, 'Linear algebra notes')
+
+        page = zlib.compress(b'BT /F1 12 Tf (Week \\(1\\)) Tj [(Vec) -20 (tors)] TJ ET')
+        pdf = self.create_material('week1.pdf', (
+            b'%%PDF-1.4\n4 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n'
+            % len(page)) + page + b'\nendstream\nendobj\n%EOF')
+        self.assertEqual(pdf.preview.text, 'Week (1) Vectors')
+
+        with self.settings(MATERIAL_TEXT_MAX_LENGTH=10):
+            text = self.create_material('long.txt', b'word ' * 1000)
+        self.assertEqual(text.preview.text, 'word word ')
+
+    def test_failures_and_shared_files(self):
+        broken = self.create_material('broken.zip', b'PK\x03\x04 not a zip')
+        self.assertEqual(broken.preview.status, 'failed')
+        self.assertIn('BadZipFile', broken.preview.error)
+
+        content = self.zip_content({'a.txt': 'a'})
+        first = self.create_material('first.zip', content)
+        with mock.patch('elearning_platform.processing.analyse_material_file') as analyse:
+            second = self.create_material('second.zip', content)
+        analyse.assert_not_called()
+        self.assertEqual(second.preview.manifest, first.preview.manifest)
+
+    def test_materials_are_only_queued_with_a_broker(self):
+        with mock.patch('elearning_platform.signals.process_material') as task:
+            # (eager tasks would run, and start the pool, in the web process)
+            material = self.create_material('a.txt', b'text')
+            task.delay.assert_not_called()
+            with self.settings(CELERY_TASK_ALWAYS_EAGER=False), mock.patch(
+                    'elearning_platform.signals.deliver_material_notifications'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    queued = MaterialFactory(course=self.course,
+                                             creator=self.teacher)
+            task.delay.assert_called_once_with(queued.material_id)
+        self.assertEqual(material.preview.status, 'processed')
+
+    def test_command_processes_materials_in_pool(self):
+        material = MaterialFactory(
+            course=self.course, creator=self.teacher, material_name='a.zip',
+            material_path=material_storage.save(
+                'materials/a.zip', ContentFile(self.zip_content({'a.txt': 'a'}))))
+        self.addCleanup(shutdown_executor)
+        out = StringIO()
+        with self.settings(MATERIAL_PROCESSING_WORKERS=2):
+            call_command('process_materials', stdout=out)
+        self.assertIn('Processed 1 materials', out.getvalue())
+        self.assertEqual(MaterialPreview.objects.get(
+            material=material).entry_count, 1)
+
+
+"""
+WebSocket Consumer Tests
+"""
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+                   CHAT_FLUSH_BATCH_SIZE=3, CHAT_FLUSH_INTERVAL=60,
+                   CHAT_HISTORY_SIZE=2)
+class ChatConsumerTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.application = URLRouter(websocket_urlpatterns)
+        # fresh per-process chat store for every test
+        self.store = ChatStore()
+        patcher = mock.patch('elearning_platform.consumers.chat_store',
+                             self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ws_counters.clear()
+
+    def connect(self, room='testroom', user=None):
+        communicator = WebsocketCommunicator(
+            self.application, f'/ws/live_chat/{room}/')
+        communicator.scope['user'] = user or self.user
+        return communicator
+
+    @async_to_sync
+    async def test_messages_are_flushed_in_batches(self):
+        communicator = self.connect()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for number in range(2):
+            await communicator.send_json_to({'message': f'message {number}'})
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'message': f'message {number}'})
+        # below the batch size nothing is written yet
+        self.assertEqual(await database_sync_to_async(Chat.objects.count)(), 0)
+        await communicator.send_json_to({'message': 'message 2'})
+        await communicator.receive_json_from()
+        self.assertEqual(await database_sync_to_async(
+            Chat.objects.filter(room='testroom', user=self.user).count)(), 3)
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_messages_that_are_not_text_are_rejected(self):
+        communicator = self.connect()
+        await communicator.connect()
+        for message in ['first', None, {'text': 'nested'}, 'second', 'third']:
+            await communicator.send_json_to({'message': message})
+            if isinstance(message, str):
+                self.assertEqual(await communicator.receive_json_from(),
+                                 {'message': message})
+        # the batch holds the valid messages only and is written
+        self.assertEqual(await database_sync_to_async(list)(
+            Chat.objects.order_by('message_id').values_list(
+                'message', flat=True)), ['first', 'second', 'third'])
+        self.assertEqual(ws_counters['chat_invalid'], 2)
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_failed_insert_keeps_the_batch(self):
+        for message in ['kept 1', 'kept 2']:
+            await self.store.add_message('testroom', self.user, message)
+        with mock.patch.object(Chat.objects, 'bulk_create',
+                               side_effect=IntegrityError('failed')), \
+                contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(await self.store.flush('testroom'), 0)
+        self.assertEqual(await self.store.flush('testroom'), 2)
+        self.assertEqual(await database_sync_to_async(Chat.objects.count)(), 2)
+
+    @async_to_sync
+    async def test_buffered_messages_keep_their_sending_time(self):
+        sent_at = timezone.now() - timezone.timedelta(seconds=30)
+        with mock.patch('elearning_platform.chat.timezone.now',
+                        return_value=sent_at):
+            await self.store.add_message('testroom', self.user, 'early')
+        await self.store.flush('testroom')
+        chat = await database_sync_to_async(Chat.objects.get)(message='early')
+        self.assertEqual(chat.sent_at, sent_at)
+
+    @async_to_sync
+    async def test_disconnect_flushes_pending_messages(self):
+        communicator = self.connect()
+        await communicator.connect()
+        await communicator.send_json_to({'message': 'bye'})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        self.assertEqual(await database_sync_to_async(
+            Chat.objects.filter(room='testroom', message='bye').count)(), 1)
+
+    @async_to_sync
+    async def test_late_joiner_receives_recent_history(self):
+        await database_sync_to_async(Chat.objects.create)(
+            user=self.user, room='testroom', message='stored message')
+        first = self.connect()
+        await first.connect()
+        self.assertEqual(await first.receive_json_from(),
+                         {'message': 'stored message'})
+        for message in ['live 1', 'live 2']:
+            await first.send_json_to({'message': message})
+            await first.receive_json_from()
+
+        # ring buffer keeps the last CHAT_HISTORY_SIZE messages
+        second = self.connect()
+        await second.connect()
+        self.assertEqual(await second.receive_json_from(), {'message': 'live 1'})
+        self.assertEqual(await second.receive_json_from(), {'message': 'live 2'})
+        self.assertTrue(await second.receive_nothing())
+        await first.disconnect()
+        await second.disconnect()
+
+    def test_history_api_lists_room_messages(self):
+        Chat.objects.create(user=self.user, room='testroom', message='hi')
+        Chat.objects.create(user=self.user, room='other', message='other')
+        self.client.login(username=self.user.username, password='password')
+        response = self.client.get(
+            reverse('api_chat_history', kwargs={'room_name': 'testroom'}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['message'] for row in response.data['results']],
+                         ['hi'])
+
+    @async_to_sync
+    async def test_anonymous_socket_is_rejected(self):
+        communicator = self.connect(user=AnonymousUser())
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(ws_counters['chat_rejected'], 1)
+
+    @override_settings(CHAT_MAX_MESSAGE_SIZE=50)
+    @async_to_sync
+    async def test_oversized_frame_is_refused(self):
+        communicator = self.connect()
+        await communicator.connect()
+        await communicator.send_json_to({'message': 'x' * 100})
+        response = await communicator.receive_json_from()
+        self.assertIn('error', response)
+        self.assertEqual(ws_counters['chat_oversized'], 1)
+        self.assertEqual(len(self.store.pending.get('testroom', [])), 0)
+        await communicator.disconnect()
+
+    @override_settings(CHAT_RATE_LIMIT=0, CHAT_RATE_BURST=2)
+    @async_to_sync
+    async def test_frames_over_the_rate_limit_are_throttled(self):
+        communicator = self.connect()
+        await communicator.connect()
+        for number in range(3):
+            await communicator.send_json_to({'message': f'message {number}'})
+        responses = [await communicator.receive_json_from() for _ in range(3)]
+        # the error frame does not go through the channel layer, so it may
+        # arrive before the relayed messages
+        self.assertCountEqual(
+            [response.get('message') for response in responses],
+            ['message 0', 'message 1', None])
+        self.assertEqual(sum('error' in response for response in responses), 1)
+        self.assertEqual(ws_counters['chat_throttled'], 1)
+        await communicator.disconnect()
+
+    def test_token_bucket_refills_over_time(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        now[0] = 0.5
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_outbound_queue_drops_oldest_frames(self):
+        queue = OutboundQueue(2)
+        for number in range(5):
+            queue.put({'message': number})
+        self.assertEqual(list(queue.items),
+                         [{'message': 3}, {'message': 4}])
+        self.assertEqual(queue.take_dropped(), 3)
+        self.assertEqual(queue.take_dropped(), 0)
+        self.assertEqual(ws_counters['chat_dropped'], 3)
+
+    def test_stats_api_requires_staff(self):
+        ws_counters['chat_throttled'] += 2
+        self.client.login(username=self.user.username, password='password')
+        url = reverse('api_websocket_stats')
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['chat_throttled'], 2)
+
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+                   WS_HEARTBEAT_INTERVAL=0.05, WS_HEARTBEAT_MISSES=2)
+class WebSocketHeartbeatTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.application = URLRouter(websocket_urlpatterns)
+        ws_counters.clear()
+
+    def connect(self, path):
+        communicator = WebsocketCommunicator(self.application, path)
+        communicator.scope['user'] = self.user
+        return communicator
+
+    @async_to_sync
+    async def test_answered_pings_keep_the_socket(self):
+        communicator = self.connect('/ws/notifications/')
+        await communicator.connect()
+        for _ in range(4):
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'type': 'ping'})
+            await communicator.send_to(text_data=PONG_FRAME)
+        self.assertEqual(ws_counters['connections_live'], 1)
+        await communicator.disconnect()
+        self.assertEqual(ws_counters['connections_live'], 0)
+        self.assertEqual(ws_counters['connections_reaped'], 0)
+
+    @async_to_sync
+    async def test_silent_socket_is_reaped_and_leaves_its_group(self):
+        communicator = self.connect('/ws/notifications/')
+        await communicator.connect()
+        layer = get_channel_layer()
+        group = f'notifications_{self.user.id}'
+        self.assertEqual(len(layer.groups[group]), 1)
+        for _ in range(2):
+            await communicator.receive_json_from()
+        closed = await communicator.receive_output()
+        self.assertEqual(closed, {'type': 'websocket.close',
+                                  'code': CLOSE_HEARTBEAT_MISSED})
+        self.assertFalse(layer.groups.get(group))
+        self.assertEqual(ws_counters['connections_live'], 0)
+        self.assertEqual(ws_counters['connections_reaped'], 1)
+        await communicator.disconnect()
+        self.assertEqual(ws_counters['connections_live'], 0)
+
+    @async_to_sync
+    async def test_pongs_are_not_chat_messages(self):
+        communicator = self.connect('/ws/live_chat/heartbeat/')
+        await communicator.connect()
+        await communicator.send_to(text_data=PONG_FRAME)
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'ping'})
+        self.assertEqual(ws_counters['chat_invalid'], 0)
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+                   WS_HEARTBEAT_INTERVAL=0, CHAT_HISTORY_SIZE=2)
+class MultiplexConsumerTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory()
+        self.application = URLRouter(websocket_urlpatterns)
+        self.store = ChatStore()
+        patcher = mock.patch('elearning_platform.consumers.chat_store',
+                             self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ws_counters.clear()
+
+    def connect(self, path='/ws/', user=None):
+        communicator = WebsocketCommunicator(self.application, path)
+        communicator.scope['user'] = user or self.user
+        return communicator
+
+    @async_to_sync
+    async def test_one_socket_carries_notifications_and_rooms(self):
+        communicator = self.connect()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for topic in ['notifications', 'chat:first', 'chat:second']:
+            await communicator.send_json_to(
+                {'topic': topic, 'action': 'subscribe'})
+        await communicator.send_json_to({'topic': 'chat:second',
+                                         'message': 'hello'})
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'topic': 'chat:second', 'message': 'hello'})
+        layer = get_channel_layer()
+        await layer.group_send(f'notifications_{self.user.id}', {
+            'type': 'send_notification', 'message': 'graded',
+            'unread_count': 1})
+        self.assertEqual(await communicator.receive_json_from(), {
+            'topic': 'notifications', 'message': 'graded', 'unread_count': 1})
+        for group in [f'notifications_{self.user.id}', 'live_chat_first',
+                      'live_chat_second']:
+            self.assertEqual(len(layer.groups[group]), 1)
+        await communicator.disconnect()
+        self.assertFalse(layer.groups.get('live_chat_first'))
+        self.assertEqual(await database_sync_to_async(
+            Chat.objects.filter(room='second', message='hello').count)(), 1)
+
+    @async_to_sync
+    async def test_rooms_are_shared_with_legacy_sockets(self):
+        await database_sync_to_async(Chat.objects.create)(
+            user=self.user, room='shared', message='stored message')
+        multiplexed = self.connect()
+        await multiplexed.connect()
+        await multiplexed.send_json_to({'topic': 'chat:shared',
+                                        'action': 'subscribe'})
+        self.assertEqual(await multiplexed.receive_json_from(),
+                         {'topic': 'chat:shared', 'message': 'stored message'})
+        legacy = self.connect('/ws/live_chat/shared/')
+        await legacy.connect()
+        await legacy.receive_json_from()
+        await legacy.send_json_to({'message': 'from legacy'})
+        self.assertEqual(await multiplexed.receive_json_from(),
+                         {'topic': 'chat:shared', 'message': 'from legacy'})
+        await multiplexed.send_json_to({'topic': 'chat:shared',
+                                        'message': 'from multiplexed'})
+        self.assertEqual(await legacy.receive_json_from(),
+                         {'message': 'from legacy'})
+        self.assertEqual(await legacy.receive_json_from(),
+                         {'message': 'from multiplexed'})
+        await legacy.disconnect()
+        await multiplexed.disconnect()
+
+    @override_settings(WS_MAX_SUBSCRIPTIONS=1)
+    @async_to_sync
+    async def test_unknown_and_extra_topics_are_refused(self):
+        communicator = self.connect()
+        await communicator.connect()
+        await communicator.send_json_to({'topic': 'grades',
+                                         'action': 'subscribe'})
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'topic': 'grades', 'error': 'Unknown topic.'})
+        await communicator.send_json_to({'topic': 'chat:one',
+                                         'action': 'subscribe'})
+        await communicator.send_json_to({'topic': 'chat:two',
+                                         'action': 'subscribe'})
+        self.assertEqual(await communicator.receive_json_from(), {
+            'topic': 'chat:two', 'error': 'Too many subscriptions.'})
+        # unsubscribed rooms are neither received nor sent to
+        await communicator.send_json_to({'topic': 'chat:one',
+                                         'action': 'unsubscribe'})
+        await communicator.send_json_to({'topic': 'chat:one',
+                                         'message': 'lost'})
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertFalse(get_channel_layer().groups.get('live_chat_one'))
+        self.assertEqual(ws_counters['chat_invalid'], 1)
+        await communicator.disconnect()
+
+    @async_to_sync
+    async def test_frames_encoded_by_the_sender_are_forwarded(self):
+        multiplexed = self.connect()
+        await multiplexed.connect()
+        await multiplexed.send_json_to({'topic': 'chat:encoded',
+                                        'action': 'subscribe'})
+        legacy = self.connect('/ws/live_chat/encoded/')
+        await legacy.connect()
+        await legacy.send_json_to({'message': 'caf\u00e9'})
+        # members send the sender's text as it is
+        self.assertEqual(await legacy.receive_from(),
+                         '{"message": "caf\\u00e9"}')
+        self.assertEqual(await multiplexed.receive_from(),
+                         '{"topic": "chat:encoded", "message": "caf\\u00e9"}')
+        # the event carries the message once, as the encoded frame
+        event = chat_event('encoded', None, 'once')
+        self.assertNotIn('message', event)
+        await get_channel_layer().group_send('live_chat_encoded', {
+            **event, 'frame': '{"message":"pre-encoded"}'})
+        self.assertEqual(await legacy.receive_from(),
+                         '{"message":"pre-encoded"}')
+        self.assertEqual(await multiplexed.receive_from(),
+                         '{"topic": "chat:encoded", "message":"pre-encoded"}')
+        # events of the previous release are encoded by each member
+        await get_channel_layer().group_send('live_chat_encoded', {
+            'type': 'chat_message', 'message': 'raw'})
+        self.assertEqual(await legacy.receive_json_from(), {'message': 'raw'})
+        self.assertEqual(await multiplexed.receive_json_from(),
+                         {'topic': 'chat:encoded', 'message': 'raw'})
+        # (their room is unknown once the socket follows several)
+        await multiplexed.send_json_to({'topic': 'chat:other',
+                                        'action': 'subscribe'})
+        await get_channel_layer().group_send('live_chat_encoded', {
+            'type': 'chat_message', 'message': 'raw'})
+        self.assertEqual(await legacy.receive_json_from(), {'message': 'raw'})
+        self.assertTrue(await multiplexed.receive_nothing())
+        self.assertEqual(ws_counters['chat_unrouted'], 1)
+        await legacy.disconnect()
+        await multiplexed.disconnect()
+
+    @async_to_sync
+    async def test_anonymous_sockets_are_refused(self):
+        communicator = self.connect(user=AnonymousUser())
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(ws_counters['multiplex_rejected'], 1)
+
+
+# accepts every socket, standing in for the consumers
+
+
+class AcceptingConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        await self.accept()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class WebSocketAdmissionTest(TestCase):
+
+    def setUp(self):
+        ws_counters.clear()
+        self.now = [0.0]
+
+    def make_application(self):
+        self.admission = ConnectionAdmission(
+            clock=lambda: self.now[0], rng=random.Random(0))
+        return AdmissionMiddleware(
+            URLRouter([re_path(r'ws/test/$', AcceptingConsumer.as_asgi())]),
+            self.admission)
+
+    # (close code, retry delay) of a refused handshake
+    async def refusal(self, communicator):
+        await communicator.connect()
+        frame = await communicator.receive_json_from()
+        closed = await communicator.receive_output()
+        return closed['code'], frame['retry_after']
+
+    @override_settings(WS_MAX_CONNECTIONS=2)
+    @async_to_sync
+    async def test_sockets_over_the_cap_are_refused(self):
+        application = self.make_application()
+        # (a communicator starts its handshake when it is created)
+        first, second, third = [
+            WebsocketCommunicator(application, '/ws/test/') for _ in range(3)]
+        self.assertTrue((await first.connect())[0])
+        self.assertTrue((await second.connect())[0])
+        code, retry_after = await self.refusal(third)
+        self.assertEqual(code, CLOSE_SERVER_FULL)
+        self.assertTrue(5 <= retry_after <= 10)
+        # a closed socket frees its place
+        await first.disconnect()
+        fourth = WebsocketCommunicator(application, '/ws/test/')
+        self.assertTrue((await fourth.connect())[0])
+        # admitted, not accepted to be told to retry
+        self.assertTrue(await fourth.receive_nothing())
+        self.assertEqual(self.admission.open, 2)
+        self.assertEqual(ws_counters['connections_refused'], 1)
+        await second.disconnect()
+        await fourth.disconnect()
+
+    @override_settings(WS_HANDSHAKE_RATE=100, WS_HANDSHAKE_BURST=500,
+                       WS_MAX_CONNECTIONS=20000, WS_RETRY_MAX_DELAY=120)
+    @async_to_sync
+    async def test_reconnect_storm_is_spread_at_the_handshake_rate(self):
+        application = self.make_application()
+        communicators = [WebsocketCommunicator(application, '/ws/test/')
+                         for _ in range(10000)]
+        # every client reconnects at the same instant
+        results = await asyncio.gather(*[
+            communicator.connect(timeout=30) for communicator in communicators])
+        self.assertTrue(all(connected for connected, _ in results))
+        # (refused sockets are accepted, then told when to retry)
+        await asyncio.sleep(0.1)
+        admitted = []
+        refused = []
+        for communicator in communicators:
+            if await communicator.receive_nothing(timeout=0):
+                admitted.append(communicator)
+                continue
+            frame = await communicator.receive_json_from()
+            closed = await communicator.receive_output()
+            self.assertEqual(closed['code'], CLOSE_HANDSHAKE_THROTTLED)
+            refused.append(frame['retry_after'])
+        self.assertEqual(len(admitted), 500)
+        self.assertEqual(len(refused), 9500)
+        self.assertEqual(self.admission.open, 500)
+        self.assertEqual(ws_counters['handshakes_throttled'], 9500)
+        # retries are spread at about 100 per second, within the maximum
+        self.assertLessEqual(max(refused), 120)
+        per_second = Counter(int(delay) for delay in refused)
+        self.assertLessEqual(max(per_second.values()), 2 * 100)
+        # coming back at the suggested times, nearly all are admitted
+        readmitted = 0
+        for delay in sorted(refused):
+            self.now[0] = delay
+            if self.admission.admit() is None:
+                readmitted += 1
+        self.assertGreater(readmitted, 0.95 * 9500)
+        await asyncio.gather(*[communicator.disconnect()
+                               for communicator in admitted])
+
+
+class WebSocketAuthTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        ws_counters.clear()
+        self.user = UserFactory()
+        self.user.groups.add(Group.objects.create(name='student'))
+        self.now = [1000.0]
+        self.cache = SessionUserCache(clock=lambda: self.now[0])
+        patcher = mock.patch('elearning_platform.websocket_auth.session_user_cache',
+                             self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = []
+
+        # records the user of each handshake and refuses it
+        async def application(scope, receive, send):
+            self.users.append(scope['user'])
+            await receive()
+            await send({'type': 'websocket.close'})
+        self.application = CachedAuthMiddlewareStack(application)
+
+    def login(self, client=None):
+        client = client or self.client
+        client.login(username=self.user.username, password='password')
+        return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+    def handshake(self, session_key=None):
+        async_to_sync(self._handshake)(session_key)
+        return self.users[-1]
+
+    # the communicator starts the application, it needs the event loop
+    async def _handshake(self, session_key):
+        headers = []
+        if session_key:
+            headers = [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode())]
+        communicator = WebsocketCommunicator(
+            self.application, '/ws/notifications/', headers=headers)
+        await communicator.connect()
+
+    def test_handshakes_of_a_session_share_the_cached_user(self):
+        session_key = self.login()
+        with mock.patch('elearning_platform.websocket_auth.load_session_user',
+                        wraps=load_session_user) as load:
+            first = self.handshake(session_key)
+            second = self.handshake(session_key)
+        self.assertEqual(first, self.user)
+        self.assertIs(second, first)
+        self.assertEqual(load.call_count, 1)
+        # roles were loaded with the user
+        with self.assertNumQueries(0):
+            self.assertTrue(has_role(second, 'student'))
+        self.assertEqual(ws_counters['auth_cache_hits'], 1)
+
+    def test_unknown_sessions_are_anonymous(self):
+        self.assertFalse(self.handshake().is_authenticated)
+        self.assertFalse(self.handshake('not-a-session').is_authenticated)
+
+    def test_logout_and_password_change_revoke_sessions(self):
+        session_key = self.login()
+        self.handshake(session_key)
+        self.client.logout()
+        self.assertFalse(self.handshake(session_key).is_authenticated)
+
+        other_key = self.login(Client())
+        self.assertTrue(self.handshake(other_key).is_authenticated)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertFalse(self.handshake(other_key).is_authenticated)
+
+    def test_changes_made_by_other_workers_are_seen(self):
+        session_key = self.login()
+        first = self.handshake(session_key)
+        # another worker revoked the user: only the shared cache knows
+        self.now[0] += 1
+        cache.set(revoked_key(self.user.pk), self.now[0])
+        second = self.handshake(session_key)
+        self.assertIsNot(second, first)
+        # roles changed elsewhere
+        invalidate_user_roles([self.user.pk])
+        self.assertIsNot(self.handshake(session_key), second)
+        self.assertEqual(ws_counters['auth_cache_misses'], 3)
+
+    def test_shared_cache_is_read_off_the_event_loop(self):
+        session_key = self.login()
+        self.handshake(session_key)
+        on_loop = []
+
+        def recording(method):
+            def read(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    on_loop.append(True)
+                except RuntimeError:
+                    on_loop.append(False)
+                return method(*args, **kwargs)
+            return read
+        # (on the backend class: cache connections are per thread)
+        backend = type(caches['default'])
+        with mock.patch.object(backend, 'get_many',
+                               recording(backend.get_many)), \
+                mock.patch.object(backend, 'get', recording(backend.get)):
+            self.assertEqual(self.handshake(session_key), self.user)
+        self.assertTrue(on_loop)
+        self.assertNotIn(True, on_loop)
+        self.assertEqual(ws_counters['auth_cache_hits'], 1)
+
+    @override_settings(WS_AUTH_CACHE_SIZE=1, WS_AUTH_CACHE_TTL=10)
+    def test_lru_eviction_and_expiry(self):
+        session_key = self.login()
+        other_key = self.login(Client())
+        self.handshake(session_key)
+        self.handshake(other_key)
+        self.assertEqual(list(self.cache.entries), [other_key])
+        self.now[0] += 11
+        self.handshake(other_key)
+        self.assertEqual(ws_counters['auth_cache_misses'], 3)
+
+"""
+Benchmark Harness Tests
+"""
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BenchmarkTest(TestCase):
+
+    def test_small_benchmark_run_reports_every_measurement(self):
+        # (inside the test transaction the fan-out runs once the block exits)
+        with self.captureOnCommitCallbacks(execute=True):
+            results = run_benchmark(
+                users=60, courses=4, enrollments_per_course=3, fanout=20,
+                notifications=200, requests=2, clients=3, messages=2,
+                serialize_rows=50, room_sizes=(2, 5))
+        # results are plain JSON
+        results = json.loads(json.dumps(results))
+        self.assertEqual(results['seed']['rows']['users'], 60)
+        self.assertEqual(results['seed']['rows']['notifications'], 200)
+        self.assertEqual(set(results['http']), {
+            'index_teacher', 'index_student', 'course_detail',
+            'api_search_users', 'user_notifications',
+            'upload_material_fanout'})
+        for name, timing in results['http'].items():
+            self.assertEqual(timing['count'], 2)
+            self.assertIn(timing['status'], (200, 302), name)
+        # both serializations give the same JSON
+        self.assertEqual(results['serialization']['notifications']['rows'], 50)
+        for name, timing in results['serialization'].items():
+            self.assertTrue(timing['identical'], name)
+        self.assertEqual(results['websocket']['chat']['dropped_frames'], 0)
+        self.assertEqual(results['websocket']['notifications']['clients'], 3)
+        self.assertEqual(set(results['broadcast']), {'2', '5'})
+        self.assertEqual(results['broadcast']['5']['members'], 5)
+        # the fan-out notified every student of the hot course per upload
+        self.assertEqual(Notification.objects.filter(
+            message__contains="added to the course").count(), 2 * 20)
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from django.conf import settings
+
+"""
+WebSocket flow control
+"""
+# every chat connection gets a token bucket limiting how fast it may send,
+# and a bounded outbound queue: when a receiver cannot keep up the oldest
+# waiting frames are dropped and the client is told how many it missed,
+# so one slow or noisy socket cannot grow the server's memory without bound.
+
+DEFAULT_CHAT_RATE_LIMIT = 5
+DEFAULT_CHAT_RATE_BURST = 10
+DEFAULT_CHAT_MAX_MESSAGE_SIZE = 4096
+DEFAULT_CHAT_OUTBOUND_QUEUE_SIZE = 100
+
+
+def get_ws_setting(name, default):
+    return getattr(settings, name, default)
+
+# 'rate' tokens per second, holding at most 'capacity' tokens
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated_at = clock()
+
+    def consume(self, tokens=1):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+# frames waiting to be written to one socket
+# when full the oldest frame is dropped; 'dropped' counts them until the
+# writer reports the gap to the client
+
+
+class OutboundQueue:
+    def __init__(self, maxsize, counter_name='chat_dropped'):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.counter_name = counter_name
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        if len(self.items) >= self.maxsize:
+            self.items.popleft()
+            self.dropped += 1
+            ws_counters[self.counter_name] += 1
+        self.items.append(item)
+        self.ready.set()
+
+    async def get(self):
+        while not self.items:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.items.popleft()
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+# per-process counters of rejected, throttled and dropped frames
+ws_counters = Counter()
+
+"""
+WebSocket admission control
+"""
+# after a restart every open page reconnects at once. Handshakes go through
+# a per-process token bucket (WS_HANDSHAKE_RATE per second, bursts of
+# WS_HANDSHAKE_BURST) and at most WS_MAX_CONNECTIONS sockets are open per
+# process. A refused socket is accepted only to be told when to come back
+# (a {"error", "retry_after"} frame, then close code 4429 or 4503) and is
+# closed before authentication or any consumer work. Throttled clients are
+# given retry times spread at the handshake rate (plus jitter), so a
+# reconnect storm comes back as a steady stream instead of a second storm.
+
+DEFAULT_WS_MAX_CONNECTIONS = 10000
+DEFAULT_WS_HANDSHAKE_RATE = 200
+DEFAULT_WS_HANDSHAKE_BURST = 400
+DEFAULT_WS_RETRY_DELAY = 5
+DEFAULT_WS_RETRY_MAX_DELAY = 60
+
+# close codes telling the client to retry after the suggested delay
+CLOSE_HANDSHAKE_THROTTLED = 4429
+CLOSE_SERVER_FULL = 4503
+
+
+class ConnectionAdmission:
+    def __init__(self, clock=time.monotonic, rng=None):
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.bucket = TokenBucket(
+            get_ws_setting('WS_HANDSHAKE_RATE', DEFAULT_WS_HANDSHAKE_RATE),
+            get_ws_setting('WS_HANDSHAKE_BURST', DEFAULT_WS_HANDSHAKE_BURST),
+            clock)
+        self.open = 0
+        # time of the latest retry handed to a throttled client
+        self.next_retry_at = 0
+
+    # None when the socket may open, else (close code, retry delay)
+    def admit(self):
+        max_delay = get_ws_setting('WS_RETRY_MAX_DELAY', DEFAULT_WS_RETRY_MAX_DELAY)
+        if self.open >= get_ws_setting('WS_MAX_CONNECTIONS',
+                                       DEFAULT_WS_MAX_CONNECTIONS):
+            ws_counters['connections_refused'] += 1
+            base = get_ws_setting('WS_RETRY_DELAY', DEFAULT_WS_RETRY_DELAY)
+            return CLOSE_SERVER_FULL, min(max_delay, self.rng.uniform(base, 2 * base))
+        if not self.bucket.consume():
+            ws_counters['handshakes_throttled'] += 1
+            # one retry slot per token, after those already handed out
+            now = self.clock()
+            spacing = 1 / self.bucket.rate if self.bucket.rate else max_delay
+            self.next_retry_at = max(now, self.next_retry_at) + spacing
+            delay = min(self.next_retry_at - now, max_delay - 1)
+            return CLOSE_HANDSHAKE_THROTTLED, delay + self.rng.uniform(0, 1)
+        self.open += 1
+        return None
+
+    def release(self):
+        self.open -= 1
+
+# ASGI middleware applying the admission of the process to websockets
+# (outermost, so refused sockets cost no session or user lookups)
+
+
+class AdmissionMiddleware:
+    def __init__(self, inner, admission=None):
+        self.inner = inner
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.inner(scope, receive, send)
+        admission = self.admission or get_connection_admission()
+        refusal = admission.admit()
+        if refusal is not None:
+            return await self.refuse(receive, send, *refusal)
+        try:
+            return await self.inner(scope, receive, send)
+        finally:
+            admission.release()
+
+    async def refuse(self, receive, send, code, delay):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': json.dumps({
+            'error': 'Server busy, retry later.',
+            'retry_after': round(delay, 3)})})
+        await send({'type': 'websocket.close', 'code': code})
+
+
+_connection_admission = None
+
+
+def get_connection_admission():
+    global _connection_admission
+    if _connection_admission is None:
+        _connection_admission = ConnectionAdmission()
+    return _connection_admission
@@ -0,0 +1,235 @@
+import hashlib
+import os
+from datetime import timedelta
+from .models import Material, MaterialUpload, MaterialUploadChunk
+from .blobs import release_material_file
+from .storage import material_storage
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+"""
+Chunked material uploads
+"""
+# large course files are sent as numbered chunks (init, put chunk N,
+# finalize) instead of one multipart POST. Each chunk is streamed straight
+# to storage while being hashed and is recorded in the upload's manifest,
+# so an interrupted transfer resumes with the missing chunks only.
+# Size and type limits are checked when the upload starts and again before
+# the Material row is created.
+
+DEFAULT_MATERIAL_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_MATERIAL_UPLOAD_MAX_SIZE = 500 * 1024 * 1024
+DEFAULT_MATERIAL_UPLOAD_EXTENSIONS = [
+    'pdf', 'zip', 'docx', 'pptx', 'xlsx', 'txt', 'png', 'jpg', 'jpeg']
+DEFAULT_MATERIAL_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# leading bytes expected for the file types that have a signature
+FILE_SIGNATURES = {
+    'pdf': (b'%PDF',),
+    'zip': (b'PK\x03\x04', b'PK\x05\x06'),
+    'docx': (b'PK\x03\x04',),
+    'pptx': (b'PK\x03\x04',),
+    'xlsx': (b'PK\x03\x04',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+}
+
+
+# chunks are plain files under MEDIA_ROOT, the joined file goes to the
+# (content-addressed) default storage
+chunk_storage = FileSystemStorage()
+
+
+def get_upload_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+def get_extension(file_name):
+    return os.path.splitext(file_name)[1].lstrip('.').lower()
+
+# checking the declared name and size of an upload
+
+
+def validate_upload(file_name, size):
+    extensions = get_upload_setting(
+        'MATERIAL_UPLOAD_EXTENSIONS', DEFAULT_MATERIAL_UPLOAD_EXTENSIONS)
+    if get_extension(file_name) not in extensions:
+        raise UploadRejected(
+            f"Only {', '.join(extensions)} files can be uploaded.")
+    max_size = get_upload_setting(
+        'MATERIAL_UPLOAD_MAX_SIZE', DEFAULT_MATERIAL_UPLOAD_MAX_SIZE)
+    if size <= 0 or size > max_size:
+        raise UploadRejected(
+            f'File size must be between 1 and {max_size} bytes.')
+
+
+def start_upload(course, creator, file_name, size):
+    file_name = os.path.basename(file_name)
+    validate_upload(file_name, size)
+    return MaterialUpload.objects.create(
+        course=course, creator=creator, file_name=file_name, size=size,
+        chunk_size=get_upload_setting(
+            'MATERIAL_UPLOAD_CHUNK_SIZE', DEFAULT_MATERIAL_UPLOAD_CHUNK_SIZE))
+
+
+def chunk_path(upload, index):
+    return f'material_uploads/{upload.upload_id}/{index:06d}.part'
+
+# file-like wrapper hashing and counting what is read through it
+# reading more than 'limit' bytes rejects the chunk
+
+
+class HashingReader:
+    def __init__(self, stream, limit=None):
+        self.stream = stream
+        self.limit = limit
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.stream.read(size) if self.stream is not None else b''
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise UploadRejected(f'Chunk is larger than {self.limit} bytes.')
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+# writing chunk 'index' from 'stream' and adding it to the manifest
+# putting the same chunk again replaces it
+
+
+def store_chunk(upload, index, stream):
+    if upload.material_id is not None:
+        raise UploadRejected('Upload is already finalized.')
+    if index >= upload.chunk_count:
+        raise UploadRejected(
+            f'Chunk index must be below {upload.chunk_count}.')
+    expected_size = upload.expected_chunk_size(index)
+    reader = HashingReader(stream, expected_size)
+    path = chunk_path(upload, index)
+    chunk_storage.delete(path)
+    try:
+        chunk_storage.save(path, File(reader, name=path))
+    except UploadRejected:
+        chunk_storage.delete(path)
+        raise
+    if reader.size != expected_size:
+        chunk_storage.delete(path)
+        raise UploadRejected(
+            f'Chunk {index} must be {expected_size} bytes, got {reader.size}.')
+    chunk = MaterialUploadChunk(upload=upload, index=index, size=reader.size,
+                                sha256=reader.hexdigest())
+    MaterialUploadChunk.objects.bulk_create(
+        [chunk], update_conflicts=True, unique_fields=['upload', 'index'],
+        update_fields=['size', 'sha256'])
+    return chunk
+
+
+def received_chunks(upload):
+    return list(upload.chunks.order_by('index').values_list('index', flat=True))
+
+# the stored chunks read back in order as one file
+
+
+class ChunkSequence:
+    def __init__(self, paths):
+        self.paths = iter(paths)
+        self.current = None
+
+    def read(self, size=-1):
+        while True:
+            if self.current is None:
+                path = next(self.paths, None)
+                if path is None:
+                    return b''
+                self.current = chunk_storage.open(path, 'rb')
+            data = self.current.read(size)
+            if data:
+                return data
+            self.current.close()
+            self.current = None
+
+
+def check_signature(upload):
+    signatures = FILE_SIGNATURES.get(get_extension(upload.file_name))
+    if not signatures:
+        return
+    with chunk_storage.open(chunk_path(upload, 0), 'rb') as first_chunk:
+        head = first_chunk.read(16)
+    if not head.startswith(signatures):
+        raise UploadRejected(
+            f'File content does not match its .{get_extension(upload.file_name)} extension.')
+
+# joining the chunks into the material file and creating the Material row
+# 'sha256' (optional) is the checksum computed by the client
+# content that is already stored is not written a second time
+
+
+def finalize_upload(upload, sha256=None):
+    if upload.material_id is not None:
+        return upload.material
+    missing = sorted(set(range(upload.chunk_count))
+                     - set(received_chunks(upload)))
+    if missing:
+        raise UploadRejected(f'Missing chunks: {missing}.')
+    validate_upload(upload.file_name, upload.size)
+    check_signature(upload)
+
+    paths = [chunk_path(upload, index) for index in range(upload.chunk_count)]
+    reader = HashingReader(ChunkSequence(paths))
+    name = material_storage.save(
+        'materials/' + material_storage.get_valid_name(upload.file_name),
+        File(reader, name=upload.file_name))
+    if reader.size != upload.size or (
+            sha256 and reader.hexdigest() != sha256.lower()):
+        release_material_file(name)
+        raise UploadRejected('Uploaded file does not match its checksum.')
+
+    try:
+        with transaction.atomic():
+            material = Material.objects.create(
+                course=upload.course, creator=upload.creator,
+                material_name=upload.file_name, material_path=name)
+            upload.sha256 = reader.hexdigest()
+            upload.material = material
+            upload.save(update_fields=['sha256', 'material'])
+    except BaseException:
+        # dropping the reference taken by the save
+        release_material_file(name)
+        raise
+    delete_chunks(upload)
+    return material
+
+
+def delete_chunks(upload):
+    for index in received_chunks(upload):
+        chunk_storage.delete(chunk_path(upload, index))
+    upload.chunks.all().delete()
+
+# dropping uploads never finalized within MATERIAL_UPLOAD_EXPIRY seconds
+
+
+def purge_expired_uploads(expiry=None):
+    if expiry is None:
+        expiry = get_upload_setting(
+            'MATERIAL_UPLOAD_EXPIRY', DEFAULT_MATERIAL_UPLOAD_EXPIRY)
+    expired = MaterialUpload.objects.filter(
+        material__isnull=True,
+        created_at__lt=timezone.now() - timedelta(seconds=expiry))
+    purged = 0
+    for upload in expired.iterator():
+        delete_chunks(upload)
+        upload.delete()
+        purged += 1
+    return purged
@@ -28,8 +28,20 @@ urlpatterns = [
     path('api/course/delete/<int:pk>/',
          api.DeleteCourseAPI.as_view(), name='api_delete_course'),
     path('material/upload/', views.upload_material, name='upload_material'),
+    path('material/<int:pk>/download/', views.download_material,
+         name='download_material'),
+    path('material/<int:pk>/thumbnail/', views.material_thumbnail,
+         name='material_thumbnail'),
     path('api/material/delete/<int:pk>/',
          api.DeleteMaterialAPI.as_view(), name='api_delete_material'),
+    path('api/material/uploads/', api.MaterialUploadStartAPI.as_view(),
+         name='api_material_upload_start'),
+    path('api/material/uploads/<uuid:upload_id>/', api.MaterialUploadAPI.as_view(),
+         name='api_material_upload'),
+    path('api/material/uploads/<uuid:upload_id>/chunks/<int:index>/',
+         api.MaterialUploadChunkAPI.as_view(), name='api_material_upload_chunk'),
+    path('api/material/uploads/<uuid:upload_id>/finalize/',
+         api.MaterialUploadFinalizeAPI.as_view(), name='api_material_upload_finalize'),
     path('add_course/', views.add_course_view, name='add_course'),
     path('api/add_course/', api.AddCourseAPI.as_view(), name='api_add_course'),
     path('course/enroll/<int:course_id>/',
@@ -46,5 +58,16 @@ urlpatterns = [
          name='user_notifications'),
     path('api/user/mark_notifications_as_read/', api.MarkNotificationsRead.as_view(),
          name='user_notifications_read'),
+    path('api/courses/', api.CourseListAPI.as_view(), name='api_list_courses'),
+    path('api/user/enrollments/', api.EnrollmentListAPI.as_view(),
+         name='api_list_enrollments'),
+    path('api/course/<int:pk>/feedback/', api.CourseFeedbackListAPI.as_view(),
+         name='api_list_course_feedback'),
+    path('api/user/notifications/', api.NotificationListAPI.as_view(),
+         name='api_list_notifications'),
+    path('api/live_chat/<str:room_name>/history/', api.ChatHistoryListAPI.as_view(),
+         name='api_chat_history'),
+    path('api/websocket/stats/', api.WebSocketStatsAPI.as_view(),
+         name='api_websocket_stats'),
 
 ]
@@ -1,17 +1,42 @@
 from .models import *
 from .forms import *
 from .permissions import group_required
+from .roles import has_role, get_primary_role
+from .pagination import paginate_keyset, InvalidCursor
+from .downloads import can_download_material, serve_material
+from .blobs import save_material
+from .catalog import catalog_excluding_enrolled
+from .fragments import get_course_version, get_catalog_version
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.contrib.auth.models import Group
-from django.views.generic import ListView, TemplateView, UpdateView, DetailView
+from django.views.generic import TemplateView, UpdateView, DetailView
 from django.views import View
+from django.utils.functional import SimpleLazyObject
+from django.db import IntegrityError, transaction
 
 
+# one page of a listing, the cursor is read from the 'param' query parameter
+
+
+def get_listing_page(request, queryset, field, param):
+    try:
+        return paginate_keyset(queryset, field, request.GET.get(param))
+    except InvalidCursor:
+        raise Http404('Invalid cursor')
+
+# the same page, only queried when the template uses it (not when it
+# comes from the fragment cache)
+
+
+def get_lazy_listing_page(request, queryset, field, param):
+    return SimpleLazyObject(
+        lambda: get_listing_page(request, queryset, field, param))
+
 # student & teacher: list notifications
 
 
@@ -21,11 +46,14 @@ class ListNotifications(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # get user's notifications
-        notifications = Notification.objects.filter(
-            user=self.request.user).order_by('-is_read', '-created_at')
-        context['unread_notifications'] = notifications.filter(is_read=False)
-        context['read_notifications'] = notifications.filter(is_read=True)
+        # get user's notifications, one page per read state
+        notifications = Notification.objects.filter(user=self.request.user)
+        context['unread_notifications'] = get_listing_page(
+            self.request, notifications.filter(is_read=False),
+            'created_at', 'unread')
+        context['read_notifications'] = get_listing_page(
+            self.request, notifications.filter(is_read=True),
+            'created_at', 'read')
         return context
 
 # teacher: search users page
@@ -49,11 +77,13 @@ class EnrollToCourse(View):
     def post(self, request, course_id):
         # capture previous URL
         course = get_object_or_404(Course, course_id=course_id)
-        # check if student already enrolled
-        if Enrollment.objects.filter(course=course, student=request.user).exists():
-            return HttpResponse("You are already enrolled in this course.", status=400)
         # create the enrollment
-        Enrollment.objects.create(course=course, student=request.user)
+        # (unique course + student constraint rejects a second enrollment)
+        try:
+            with transaction.atomic():
+                Enrollment.objects.create(course=course, student=request.user)
+        except IntegrityError:
+            return HttpResponse("You are already enrolled in this course.", status=400)
         # redirect or return success message
         return redirect('course_detail', pk=course.course_id)
 
@@ -77,16 +107,16 @@ class UserDetail(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.get_object()
+        user = self.object
         appUser = AppUser.objects.get(user=user)
         context['app_user'] = appUser
-        if user.groups.filter(name='student').exists():
+        if has_role(user, 'student'):
             # if user is a student get enrolled courses
             enrolled_courses = Course.objects.filter(enrollments__student=user)
             context['enrolled_courses'] = enrolled_courses
             context['is_student'] = True
             context['is_teacher'] = False
-        elif user.groups.filter(name='teacher').exists():
+        elif has_role(user, 'teacher'):
             # if user is a teacher get created courses
             created_courses = Course.objects.filter(creator=user)
             context['created_courses'] = created_courses
@@ -111,16 +141,44 @@ def upload_material(request):
             course = get_object_or_404(Course, course_id=course_id)
             user = request.user
             # create + save material object
-            material = Material.objects.create(
+            # (the file's reference is dropped if the row can't be saved)
+            material = save_material(Material(
                 course=course,
                 creator=user,
                 material_name=material_to_upload.name,
                 material_path=material_to_upload
-            )
-            material.save()
+            ))
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
     return HttpResponseRedirect('/')
 
+# student and teacher: download a course material
+# (see downloads.py for who may download and how the file is sent)
+
+
+@login_required
+def download_material(request, pk):
+    material = get_object_or_404(Material, pk=pk)
+    if not can_download_material(request.user, material):
+        return HttpResponse(status=403)
+    try:
+        return serve_material(request, material)
+    except FileNotFoundError:
+        raise Http404('Material file not found.')
+
+# student and teacher: thumbnail made by post-processing
+
+
+@login_required
+def material_thumbnail(request, pk):
+    preview = get_object_or_404(
+        MaterialPreview.objects.select_related('material').only(
+            'thumbnail', 'material'), pk=pk, thumbnail__isnull=False)
+    if not can_download_material(request.user, preview.material):
+        return HttpResponse(status=403)
+    response = HttpResponse(bytes(preview.thumbnail), content_type='image/jpeg')
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
+
 # teacher:  edit course
 
 
@@ -143,27 +201,51 @@ def search_users(request):
 
 
 # student and teacher: view course details and name of the creator
+# every related row is loaded with its user in one query per list
+# materials and enrollments are only queried when the cached body of the
+# page is out of date (see fragments.py)
+
+
 @method_decorator(login_required, name='dispatch')
 class CourseDetail(DetailView):
     model = Course
+    queryset = Course.objects.select_related('creator')
     context_object_name = 'course'
     template_name = 'elearning_platform/course/course_detail.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         course = context['course']
+        user = self.request.user
+        context['course_version'] = get_course_version(course.course_id)
         context['creator_name'] = f"{course.creator.first_name} {
             course.creator.last_name}"
-        context['materials'] = course.materials.all()
-        enrollments = Enrollment.objects.filter(course=course)
-        context['enrollments'] = enrollments
-        feedbacks = Feedback.objects.filter(course=course).order_by('-sent_at')
-        context['feedbacks'] = feedbacks
-        is_enrolled = enrollments.filter(student=self.request.user).exists()
-        context['is_enrolled'] = is_enrolled
+        # one page of each list, only queried on a fragment cache miss
+        context['materials'] = get_lazy_listing_page(
+            self.request, course.materials.select_related(
+                'creator', 'preview').defer('preview__text'),
+            'added_at', 'materials')
+        context['enrollments'] = get_lazy_listing_page(
+            self.request, course.enrollments.select_related('student'),
+            'enrolled_at', 'enrollments')
+        # teachers see all feedback, students only their own
+        feedbacks = course.feedbacks.select_related('user')
+        if has_role(user, 'teacher'):
+            pass
+        elif has_role(user, 'student'):
+            feedbacks = feedbacks.filter(user=user)
+        else:
+            feedbacks = feedbacks.none()
+        context['feedbacks'] = get_listing_page(
+            self.request, feedbacks, 'sent_at', 'feedback')
+        # only students enroll
+        context['is_enrolled'] = has_role(user, 'student') and \
+            course.enrollments.filter(student=user).exists()
         return context
 
 # student and teacher: list courses
+# every list is paginated on its own cursor parameter
+# course lists read the catalogue rows (creator name and counts included)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -173,22 +255,29 @@ class ListCourses(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
+        catalog = CourseCatalogEntry.objects.all()
         # full info of the logged user
         context['app_user'] = AppUser.objects.get(
             user=user)
+        context['catalog_version'] = get_catalog_version()
         # courses created by logged teacher
-        context['created_courses'] = Course.objects.filter(
-            creator=user)
+        context['created_courses'] = get_lazy_listing_page(
+            self.request, catalog.filter(creator=user),
+            'created_at', 'created')
         # courses not created by logged teacher
-        context['other_teachers_courses'] = Course.objects.exclude(
-            creator=user)
+        context['other_teachers_courses'] = get_lazy_listing_page(
+            self.request, catalog.exclude(creator=user),
+            'created_at', 'other')
         # courses student is enrolled in
-        context['enrolled_courses'] = Enrollment.objects.filter(
-            student=user)
+        context['enrolled_courses'] = get_lazy_listing_page(
+            self.request, Enrollment.objects.filter(
+                student=user).select_related('course__catalog_entry'),
+            'enrolled_at', 'enrolled')
 
         # courses student is not enrolled in
-        context['not_enrolled_courses'] = Course.objects.exclude(
-            enrollments__student=user)
+        context['not_enrolled_courses'] = get_lazy_listing_page(
+            self.request, catalog_excluding_enrolled(user),
+            'created_at', 'not_enrolled')
         return context
 
 # teacher: add new course
@@ -204,13 +293,15 @@ def add_course_view(request):
 
 @method_decorator(login_required, name='dispatch')
 @method_decorator(group_required('student'), name='dispatch')
-class ListStudentMoreCourses(ListView):
-    model = Course
+class ListStudentMoreCourses(TemplateView):
     template_name = 'elearning_platform/more_courses.html'
-    context_object_name = 'courses'
 
-    def get_queryset(self):
-        return Course.objects.exclude(enrollments__student=self.request.user)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['courses'] = get_listing_page(
+            self.request, catalog_excluding_enrolled(self.request.user),
+            'created_at', 'cursor')
+        return context
 
 # view live chat
 
@@ -228,11 +319,7 @@ def live_chat(request):
 def live_chat_room(request, room_name):
     print(f"Room Name: {room_name}")
     # determining what group the user is part of
-    user_group = None
-    if request.user.groups.filter(name='student').exists():
-        user_group = 'student'
-    elif request.user.groups.filter(name='teacher').exists():
-        user_group = 'teacher'
+    user_group = get_primary_role(request.user, 'student', 'teacher')
     # adding room name, current user and the the user's access group to context
     context = {
         'room_name': room_name,
@@ -0,0 +1,165 @@
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from .roles import get_role_cache_timeout, get_user_roles, role_cache_key
+from .throttling import ws_counters
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from channels.sessions import SessionMiddlewareStack
+
+"""
+WebSocket authentication
+"""
+# every page opens a websocket, so a handshake must not read the session
+# and user tables each time. Every worker keeps the users of recent session
+# keys (with their roles loaded) in an LRU map of at most
+# WS_AUTH_CACHE_SIZE sessions (0 disables it); sockets of the same session
+# share the cached user object for at most WS_AUTH_CACHE_TTL seconds (or
+# until the session expires). Logging out, changing the password or any
+# other save of the user revokes its entries: signals.py drops them from
+# this process and records the time in the shared cache, so other workers
+# reload them on their next handshake. Role changes are seen the same way
+# through the shared role cache of roles.py.
+
+DEFAULT_WS_AUTH_CACHE_SIZE = 10000
+DEFAULT_WS_AUTH_CACHE_TTL = 60
+
+
+def get_ws_auth_cache_size():
+    return getattr(settings, 'WS_AUTH_CACHE_SIZE', DEFAULT_WS_AUTH_CACHE_SIZE)
+
+
+def get_ws_auth_cache_ttl():
+    return getattr(settings, 'WS_AUTH_CACHE_TTL', DEFAULT_WS_AUTH_CACHE_TTL)
+
+
+def revoked_key(user_id):
+    return f'session_users_revoked:{user_id}'
+
+
+class SessionUserEntry:
+    def __init__(self, user, loaded_at, expires_at):
+        self.user = user
+        self.loaded_at = loaded_at
+        self.expires_at = expires_at
+
+
+class SessionUserCache:
+    def __init__(self, clock=time.time):
+        self.entries = OrderedDict()
+        self.clock = clock
+
+    def get(self, session_key):
+        entry = self.entries.get(session_key)
+        if entry is None:
+            return None
+        if self.clock() >= entry.expires_at:
+            del self.entries[session_key]
+            return None
+        self.entries.move_to_end(session_key)
+        return entry
+
+    # 'loaded_at' is when the user was read, revocations after it apply
+    def put(self, session_key, user, max_age, loaded_at):
+        self.entries[session_key] = SessionUserEntry(
+            user, loaded_at, self.clock() + min(max_age, get_ws_auth_cache_ttl()))
+        self.entries.move_to_end(session_key)
+        # evicting the least recently used sessions
+        while len(self.entries) > get_ws_auth_cache_size():
+            self.entries.popitem(last=False)
+
+    def discard_session(self, session_key):
+        self.entries.pop(session_key, None)
+
+    def discard_users(self, user_ids):
+        user_ids = set(user_ids)
+        for session_key in [key for key, entry in self.entries.items()
+                            if entry.user.pk in user_ids]:
+            del self.entries[session_key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+session_user_cache = SessionUserCache()
+
+
+def discard_cached_session(session_key):
+    session_user_cache.discard_session(session_key)
+
+# dropping the cached sessions of these users, here and in other workers
+
+
+def revoke_session_users(user_ids):
+    session_user_cache.discard_users(user_ids)
+    now = session_user_cache.clock()
+    cache.set_many({revoked_key(user_id): now for user_id in user_ids},
+                   get_ws_auth_cache_ttl())
+
+# user of a session, as django.contrib.auth.get_user() finds it for a
+# request (checking the password hash), with its roles loaded
+
+
+def load_session_user(session):
+    user = auth.get_user(SimpleNamespace(session=session))
+    get_user_roles(user)
+    return user, session.get_expiry_age()
+
+# checking a cached user against revocations and role changes recorded in
+# the shared cache (a single cache round trip, off the event loop); False
+# when it must be loaded again
+
+
+async def is_entry_current(entry):
+    user = entry.user
+    if not user.is_authenticated:
+        return True
+    keys = [revoked_key(user.pk)]
+    if get_role_cache_timeout():
+        keys.append(role_cache_key(user.pk))
+    found = await cache.aget_many(keys)
+    revoked_at = found.get(revoked_key(user.pk))
+    if revoked_at is not None and revoked_at >= entry.loaded_at:
+        return False
+    # roles dropped by roles.invalidate_user_roles()
+    return len(keys) == 1 or role_cache_key(user.pk) in found
+
+
+async def get_session_user(scope):
+    session_key = scope['cookies'].get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return AnonymousUser()
+    if get_ws_auth_cache_size() > 0:
+        entry = session_user_cache.get(session_key)
+        if entry is not None:
+            if await is_entry_current(entry):
+                ws_counters['auth_cache_hits'] += 1
+                return entry.user
+            session_user_cache.discard_session(session_key)
+    ws_counters['auth_cache_misses'] += 1
+    loaded_at = session_user_cache.clock()
+    user, max_age = await database_sync_to_async(load_session_user)(
+        scope['session'])
+    if get_ws_auth_cache_size() > 0:
+        session_user_cache.put(session_key, user, max_age, loaded_at)
+    return user
+
+# sets scope['user'] like channels' AuthMiddleware, through the cache
+# (needs the cookies and session of SessionMiddlewareStack)
+
+
+class CachedAuthMiddleware(BaseMiddleware):
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        if 'user' not in scope:
+            scope['user'] = await get_session_user(scope)
+        return await super().__call__(scope, receive, send)
+
+
+def CachedAuthMiddlewareStack(inner):
+    return SessionMiddlewareStack(CachedAuthMiddleware(inner))